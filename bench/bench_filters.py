@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Benchmark the stages of the lupbook filters on a book (by default, a synthetic
+book from `gen_book.py`), and compare results against a stored baseline
+"""
+
+import argparse
+import contextlib
+import copy
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+LBDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(LBDIR, "pandoc"))
+
+import panflute
+
+import gen_book
+import lupbook_build
+import lupbook_cache
+import lupbook_filter
+import lupbook_registry
+import toc_filter
+
+# Format of the results, bumped when incompatible
+RESULTS_VERSION = 1
+
+# Default relative slowdown of a stage considered as a regression
+DEFAULT_THRESHOLD = 0.10
+
+@contextlib.contextmanager
+def _in_dir(path):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+#
+# Stages
+#
+
+class _Book:
+    """ Parsed book, with its activities """
+    def __init__(self, book_dir, pandoc):
+        self.dir = book_dir
+        self.pandoc = pandoc
+        self.sources = lupbook_build.default_sources(book_dir)
+        self.doc = lupbook_build.read_book(self.sources, None, book_dir, pandoc)
+
+        self.activities = []
+        def collect(element, doc):
+            if isinstance(element, panflute.CodeBlock) and element.classes:
+                cls = lupbook_registry.get_activity(element.classes[0])
+                if cls is not None:
+                    self.activities.append((cls, element.text))
+        self.doc.walk(collect)
+
+def _load_yaml(text):
+    loader = lupbook_filter.LupbookLoader(text)
+    try:
+        return loader.get_single_data()
+    finally:
+        loader.dispose()
+
+def _stage_yaml(book):
+    def run():
+        # Start from a cold include cache, as a one-shot build would
+        lupbook_filter.include_cache = lupbook_cache.IncludeCache()
+        for _, text in book.activities:
+            _load_yaml(text)
+    return run
+
+def _stage_validation(book):
+    confs = [(cls, _load_yaml(text)) for cls, text in book.activities]
+    def run():
+        # Validation fills in defaults, so validate pristine copies
+        todo = [(cls, copy.deepcopy(conf)) for cls, conf in confs]
+        start = time.perf_counter()
+        for cls, conf in todo:
+            cls._yaml_validator().validate(conf)
+        return time.perf_counter() - start
+    return run
+
+def _stage_markdown(book):
+    batch = lupbook_filter.MarkdownBatch()
+    for cls, text in book.activities:
+        cls(text).process(batch)
+    fragments = batch.fragments
+    def run():
+        batch = lupbook_filter.MarkdownBatch()
+        for text in fragments:
+            batch.add(text)
+        batch.convert()
+    return run
+
+def _stage_render(book):
+    activities = [cls(text) for cls, text in book.activities]
+    def run():
+        batch = lupbook_filter.MarkdownBatch()
+        for activity in activities:
+            activity.process(batch)
+    return run
+
+def _stage_toc(book):
+    headers = []
+    book.doc.walk(lambda e, d: headers.append(e)
+                  if isinstance(e, panflute.Header) else None)
+    def run():
+        toc_filter._prepare_toc_filter(book.doc)
+        for header in headers:
+            toc_filter._process_toc_filter(header, book.doc)
+        toc_filter._finalize_toc_filter(book.doc)
+    return run
+
+def _stage_pandoc(book):
+    def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            subprocess.run([book.pandoc, "-o", os.path.join(tmp, "book.html"),
+                            "-V", f"lbdir={LBDIR}", "--standalone",
+                            "--section-divs", "--template", "template.html",
+                            "--filter", os.path.join(LBDIR, "pandoc",
+                                                     "book_filter.py"),
+                            *book.sources],
+                           cwd = book.dir, check = True,
+                           env = { **os.environ, "LUPBOOK_NO_CACHE": "1" })
+    return run
+
+STAGES = { "yaml": _stage_yaml,
+          "validation": _stage_validation,
+          "markdown": _stage_markdown,
+          "render": _stage_render,
+          "toc": _stage_toc,
+          "pandoc": _stage_pandoc }
+
+def _time(run, repeat):
+    """ Time function `repeat` times (it may return its own timing) """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        elapsed = run()
+        if elapsed is None:
+            elapsed = time.perf_counter() - start
+        times.append(elapsed)
+    return { "min": min(times), "median": statistics.median(times),
+            "runs": times }
+
+def run_bench(book_dir, stages = None, repeat = 5, pandoc = "pandoc"):
+    """ Benchmark stages of the filters on book, return results """
+    stages = stages or list(STAGES)
+    book = _Book(book_dir, pandoc)
+
+    results = {}
+    with _in_dir(book_dir):
+        for name in stages:
+            results[name] = _time(STAGES[name](book), repeat)
+            sys.stderr.write(f"{name:>12}: {results[name]['min'] * 1000:9.2f} ms\n")
+
+    version = subprocess.run([pandoc, "--version"], stdout = subprocess.PIPE,
+                             check = True).stdout.decode().splitlines()[0]
+    return { "version": RESULTS_VERSION,
+            "book": { "sources": len(book.sources),
+                     "activities": len(book.activities) },
+            "environment": { "python": platform.python_version(),
+                            "pandoc": version,
+                            "machine": platform.machine() },
+            "repeat": repeat,
+            "stages": results }
+
+#
+# Comparison
+#
+
+def compare(baseline, results, threshold = DEFAULT_THRESHOLD):
+    """
+    Compare best timings of each stage against baseline, return list of
+    regressed stages
+    """
+    if baseline["book"] != results["book"]:
+        sys.stderr.write("Warning: baseline was measured on a different book\n")
+
+    regressions = []
+    print(f"{'stage':>12} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, base in baseline["stages"].items():
+        if name not in results["stages"]:
+            continue
+        cur = results["stages"][name]
+        change = cur["min"] / base["min"] - 1 if base["min"] else 0
+        regressed = change > threshold
+        if regressed:
+            regressions.append(name)
+        print(f"{name:>12} {base['min'] * 1000:9.2f} ms {cur['min'] * 1000:9.2f} ms"
+              f" {change:+7.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+#
+# Command-line interface
+#
+
+def _cmd_run(args):
+    with contextlib.ExitStack() as stack:
+        book_dir = args.book
+        if book_dir is None:
+            book_dir = stack.enter_context(tempfile.TemporaryDirectory())
+            gen_book.generate(book_dir, args.chapters, args.sections,
+                              args.activities)
+        results = run_bench(book_dir, args.stages, args.repeat, args.pandoc)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent = 2)
+            f.write("\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        return 1 if compare(baseline, results, args.threshold) else 0
+
+def _cmd_compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.results) as f:
+        results = json.load(f)
+    return 1 if compare(baseline, results, args.threshold) else 0
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.strip())
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    run_parser = commands.add_parser("run", help = "run benchmark")
+    run_parser.add_argument("book", nargs = "?",
+                            help = "book directory (default: synthetic book)")
+    run_parser.add_argument("-c", "--chapters", type = int, default = 10,
+                            help = "chapters of synthetic book"
+                            " (default: %(default)s)")
+    run_parser.add_argument("-s", "--sections", type = int, default = 3,
+                            help = "sections per chapter of synthetic book"
+                            " (default: %(default)s)")
+    run_parser.add_argument("-a", "--activities", type = int, default = 2,
+                            help = "activities of each type per chapter of"
+                            " synthetic book (default: %(default)s)")
+    run_parser.add_argument("--stages", nargs = "+", choices = list(STAGES),
+                            help = "stages to benchmark (default: all)")
+    run_parser.add_argument("-r", "--repeat", type = int, default = 5,
+                            help = "runs of each stage (default: %(default)s)")
+    run_parser.add_argument("-o", "--output", help = "JSON results file")
+    run_parser.add_argument("-b", "--baseline",
+                            help = "JSON results to compare against")
+    run_parser.add_argument("-t", "--threshold", type = float,
+                            default = DEFAULT_THRESHOLD,
+                            help = "relative slowdown considered as a"
+                            " regression (default: %(default)s)")
+    run_parser.add_argument("--pandoc",
+                            default = os.environ.get("PANDOC", "pandoc"),
+                            help = "pandoc executable (default: %(default)s)")
+    run_parser.set_defaults(func = _cmd_run)
+
+    compare_parser = commands.add_parser("compare",
+                                         help = "compare results to baseline")
+    compare_parser.add_argument("baseline", help = "baseline JSON results")
+    compare_parser.add_argument("results", help = "JSON results")
+    compare_parser.add_argument("-t", "--threshold", type = float,
+                                default = DEFAULT_THRESHOLD,
+                                help = "relative slowdown considered as a"
+                                " regression (default: %(default)s)")
+    compare_parser.set_defaults(func = _cmd_compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
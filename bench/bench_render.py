@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Compare the streaming HTML writer of the activities (`lupbook_html`) with
+dominate, on the activities of books and on a few large ones: same markup
+(golden check), render time and peak memory
+"""
+
+import argparse
+import contextlib
+import difflib
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+LBDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(LBDIR, "pandoc"))
+
+import dominate.tags
+import dominate.util
+
+import bench_filters
+import gen_book
+import lupbook_filter
+import lupbook_html
+import lupbook_registry
+
+#
+# Corpus
+#
+
+def _block_text(block):
+    """ Content of fenced code block, and its class """
+    header, text = block.split("\n", 1)
+    return header.strip("` "), text.rsplit("```", 1)[0]
+
+def _large_blocks(tmp_dir, size):
+    """ Activities with a large included skeleton and many fragments """
+    rng = random.Random(0)
+    skel = os.path.join(tmp_dir, "large.c")
+    with open(skel, "w") as f:
+        f.write(gen_book._skeleton(rng, size = size * 10))
+    return [_block_text(gen_book._icode(rng, "large-icode", skel)),
+            _block_text(gen_book._parsons(rng, "large-parsons",
+                                          frags = size))]
+
+def _activities(books, tmp_dir, size, pandoc):
+    """ Activities to render, as `(name, activity)` """
+    activities = []
+    for book_dir in books:
+        book = bench_filters._Book(book_dir, pandoc)
+        with bench_filters._in_dir(book_dir):
+            for cls, text in book.activities:
+                activity = cls(text)
+                activities.append((activity.conf["id"], activity))
+
+    for activity_type, text in _large_blocks(tmp_dir, size):
+        activity = lupbook_registry.get_activity(activity_type)(text)
+        activities.append((activity.conf["id"], activity))
+    return activities
+
+#
+# Renderers
+#
+
+@contextlib.contextmanager
+def _dominate(activities):
+    """ Make the activity modules generate dominate trees instead """
+    modules = {sys.modules[c.__module__] for _, activity in activities
+               for c in type(activity).__mro__ if c is not object}
+    saved = []
+    for module in modules:
+        for name, value in list(vars(module).items()):
+            if value is lupbook_html.raw:
+                replacement = dominate.util.raw
+            elif isinstance(value, type) \
+                    and issubclass(value, lupbook_html.html_tag) \
+                    and value is not lupbook_html.html_tag:
+                replacement = getattr(dominate.tags, value.__name__)
+            else:
+                continue
+            saved.append((module, name, value))
+            setattr(module, name, replacement)
+    try:
+        yield
+    finally:
+        for module, name, value in saved:
+            setattr(module, name, value)
+
+def _render_dominate(activity):
+    """ Card of activity, as rendered before the streaming writer """
+    root = dominate.tags.div(id = activity.conf["id"],
+                             cls = "card my-3 {}-container".format(
+                                 activity.activity_id()))
+    with root:
+        for gen in [activity._gen_header, activity._gen_description,
+                    activity._gen_activity, activity._gen_controls,
+                    activity._gen_testing, activity._gen_footer]:
+            gen()
+    return root.render()
+
+def _render_streaming(activity):
+    return activity._generate_html().text
+
+def _render_all(activities, render):
+    # Placeholders instead of converted markdown, the same for both renderers
+    batch = lupbook_filter.MarkdownBatch()
+    batch.nonce = "0" * 16
+    results = []
+    for _, activity in activities:
+        activity.md_batch = batch
+        activity.md_cache = None
+        results.append(render(activity))
+    return results
+
+#
+# Measurements
+#
+
+def check(activities, expected, results):
+    """ Compare markups, return number of mismatches """
+    mismatches = 0
+    for (name, _), html, ref in zip(activities, results, expected):
+        if html == ref:
+            continue
+        mismatches += 1
+        sys.stderr.write(f"Mismatch on '{name}':\n")
+        sys.stderr.writelines(difflib.unified_diff(
+            ref.splitlines(True), html.splitlines(True),
+            "dominate", "lupbook_html", n = 1))
+    print(f"Checked {len(activities)} activities, {mismatches} mismatches")
+    return mismatches
+
+def _time(activities, render, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _render_all(activities, render)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def _peak(activity, render):
+    """ Peak memory allocated while rendering activity """
+    tracemalloc.start()
+    try:
+        _render_all([(None, activity)], render)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def measure(activities, render, repeat):
+    """ Render time of all activities, and peak memory of each """
+    return _time(activities, render, repeat), \
+        [_peak(activity, render) for _, activity in activities]
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.strip())
+    parser.add_argument("books", nargs = "*",
+                        help = "book directories (default: sample book and a"
+                        " synthetic book)")
+    parser.add_argument("--size", type = int, default = 500,
+                        help = "fragments of the large parsons activity, and"
+                        " tenth of the lines of the large icode skeleton"
+                        " (default: %(default)s)")
+    parser.add_argument("-r", "--repeat", type = int, default = 5,
+                        help = "timing repetitions (default: %(default)s)")
+    parser.add_argument("--pandoc",
+                        default = os.environ.get("PANDOC", "pandoc"),
+                        help = "pandoc executable (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        books = args.books
+        if not books:
+            synthetic = os.path.join(tmp_dir, "book")
+            gen_book.generate(synthetic, chapters = 4, activities = 2)
+            books = [os.path.join(LBDIR, "sample"), synthetic]
+        activities = _activities(books, tmp_dir, args.size, args.pandoc)
+
+    with _dominate(activities):
+        expected = _render_all(activities, _render_dominate)
+        ref_time, ref_peaks = measure(activities, _render_dominate,
+                                      args.repeat)
+    results = _render_all(activities, _render_streaming)
+    time_, peaks = measure(activities, _render_streaming, args.repeat)
+
+    mismatches = check(activities, expected, results)
+
+    print(f"Render time of {len(activities)} activities:"
+          f" {ref_time * 1000:.2f} ms with dominate,"
+          f" {time_ * 1000:.2f} ms streaming")
+    print(f"{'activity':<24} {'dominate':>12} {'streaming':>12}  (peak memory)")
+    largest = sorted(range(len(activities)), key = lambda i: ref_peaks[i],
+                     reverse = True)[:5]
+    for idx in largest:
+        print(f"{activities[idx][0]:<24} {ref_peaks[idx] / 1024:>9.1f} KiB"
+              f" {peaks[idx] / 1024:>9.1f} KiB")
+    print(f"{'(all, max)':<24} {max(ref_peaks) / 1024:>9.1f} KiB"
+          f" {max(peaks) / 1024:>9.1f} KiB")
+
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
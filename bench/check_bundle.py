@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Check the bundle of the front-end modules (`lupbook_bundle`): minification
+only removes whitespace and comments, the bundle is valid JavaScript (with
+node, if installed), and its source map points back to the right lines. Then
+report the bytes saved, raw and gzipped.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+LBDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(LBDIR, "pandoc"))
+
+import lupbook_bundle
+
+_BASE64 = {c: i for i, c in enumerate(lupbook_bundle._BASE64)}
+
+def _decode_vlq(segment):
+    values = []
+    value, shift = 0, 0
+    for c in segment:
+        digit = _BASE64[c]
+        value |= (digit & 31) << shift
+        shift += 5
+        if not digit & 32:
+            values.append(-(value >> 1) if value & 1 else value >> 1)
+            value, shift = 0, 0
+    return values
+
+def _decode_mappings(mappings):
+    """ Origin `(source, line, column)` of each line, or None """
+    origins = []
+    origin = [0, 0, 0]
+    for segment in mappings.split(";"):
+        if not segment:
+            origins.append(None)
+            continue
+        deltas = _decode_vlq(segment)[1:]
+        origin = [o + d for o, d in zip(origin, deltas)]
+        origins.append(tuple(origin))
+    return origins
+
+#
+# Checks
+#
+
+def check_modules():
+    """ Minified modules only differ from their source by whitespace """
+    errors = 0
+    for name in lupbook_bundle.modules():
+        with open(os.path.join(LBDIR, f"modules/{name}.js"),
+                  encoding = 'utf-8') as f:
+            src = f.read()
+        code, _ = lupbook_bundle._strip_js_comments(src)
+        minified = "\n".join(text for text, _, _
+                              in lupbook_bundle.minify_js(src))
+        if re.sub(r'\s', "", code) != re.sub(r'\s', "", minified):
+            errors += 1
+            sys.stderr.write(f"modules/{name}.js: minification changed code\n")
+    return errors
+
+def check_syntax(bundle):
+    """ Bundle is valid JavaScript """
+    node = shutil.which("node")
+    if node is None:
+        print("node not found, skipping syntax check")
+        return 0
+    proc = subprocess.run([node, "--check", bundle.js],
+                          stderr = subprocess.PIPE, text = True)
+    if proc.returncode:
+        sys.stderr.write(proc.stderr)
+        return 1
+    return 0
+
+def check_source_map(bundle):
+    """ Each line of the bundle comes from where its source map says """
+    with open(bundle.js, encoding = 'utf-8') as f:
+        lines = f.read().split("\n")
+    with open(bundle.map, encoding = 'utf-8') as f:
+        smap = json.load(f)
+    sources = [content.split("\n") for content in smap["sourcesContent"]]
+
+    errors = 0
+    for idx, origin in enumerate(_decode_mappings(smap["mappings"])):
+        if origin is None:
+            continue
+        source, line, col = origin
+        text = lines[idx]
+        token = text.split(None, 1)[0] if text.strip() else ""
+        if not sources[source][line][col:].startswith(token):
+            errors += 1
+            sys.stderr.write(f"Line {idx + 1} mapped to"
+                             f" {smap['sources'][source]}:{line + 1}:{col}"
+                             f" instead\n")
+    return errors
+
+def _read(fnames):
+    data = b""
+    for fname in fnames:
+        if os.path.exists(fname):
+            with open(fname, 'rb') as f:
+                data += f.read()
+    return data
+
+def report(bundle):
+    """ Bytes saved, raw and gzipped """
+    print("\n".join(bundle.report_lines()))
+    before, after = 0, 0
+    for fname, ext in [(bundle.js, "js"), (bundle.css, "css")]:
+        sources = _read(os.path.join(LBDIR, f"modules/{m}.{ext}")
+                        for m in lupbook_bundle.modules())
+        before += len(gzip.compress(sources))
+        after += len(gzip.compress(_read([fname])))
+    print(f"{'gzipped':<24} {before:>9} -> {after:>9} bytes"
+          f" ({before - after} saved)")
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.strip())
+    parser.parse_args(argv)
+
+    errors = check_modules()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Bundle of all the modules, built from scratch
+        description = lupbook_bundle._build(tmp_dir, lupbook_bundle.modules(),
+                                            "file")
+        bundle = lupbook_bundle.Bundle(tmp_dir, description)
+        errors += check_syntax(bundle)
+        errors += check_source_map(bundle)
+        report(bundle)
+
+    print(f"{errors} errors")
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
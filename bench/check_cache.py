@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Check that concurrent builds and workers can share the same caches
+(`lupbook_cache.LupbookCache`): processes which keep a cache open, reading and
+writing it, don't lock each other out, and an incremental build with several
+workers on a warm cache gives the same book as on a cold one
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+LBDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(LBDIR, "pandoc"))
+
+import gen_book
+import lupbook_cache
+import lupbook_chapters
+
+# How long processes wait for the lock of a cache in these checks, in seconds
+# (instead of the cache's own timeout), so that lock contention fails quickly
+BUSY_TIMEOUT = 2
+
+#
+# Concurrent access
+#
+
+def _access(path, worker, rounds, barrier):
+    """ Read and write cache in rounds, keeping it open all along """
+    cache = lupbook_cache.LupbookCache(path, "check")
+    cache.db.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT * 1000}")
+    for r in range(rounds):
+        cache.get(f"shared-{r - 1}")
+        cache.get(f"{worker}-{r - 1}")
+        cache.put(f"{worker}-{r}", "x" * 100)
+        cache.put(f"shared-{r}", f"{worker}")
+        # Other processes go on while this one still has the cache open
+        barrier.wait(timeout = BUSY_TIMEOUT * 5)
+    cache.close()
+
+def check_access(workers, rounds = 10):
+    """ Processes sharing a cache never wait for each other's lock """
+    errors = 0
+    with tempfile.TemporaryDirectory() as path:
+        ctx = multiprocessing.get_context("spawn")
+        barrier = ctx.Barrier(workers)
+        procs = [ctx.Process(target = _access,
+                             args = (path, w, rounds, barrier))
+                 for w in range(workers)]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+            if proc.exitcode != 0:
+                errors += 1
+
+        cache = lupbook_cache.LupbookCache(path, "check")
+        count = cache.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        cache.close()
+        if count != workers * rounds + rounds:
+            errors += 1
+            sys.stderr.write(f"{count} cache entries instead of"
+                             f" {workers * rounds + rounds}\n")
+    print(f"{workers} processes sharing a cache: {errors} errors")
+    return errors
+
+#
+# Parallel builds
+#
+
+def _build(book_dir, output, jobs, pandoc):
+    start = time.monotonic()
+    lupbook_chapters.build_book(book_dir, output, embed = False,
+                                pandoc = pandoc, jobs = jobs)
+    elapsed = time.monotonic() - start
+    with open(output, encoding = 'utf-8') as f:
+        return f.read(), elapsed
+
+def check_build(jobs, chapters, pandoc):
+    """
+    Book built with `jobs` workers on a warm cache (all chapters rebuilt, but
+    all activities cached) is the same as on a cold one
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        book_dir = os.path.join(tmp_dir, "book")
+        gen_book.generate(book_dir, chapters = chapters)
+        os.environ["LUPBOOK_CACHE_DIR"] = os.path.join(tmp_dir, "cache")
+
+        cold, cold_time = _build(book_dir, os.path.join(tmp_dir, "cold.html"),
+                                 jobs, pandoc)
+        warm, warm_time = _build(book_dir, os.path.join(tmp_dir, "warm.html"),
+                                 jobs, pandoc)
+
+    print(f"{chapters} chapters, {jobs} jobs: cold cache {cold_time:.2f} s,"
+          f" warm cache {warm_time:.2f} s")
+    if cold != warm:
+        sys.stderr.write("Book built on warm cache differs\n")
+        return 1
+    return 0
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.strip())
+    parser.add_argument("-j", "--jobs", type = int, default = 4,
+                        help = "number of processes (default: %(default)s)")
+    parser.add_argument("-c", "--chapters", type = int, default = 16,
+                        help = "number of chapters of the synthetic book"
+                        " (default: %(default)s)")
+    parser.add_argument("--pandoc", default = os.environ.get("PANDOC", "pandoc"),
+                        help = "pandoc executable (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    errors = check_access(args.jobs)
+    errors += check_build(args.jobs, args.chapters, args.pandoc)
+
+    print(f"{errors} errors")
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Check that converting the markdown fragments of activities in a single pandoc
+run (`lupbook_filter.MarkdownBatch`) gives the same HTML as converting each of
+them on its own, on fragments which could run into one another and on the
+fragments of books
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+LBDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(LBDIR, "pandoc"))
+
+import bench_filters
+import gen_book
+import lupbook_filter
+
+# Fragments converted together, each list in a batch of its own, which markdown
+# constructs could continue across the separating markers
+CASES = [
+    # Definition lists, whose term ends the previous fragment
+    ["Term\n:   definition", ": def only"],
+    ["Term", ":   definition"],
+    ["Term", "~   definition"],
+    ["Term\n~   definition", "~ def only"],
+    # Setext headers and horizontal rules, under the previous fragment
+    ["Title", "====="],
+    ["Title", "-----"],
+    # Lists, block quotes and lazy continuation lines
+    ["- item", "continued"],
+    ["1. one", "2. two"],
+    ["> quote", "lazy"],
+    ["    indented code", "    more code"],
+    # Inline constructs left open
+    ["*emphasis", "across*"],
+    ["`code", "span`"],
+    ["[link", "](url)"],
+    # Reference links, footnotes and example lists
+    ["[text][ref]", "[ref]: https://example.com"],
+    ["Note[^1]", "[^1]: footnote"],
+    ["(@) first", "(@) second"],
+    # Unclosed blocks
+    ["```\ncode", "text"],
+    ["::: div\ntext", "text"],
+    ["<div>\ntext", "text"],
+]
+
+def _book_fragments(book_dir, pandoc):
+    """ Markdown fragments of the activities of book """
+    book = bench_filters._Book(book_dir, pandoc)
+    batch = lupbook_filter.MarkdownBatch()
+    with bench_filters._in_dir(book_dir):
+        for cls, text in book.activities:
+            cls(text).process(batch)
+    return batch.fragments
+
+def check(fragments, name):
+    """ Compare batched and separate conversions, return number of errors """
+    batch = lupbook_filter.MarkdownBatch()
+    placeholders = [batch.add(text) for text in fragments]
+    batch.convert()
+
+    errors = 0
+    for text, placeholder in zip(fragments, placeholders):
+        expected = lupbook_filter.convert_markdown(text)
+        html = batch.resolve(placeholder)
+        if html != expected:
+            errors += 1
+            sys.stderr.write(f"{name}: fragment {text!r} converted to"
+                             f" {html!r} instead of {expected!r}\n")
+    return errors
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.strip())
+    parser.add_argument("--pandoc", default = os.environ.get("PANDOC", "pandoc"),
+                        help = "pandoc executable (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    errors = 0
+    for i, fragments in enumerate(CASES):
+        errors += check(fragments, f"case {i}")
+    print(f"{len(CASES)} cases: {errors} errors")
+
+    corpus = [("sample", os.path.join(LBDIR, "sample"))]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus.append(("synthetic", tmp_dir))
+        gen_book.generate(tmp_dir)
+        for name, book_dir in corpus:
+            fragments = _book_fragments(book_dir, args.pandoc)
+            book_errors = check(fragments, name)
+            print(f"{name} book: {len(fragments)} fragments,"
+                  f" {book_errors} errors")
+            errors += book_errors
+
+    print(f"{errors} errors")
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Check that the compiled schema validators behave exactly like the jsonschema
+validators (`lupbook_schema.LupbookValidator`), on the activities of books and
+on many broken variants of them: same outcome, same errors and messages, and
+same defaults filled in
+"""
+
+import argparse
+import contextlib
+import copy
+import io
+import os
+import sys
+import tempfile
+import time
+
+LBDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(LBDIR, "pandoc"))
+
+import bench_filters
+import gen_book
+
+# Values replacing parts of valid configurations
+WRONG_VALUES = [None, True, False, 0, 1, -1, 2.5, "", "x", "file", "regex",
+                "bad id!", [], [1], ["x"], [{}], {}, { "from": 0 },
+                { "to": 2 }, { "except": [] }]
+
+#
+# Corpus
+#
+
+def _configurations(book_dir, pandoc):
+    """ Activity type and YAML configuration of each activity of book """
+    book = bench_filters._Book(book_dir, pandoc)
+    with bench_filters._in_dir(book_dir):
+        return [(cls.activity_id(), cls._yaml_validator(),
+                 bench_filters._load_yaml(text))
+                for cls, text in book.activities]
+
+def _mutations(node):
+    """ Copies of node, each broken in one place """
+    yield from WRONG_VALUES
+    if isinstance(node, dict):
+        yield { **node, "extra": "x" }
+        for key, value in node.items():
+            yield { k: v for k, v in node.items() if k != key }
+            for mutation in _mutations(value):
+                yield { **node, key: mutation }
+    elif isinstance(node, list):
+        yield node + node[:1]
+        for i, value in enumerate(node):
+            for mutation in _mutations(value):
+                yield node[:i] + [mutation] + node[i + 1:]
+
+#
+# Comparison
+#
+
+def _run(validator, conf):
+    """ Outcome of validating a copy of conf, with the resulting instance """
+    conf = copy.deepcopy(conf)
+    err = io.StringIO()
+    with contextlib.redirect_stderr(err):
+        try:
+            validator.validate(conf)
+            error = None
+        except Exception as e:
+            error = (type(e).__name__, str(e))
+    return error, conf, err.getvalue()
+
+def check(configurations):
+    """ Compare validators on configurations, return number of mismatches """
+    mismatches = 0
+    checked = invalid = 0
+    for activity_id, validator, conf in configurations:
+        validator.compile()
+        if validator.source is None:
+            sys.stderr.write(f"Warning: schema of '{activity_id}' isn't"
+                             " compiled\n")
+
+        for instance in [conf, *_mutations(conf)]:
+            expected = _run(validator.reference, instance)
+            result = _run(validator, instance)
+            checked += 1
+            invalid += expected[0] is not None
+            if result != expected:
+                mismatches += 1
+                sys.stderr.write(f"Mismatch on '{activity_id}' instance"
+                                 f" {instance!r}:\n  expected {expected!r}\n"
+                                 f"  got {result!r}\n")
+
+    print(f"Checked {checked} instances ({invalid} invalid),"
+          f" {mismatches} mismatches")
+    return mismatches
+
+def _time(configurations, reference, repeat = 5):
+    best = None
+    for _ in range(repeat):
+        todo = [(v.reference if reference else v, copy.deepcopy(c))
+                for _, v, c in configurations]
+        start = time.perf_counter()
+        for validator, conf in todo:
+            validator.validate(conf)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.strip())
+    parser.add_argument("books", nargs = "*",
+                        help = "book directories (default: sample book and a"
+                        " synthetic book)")
+    parser.add_argument("--pandoc",
+                        default = os.environ.get("PANDOC", "pandoc"),
+                        help = "pandoc executable (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    with contextlib.ExitStack() as stack:
+        books = args.books
+        if not books:
+            synthetic = stack.enter_context(tempfile.TemporaryDirectory())
+            gen_book.generate(synthetic, chapters = 2, activities = 2)
+            books = [os.path.join(LBDIR, "sample"), synthetic]
+
+        configurations = []
+        for book_dir in books:
+            configurations += _configurations(book_dir, args.pandoc)
+
+    mismatches = check(configurations)
+
+    reference = _time(configurations, reference = True)
+    compiled = _time(configurations, reference = False)
+    print(f"Validation of {len(configurations)} activities:"
+          f" {reference * 1000:.2f} ms with jsonschema,"
+          f" {compiled * 1000:.2f} ms compiled")
+
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
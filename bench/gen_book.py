@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Generate synthetic books for benchmarking the filters, modeled on the chapters
+of `sample/`
+"""
+
+import argparse
+import os
+import random
+import shutil
+
+LBDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ACTIVITY_TYPES = ["icode", "mcq", "fib", "parsons", "hparsons", "matching"]
+
+WORDS = """lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod
+tempor incididunt ut labore et dolore magna aliqua enim ad minim veniam quis
+nostrud exercitation ullamco laboris nisi aliquip ex ea commodo consequat duis
+aute irure in reprehenderit voluptate velit esse cillum fugiat nulla pariatur
+""".split()
+
+def _words(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+def _paragraph(rng):
+    """ Markdown paragraph, with some inline formatting """
+    text = _words(rng, rng.randint(30, 60))
+    words = text.split()
+    words[rng.randrange(len(words))] = f"**{rng.choice(WORDS)}**"
+    words[rng.randrange(len(words))] = f"`{rng.choice(WORDS)}`"
+    words[rng.randrange(len(words))] = "$x^2$"
+    return " ".join(words).capitalize() + "."
+
+def _prompt(rng, indent = "  "):
+    lines = [f"*{_words(rng, 4).capitalize()}!*", "",
+             _words(rng, 12).capitalize() + " with `code` and $\\pi$."]
+    return "prompt: |\n" + "".join(f"{indent}{l}\n" if l else "\n"
+                                   for l in lines)
+
+#
+# Activities
+#
+
+def _icode(rng, ident, skel):
+    return f"""``` icode
+id: {ident}
+title: {_words(rng, 3).title()}
+{_prompt(rng)}skeleton:
+  - filename: main.c
+    data: !raw_include {skel}
+    readonly:
+      except:
+        - from: 3
+          to: 5
+tests:
+  - name: Build
+    fatal: true
+    cmds:
+      - gcc -o main main.c
+  - name: Run
+    cmds:
+      - ./main {rng.randint(1, 100)}
+    checks:
+      - output: stdout
+        content: "{_words(rng, 3)}\\n"
+```
+"""
+
+def _mcq(rng, ident):
+    n = rng.randint(3, 5)
+    correct = rng.randrange(n)
+    choices = "".join(f"""  - text: {_words(rng, 4)} $x_{i}$
+    feedback: |
+      {_words(rng, 10).capitalize()}.
+""" + ("    correct: true\n" if i == correct else "")
+                      for i in range(n))
+    return f"""``` mcq
+id: {ident}
+title: {_words(rng, 3).title()}
+{_prompt(rng)}choices:
+{choices}```
+"""
+
+def _fib(rng, ident):
+    return f"""``` fib
+id: {ident}
+title: {_words(rng, 3).title()}
+prompt: {_words(rng, 8).capitalize()}.
+text: |
+  {_words(rng, 6).capitalize()} |blank| {_words(rng, 5)}.
+
+  {_words(rng, 4).capitalize()} |blank| {_words(rng, 3)} |blank|.
+blanks:
+  - answer: {rng.choice(WORDS)}
+    type: text
+    feedback: |
+      {_words(rng, 5).capitalize()}.
+  - answer: "{rng.randint(1, 10)}"
+    type: number
+    feedback: |
+      {_words(rng, 5).capitalize()}.
+  - answer: {rng.choice(WORDS)}
+    type: text
+    feedback: |
+      {_words(rng, 5).capitalize()}.
+```
+"""
+
+def _frags(rng, n):
+    frags = [f"""  - id: {i + 1}
+""" + (f"    depend: {i}\n" if i else "") + f"""    text: |
+      {_words(rng, 5).capitalize()} $n_{i}$.
+""" for i in range(n)]
+    frags.append("  - id: -1\n    text: Redundant fragment\n")
+    rng.shuffle(frags)
+    return "".join(frags)
+
+def _parsons(rng, ident, frags = None):
+    return f"""``` parsons
+id: {ident}
+title: {_words(rng, 3).title()}
+{_prompt(rng)}frags:
+{_frags(rng, frags or rng.randint(3, 6))}```
+"""
+
+def _hparsons(rng, ident):
+    return f"""``` hparsons
+id: {ident}
+title: {_words(rng, 3).title()}
+{_prompt(rng)}frags:
+{_frags(rng, rng.randint(3, 6))}```
+"""
+
+def _matching(rng, ident):
+    n = rng.randint(3, 5)
+    choices = "".join(f"""  - id: choice{i}
+    text: {_words(rng, 2).capitalize()}
+    feedback: |
+      {_words(rng, 8).capitalize()}.
+""" for i in range(n))
+    answers = "".join(f"""  - text: {_words(rng, 2).capitalize()}
+    choices: [choice{i}]
+""" for i in range(n))
+    return f"""``` matching
+id: {ident}
+title: {_words(rng, 3).title()}
+random: false
+{_prompt(rng)}choices:
+{choices}answers:
+{answers}```
+"""
+
+def _skeleton(rng, size = None):
+    """ C source file, included by icode activities """
+    lines = ["#include <stdio.h>", "", "int main(int argc, char *argv[])", "{"]
+    lines += [f"    /* {_words(rng, 8)} */"
+              for _ in range(size or rng.randint(20, 60))]
+    lines += ['    printf("%d\\n", argc);', "    return 0;", "}"]
+    return "\n".join(lines) + "\n"
+
+#
+# Book
+#
+
+def generate(out_dir, chapters = 10, sections = 3, activities = 1, seed = 0):
+    """
+    Generate book in `out_dir`, with `sections` sections per chapter, and
+    `activities` activities of each type per chapter
+    """
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(out_dir, "skel"), exist_ok = True)
+    for fname in ["template.html", "template.css"]:
+        shutil.copy(os.path.join(LBDIR, "sample", fname), out_dir)
+
+    for c in range(chapters):
+        # Activities of all types, spread over the sections of the chapter
+        blocks = []
+        for a in range(activities):
+            for activity_type in ACTIVITY_TYPES:
+                ident = f"ch{c}-{activity_type}-{a}"
+                if activity_type == "icode":
+                    skel = f"skel/{ident}.c"
+                    with open(os.path.join(out_dir, skel), "w") as f:
+                        f.write(_skeleton(rng))
+                    blocks.append(_icode(rng, ident, skel))
+                else:
+                    generator = globals()[f"_{activity_type}"]
+                    blocks.append(generator(rng, ident))
+        rng.shuffle(blocks)
+
+        lines = []
+        if c == 0:
+            lines += ["---", "title: Synthetic book", "author: lupbook bench",
+                      "---", ""]
+        lines += [f"# Chapter {c}: {_words(rng, 3).title()}", "",
+                  _paragraph(rng), ""]
+        per_section = -(-len(blocks) // max(sections, 1))
+        for s in range(sections):
+            lines += [f"## {_words(rng, 3).title()}", "", _paragraph(rng), ""]
+            for b in blocks[s * per_section:(s + 1) * per_section]:
+                lines += [b, _paragraph(rng), ""]
+            lines += [f"### {_words(rng, 2).title()}", "", _paragraph(rng), ""]
+
+        with open(os.path.join(out_dir, f"{c:03d}-chapter.md"), "w") as f:
+            f.write("\n".join(lines))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__.strip())
+    parser.add_argument("out_dir", help = "output directory")
+    parser.add_argument("-c", "--chapters", type = int, default = 10,
+                        help = "number of chapters (default: %(default)s)")
+    parser.add_argument("-s", "--sections", type = int, default = 3,
+                        help = "number of sections per chapter"
+                        " (default: %(default)s)")
+    parser.add_argument("-a", "--activities", type = int, default = 1,
+                        help = "number of activities of each type per chapter"
+                        " (default: %(default)s)")
+    parser.add_argument("--seed", type = int, default = 0,
+                        help = "random seed (default: %(default)s)")
+    args = parser.parse_args()
+    generate(args.out_dir, args.chapters, args.sections, args.activities,
+             args.seed)
@@ -12,6 +12,7 @@ class FIBActivity extends LupBookActivity {
 
   filledCount = [];
   casing;
+  answers = [];
 
   /* Class methods */
   constructor(elt) {
@@ -25,11 +26,8 @@ class FIBActivity extends LupBookActivity {
     this.feedbackItems = Array.from(
       elt.getElementsByClassName("fib-feedback-item")
     );
-    const casingDiv = document.getElementById(
-      `${this.prefixId}-casing-div`
-    );
-    this.casing = casingDiv.dataset.casing;
-
+    this.casing = this.data.casing;
+    this.answers = this.data.answers;
 
     /* Init activity */
     this.initActivity();
@@ -101,7 +99,7 @@ class FIBActivity extends LupBookActivity {
 
       /* By default, case sensitive */
       let itemVal = item.value;
-      let answerVal = item.dataset.answer;
+      let answerVal = this.answers[idx];
 
       /* Unless specified otherwise */
       if (this.casing === false) {
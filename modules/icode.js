@@ -51,9 +51,8 @@ class IcodeTest {
 
   /* Class constructor */
   constructor(idx, elt, icode) {
-    /* Read array of test objects from the DOM and transform them into object
-     * attributes. */
-    Object.assign(this, JSON.parse(atob(elt.dataset.params)));
+    /* Transform test object of the activity's data into object attributes */
+    Object.assign(this, icode.data.tests[idx]);
 
     const testId = `${icode.prefixId}-test-${idx}`;
 
@@ -383,7 +382,8 @@ class IcodeActivity extends LupBookActivity {
   constructor(elt) {
     super("icode", elt);
 
-    this.sessionVM = LupBookVM.session_open();
+    /* VM session is only opened once the VM is loaded (see IcodeVM) */
+    this.sessionVM = null;
 
     /*
      * Create test objects
@@ -402,7 +402,7 @@ class IcodeActivity extends LupBookActivity {
       lineNumbers: true,
       matchBrackets: true,
       indentUnit: 4,
-      mode: "text/x-csrc" /* TODO: auto-detection of mode using mode/meta.js addon */,
+      mode: "text/plain",
       extraKeys: {
         Tab: (cm) => cm.execCommand("indentMore"),
         "Shift-Tab": (cm) => cm.execCommand("indentLess")
@@ -415,13 +415,17 @@ class IcodeActivity extends LupBookActivity {
     icodeSrcFiles.forEach((srcFileElt) => {
       const cmArgs = { ...cmBaseArgs };
 
+      /* Language inferred from the file name (see `lupbook-modes`) */
+      if (srcFileElt.dataset.mode) cmArgs.mode = srcFileElt.dataset.mode;
+
       /* By default, files aren't readonly at all. Here, determine if a file is
        * entirely readonly (in which case, it needs to be specified when
        * creating the editor) or partially readonly (in which case, it needs to
        * be specified after creating the editor) */
+      const readOnly = this.data.readonly[srcFileElt.dataset.filename];
       let readOnlyPartial = false;
-      if (typeof srcFileElt.dataset.readonly !== "undefined") {
-        if (srcFileElt.dataset.readonly == "data-readonly") {
+      if (typeof readOnly !== "undefined") {
+        if (readOnly === true) {
           /* The whole file is readonly */
           cmArgs["readOnly"] = "nocursor";
           cmArgs["theme"] = "default readonly";
@@ -436,8 +440,7 @@ class IcodeActivity extends LupBookActivity {
 
       /* Specify ranges of readonly lines if any */
       if (readOnlyPartial) {
-        const readOnlyRanges = JSON.parse(atob(srcFileElt.dataset.readonly));
-        readOnlyRanges.forEach((range) => {
+        readOnly.forEach((range) => {
           cm.markText(
             { line: range[0] - 2 },
             { line: range[1], ch: 0 },
@@ -518,6 +521,16 @@ class IcodeActivity extends LupBookActivity {
   onSubmit() {
     /* Disable buttons */
     this.submitStatus(LupBookActivity.SubmitStatus.DISABLED);
+
+    /* Submission before the VM is up (e.g., right after editing the code):
+     * resume once it is */
+    if (!icodeVM.ready) {
+      icodeVM.boot().then(
+        () => this.onSubmit(),
+        () => this.submitStatus(LupBookActivity.SubmitStatus.ENABLED)
+      );
+      return;
+    }
     this.resetStatus(false);
 
     /* Clear and show progress bar */
@@ -601,10 +614,206 @@ class IcodeActivity extends LupBookActivity {
   }
 }
 
+/*
+ * Virtual machine, loaded on demand
+ *
+ * The VM script is the largest part of the book, and only icode activities need
+ * it. Instead of being loaded with the page, it's included as a deferred script
+ * (with a type browsers don't run, either embedded or referenced by URL, see
+ * template) and only loaded, then booted, when an icode activity first comes
+ * into view or gets the focus.
+ */
+class IcodeVM {
+  /* Class members */
+  term;
+  icodes;
+  scriptElt;
+  progressElt;
+  progressBar;
+  booting = null;
+  ready = false;
+
+  /* Class constructor */
+  constructor(term, icodes) {
+    this.term = term;
+    this.icodes = icodes;
+    this.scriptElt = document.getElementById("lbvm-script");
+    this.progressElt = document.getElementById("lbvm-progress");
+    this.progressBar = this.progressElt.querySelector(".progress-bar");
+
+    /* Boot once an activity is about to be seen or used */
+    if (!icodes.length) return;
+    const observer = new IntersectionObserver(
+      (entries) => {
+        if (entries.some((entry) => entry.isIntersecting)) {
+          observer.disconnect();
+          this.prefetch();
+        }
+      },
+      { rootMargin: "200px" }
+    );
+    for (const elt of document.getElementsByClassName("icode-container")) {
+      observer.observe(elt);
+      elt.addEventListener("focusin", () => this.prefetch(), { once: true });
+    }
+  }
+
+  /* Load and start VM (once), return a promise resolved when it's up */
+  boot() {
+    if (!this.booting) {
+      this.booting = this.load()
+        .then(() => this.start())
+        .catch((err) => {
+          /* Allow retrying (e.g., on next submission) */
+          this.booting = null;
+          this.showProgress(null);
+          this.term.write(
+            `Failed to load virtual machine: ${err.message}\r\n`
+          );
+          throw err;
+        });
+    }
+    return this.booting;
+  }
+
+  /* Boot VM in the background (errors are reported in the terminal) */
+  prefetch() {
+    this.boot().catch(() => {});
+  }
+
+  /* Show loading progress in terminal modal (hidden if `loaded` is null) */
+  showProgress(loaded, total = null) {
+    if (loaded === null) {
+      this.progressElt.classList.add("d-none");
+      return;
+    }
+    this.progressElt.classList.remove("d-none");
+    if (total) {
+      const percent = Math.min(100, Math.round((100 * loaded) / total));
+      this.progressBar.classList.remove("progress-bar-striped");
+      this.progressBar.style.width = `${percent}%`;
+      this.progressBar.textContent = `${percent}%`;
+    } else {
+      /* Unknown size (e.g., compressed response) */
+      this.progressBar.classList.add("progress-bar-striped");
+      this.progressBar.style.width = "100%";
+      this.progressBar.textContent = `${(loaded / 1048576).toFixed(1)} MiB`;
+    }
+  }
+
+  /* Run script given as its URL */
+  static runScript(url) {
+    return new Promise((resolve, reject) => {
+      const elt = document.createElement("script");
+      elt.src = url;
+      elt.onload = resolve;
+      elt.onerror = () => reject(new Error(`cannot load ${url}`));
+      document.head.appendChild(elt);
+    });
+  }
+
+  /* Fetch script, reporting progress, return its content */
+  async fetchScript(url) {
+    const response = await fetch(url);
+    if (!response.ok)
+      throw new Error(`${response.status} ${response.statusText}`);
+
+    /* The length is that of the encoded data if compressed by the server */
+    const length = response.headers.get("Content-Length");
+    const total =
+      length && !response.headers.get("Content-Encoding")
+        ? parseInt(length)
+        : null;
+
+    const reader = response.body.getReader();
+    const chunks = [];
+    let loaded = 0;
+    for (;;) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      chunks.push(value);
+      loaded += value.length;
+      this.showProgress(loaded, total);
+    }
+    return new Blob(chunks, { type: "text/javascript" });
+  }
+
+  /* Load VM script */
+  async load() {
+    /* Already loaded (e.g., template loading the VM script with the page) */
+    if (typeof LupBookVM !== "undefined") return;
+    if (!this.scriptElt)
+      throw new Error("no virtual machine included in this page");
+
+    this.term.write("Loading virtual machine...\r\n");
+    this.showProgress(0);
+
+    let blob;
+    if (this.scriptElt.hasAttribute("src")) {
+      try {
+        blob = await this.fetchScript(this.scriptElt.src);
+      } catch (err) {
+        /* Fetching isn't allowed for local files (file://), but running
+         * scripts is, only without progress */
+        if (!(err instanceof TypeError)) throw err;
+        await IcodeVM.runScript(this.scriptElt.src);
+        return;
+      }
+    } else {
+      /* Embedded into the book */
+      blob = new Blob([this.scriptElt.textContent], {
+        type: "text/javascript"
+      });
+    }
+
+    const url = URL.createObjectURL(blob);
+    try {
+      await IcodeVM.runScript(url);
+    } finally {
+      URL.revokeObjectURL(url);
+    }
+  }
+
+  /* Start VM, resolve once it's up */
+  start() {
+    this.term.write("Booting virtual machine...\r\n");
+    this.showProgress(null);
+    this.icodes.forEach((icode) => {
+      icode.sessionVM = LupBookVM.session_open();
+    });
+
+    return new Promise((resolve) => {
+      LupBookVM.start({
+        on_init: () => {
+          /* Once the VM is up and ready, make icode activities submittable */
+          this.ready = true;
+          this.icodes.forEach((icode) =>
+            icode.submitStatus(LupBookActivity.SubmitStatus.ENABLED)
+          );
+          resolve();
+        },
+        on_error: () => {
+          console.log("VM Error!");
+        },
+        console_debug_write: (c) => {
+          this.term.write(c);
+        }
+      });
+    });
+  }
+}
+
+/* VM of the page */
+let icodeVM;
+
 /*
  * Initialization of icode activities after DOM loading
  */
 window.addEventListener("DOMContentLoaded", () => {
+  /* Nothing to do without icode activities (e.g., if bundled with the modules
+   * of other pages) */
+  if (!document.getElementsByClassName("icode-container").length) return;
+
   /*
    * Set up terminal once
    */
@@ -635,9 +844,9 @@ window.addEventListener("DOMContentLoaded", () => {
     fitAddon.fit();
   };
 
-  /* Bind terminal input to VM */
+  /* Bind terminal input to VM, once running */
   term.onKey((ev) => {
-    LupBookVM.on_console_queue(ev.key.charCodeAt(0));
+    if (icodeVM.ready) LupBookVM.on_console_queue(ev.key.charCodeAt(0));
   });
 
   /*
@@ -649,21 +858,10 @@ window.addEventListener("DOMContentLoaded", () => {
   }
 
   /*
-   * Virtual Machine
+   * Virtual Machine, booted on demand (or when opening the terminal)
    */
-  term.write("Loading virtual machine...\r\n");
-  LupBookVM.start({
-    on_init: () => {
-      /* Once the VM is up and ready, make icode activities submittable */
-      icodes.forEach((icode) =>
-        icode.submitStatus(LupBookActivity.SubmitStatus.ENABLED)
-      );
-    },
-    on_error: () => {
-      console.log("VM Error!");
-    },
-    console_debug_write: (c) => {
-      term.write(c);
-    }
+  icodeVM = new IcodeVM(term, icodes);
+  termModElt.addEventListener("show.bs.modal", () => {
+    if (icodes.length) icodeVM.prefetch();
   });
 });
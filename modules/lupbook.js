@@ -18,9 +18,13 @@ class LupBookActivity {
     FAILURE: "FAILURE"
   });
 
+  /* Data of all the activities of the page, parsed once (see `dataOf()`) */
+  static islandData = null;
+
   /* Class members */
   prefixId;
   sectionDiv;
+  data;
 
   submitBtn;
   resetBtn;
@@ -36,6 +40,7 @@ class LupBookActivity {
   constructor(type, elt) {
     this.prefixId = `${type}-${elt.id}`;
     this.sectionDiv = elt.closest("section");
+    this.data = LupBookActivity.dataOf(elt.id);
 
     this.submitBtn = document.getElementById(`${this.prefixId}-submit`);
     this.resetBtn = document.getElementById(`${this.prefixId}-reset`);
@@ -60,6 +65,18 @@ class LupBookActivity {
     this.resetBtn.onclick = () => this.onReset();
   }
 
+  /* Data of activity (e.g., answers), from the JSON data island that the
+   * book holds for all its activities */
+  static dataOf(id) {
+    if (LupBookActivity.islandData === null) {
+      const island = document.getElementById("lupbook-data");
+      LupBookActivity.islandData = island
+        ? JSON.parse(island.textContent)
+        : {};
+    }
+    return LupBookActivity.islandData[id] || {};
+  }
+
   onSubmit() {
     throw new Error("This method should be overridden by subclasses");
   }
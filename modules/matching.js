@@ -9,6 +9,7 @@ class MatchingActivity extends LupBookActivity {
   choiceItems = [];
   answerContainer;
   answerBoxes = [];
+  answerChoices = [];
 
   testingScore;
   feedbackItems = [];
@@ -28,6 +29,8 @@ class MatchingActivity extends LupBookActivity {
     this.answerBoxes = Array.from(
       elt.getElementsByClassName("matching-answer")
     );
+    /* Choices matching each answer box */
+    this.answerChoices = this.data.answers;
 
     this.testingScore = document.getElementById(
       `${this.prefixId}-testing-score`
@@ -155,8 +158,8 @@ class MatchingActivity extends LupBookActivity {
     this.choiceItems.forEach((item, idx) => {
       const choiceContainerElt = item.parentNode;
       const feedbackItem = this.feedbackItems[idx];
-      const answerChoices = choiceContainerElt.dataset.choices ? 
-        choiceContainerElt.dataset.choices.split(",") : [];
+      const boxIdx = this.answerBoxes.indexOf(choiceContainerElt);
+      const answerChoices = boxIdx !== -1 ? this.answerChoices[boxIdx] : [];
 
       const choiceId = item.id.split("-").pop();
       if (
@@ -10,6 +10,7 @@ class MCQActivity extends LupBookActivity {
   testingScore;
   feedbackItems = [];
 
+  correctItems;
   totalCorrectCount = 0;
   testingCount = 0;
 
@@ -48,9 +49,11 @@ class MCQActivity extends LupBookActivity {
   initActivity() {
     this.resetSelection();
 
-    this.choiceItems.forEach((item) => {
-      if (item.dataset.correct !== undefined) this.totalCorrectCount++;
+    /* Indices of correct choices */
+    this.correctItems = new Set(this.data.correct);
+    this.totalCorrectCount = this.correctItems.size;
 
+    this.choiceItems.forEach((item) => {
       item.addEventListener("click", () => {
         if (item.checked) this.selectedCount++;
         else this.selectedCount--;
@@ -101,7 +104,7 @@ class MCQActivity extends LupBookActivity {
 
         /* Show corresponding feedback item and color it appropriately */
         feedbackItem.classList.remove("d-none");
-        if (item.dataset.correct !== undefined) {
+        if (this.correctItems.has(idx)) {
           feedbackItem.classList.add("border-success");
           userCorrect++;
         } else {
@@ -6,6 +6,7 @@
 class ParsonsActivity extends LupBookActivity {
   /* Class members */
   fragItems = [];
+  fragInfo = new Map();
   answerBox;
 
   testingScore;
@@ -43,10 +44,17 @@ class ParsonsActivity extends LupBookActivity {
       "parsons-placeholder border border-0 bg-secondary-subtle rounded m-2 mb-0 p-2 d-flex";
 
     /* Attach "source" dragging functions to frag items */
-    this.fragItems.forEach((item) => {
+    this.fragItems.forEach((item, idx) => {
       this.setFragDraggable(item, true);
 
-      if (parseInt(item.dataset.id, 10) !== -1) this.totalValidFrags++;
+      /* ID and dependency of fragment, and its (OR-)group in the frag box */
+      this.fragInfo.set(item, {
+        id: this.data.ids[idx],
+        depend: this.data.depends[idx],
+        group: item.parentNode
+      });
+
+      if (this.data.ids[idx] !== -1) this.totalValidFrags++;
       else this.totalInvalidFrags++;
 
       item.ondragstart = (event) => {
@@ -128,9 +136,7 @@ class ParsonsActivity extends LupBookActivity {
   }
 
   getGroup(frag) {
-    return document.getElementById(
-      `${this.prefixId}-frags-${frag.dataset.gid}`
-    );
+    return this.fragInfo.get(frag).group;
   }
 
   setFragDraggable(frag, draggable) {
@@ -181,7 +187,7 @@ class ParsonsActivity extends LupBookActivity {
     /* Check solution */
     Array.from(this.answerBox.children).forEach((frag) => {
       /* Count number of placed distractors */
-      const fragID = parseInt(frag.dataset.id, 10);
+      const fragID = this.fragInfo.get(frag).id;
       if (fragID === -1) {
         invalidCount++;
         return;
@@ -192,9 +198,7 @@ class ParsonsActivity extends LupBookActivity {
 
       /* If current fragment has no dependency, then it is necessarily properly
        * placed */
-      const fragDepend = frag.dataset.depend
-        ? parseInt(frag.dataset.depend, 10)
-        : null;
+      const fragDepend = this.fragInfo.get(frag).depend;
       if (fragDepend === null) return;
 
       /* If the fragment's dependency has already been visited, then it's
@@ -204,7 +208,7 @@ class ParsonsActivity extends LupBookActivity {
       /* Determine if the missing dependency was misplaced in the answer box, or
        * not placed at all*/
       const dependInAnswerBox = Array.from(this.answerBox.children).some(
-        (child) => parseInt(child.dataset.id, 10) === fragDepend
+        (child) => this.fragInfo.get(child).id === fragDepend
       );
       if (dependInAnswerBox) misplacedCount++;
       else missingCount++;
@@ -0,0 +1,302 @@
+/*
+ * Copyright (c) 2024 LupLab
+ * SPDX-License-Identifier: AGPL-3.0-only
+ */
+
+/*
+ * Full-text search of the book, in the top navbar
+ *
+ * Queries run against the index built with the book (see
+ * `pandoc/lupbook_search.py`) instead of the page: the list of sections and the
+ * shards of the index are only loaded (or parsed, if embedded into the page)
+ * the first time a query needs them. Results are the sections holding all the
+ * words of the query (the last one possibly being the prefix of a word), best
+ * first.
+ */
+class LupbookSearch {
+  static MAX_RESULTS = 12;
+  static MAX_TERM_LEN = 32;
+
+  /* Parts of the index (list of sections, and shards), by name */
+  static parts = new Map();
+
+  /* Called by the scripts of the parts of the index (split-output mode) */
+  static define(name, data) {
+    LupbookSearch.part(name).resolve(data);
+  }
+
+  static part(name) {
+    let part = LupbookSearch.parts.get(name);
+    if (part === undefined) {
+      part = { loading: false };
+      part.promise = new Promise((resolve, reject) => {
+        part.resolve = resolve;
+        part.reject = reject;
+      });
+      LupbookSearch.parts.set(name, part);
+    }
+    return part;
+  }
+
+  /* Terms of text, as indexed (see `terms()` in lupbook_search.py) */
+  static terms(text) {
+    const words = text
+      .toLowerCase()
+      .normalize("NFKD")
+      .replace(/\p{M}/gu, "")
+      .match(/[\p{L}\p{N}_]+/gu);
+    return (words || []).filter((t) => t.length <= LupbookSearch.MAX_TERM_LEN);
+  }
+
+  /* Class members */
+  manifest;
+  input;
+  resultList;
+  mainTOC;
+  rootPage;
+  sections = null;
+  active = -1;
+  queryId = 0;
+
+  /* Class constructor */
+  constructor(elt) {
+    this.manifest = JSON.parse(
+      document.getElementById("lupbook-search-manifest").textContent
+    );
+    this.input = document.getElementById("lb-search-input");
+    this.resultList = document.getElementById("lb-search-results");
+    this.mainTOC = document.getElementById("lb-main-toc-nav");
+    this.rootPage = elt.dataset.lbRootPage || "";
+
+    this.input.addEventListener("focus", () => this.prefetch(), {
+      once: true
+    });
+    this.input.addEventListener("input", () => this.onInput());
+    this.input.addEventListener("keydown", (e) => this.onKeyDown(e));
+    this.input.addEventListener("blur", () => {
+      /* Let clicks on results through first */
+      setTimeout(() => this.showResults(false), 200);
+    });
+
+    /* Focus search with "/", unless typing somewhere else */
+    document.addEventListener("keydown", (e) => {
+      if (e.key !== "/" || e.ctrlKey || e.metaKey || e.altKey) return;
+      if (e.target.closest("input, textarea, select, [contenteditable]"))
+        return;
+      e.preventDefault();
+      this.input.focus();
+    });
+  }
+
+  /* Part of the index, loaded once */
+  load(name) {
+    const part = LupbookSearch.part(name);
+    if (!part.loading) {
+      part.loading = true;
+      const island = document.getElementById(`lupbook-search-${name}`);
+      if (island !== null) {
+        part.resolve(JSON.parse(island.textContent));
+      } else {
+        const url = `${this.manifest.url}/${this.manifest.files[name]}`;
+        const elt = document.createElement("script");
+        elt.src = url;
+        elt.onerror = () => {
+          /* Allow retrying with the next query */
+          LupbookSearch.parts.delete(name);
+          part.reject(new Error(`cannot load ${url}`));
+        };
+        document.head.appendChild(elt);
+      }
+    }
+    return part.promise;
+  }
+
+  /* Shard holding the terms starting like term ({} if none) */
+  shard(term) {
+    const idx = this.manifest.keys[term.slice(0, this.manifest.prefix)];
+    return idx === undefined ? Promise.resolve({}) : this.load(`${idx}`);
+  }
+
+  /* Load list of sections ahead of the first query */
+  prefetch() {
+    this.load("docs")
+      .then((sections) => (this.sections = sections))
+      .catch(() => {});
+  }
+
+  /* Indices of the sections matching query, best first */
+  async search(query) {
+    const terms = LupbookSearch.terms(query);
+    if (!terms.length) return [];
+
+    /* Last word may be incomplete, unless followed by a space */
+    const prefix = !/\s$/.test(query);
+    const shards = await Promise.all(terms.map((t) => this.shard(t)));
+
+    let scores = null;
+    terms.forEach((term, i) => {
+      const shard = shards[i];
+      const expand =
+        prefix && i === terms.length - 1 && term.length >= this.manifest.prefix;
+      const matching = expand
+        ? Object.keys(shard).filter((t) => t.startsWith(term))
+        : term in shard
+          ? [term]
+          : [];
+
+      /* Best weight of the matching terms in each section */
+      const weights = new Map();
+      for (const t of matching) {
+        const postings = shard[t];
+        let section = 0;
+        for (let j = 0; j < postings.length; j += 2) {
+          section += postings[j];
+          weights.set(
+            section,
+            Math.max(weights.get(section) || 0, postings[j + 1])
+          );
+        }
+      }
+
+      /* Sections must match all the terms */
+      if (scores === null) {
+        scores = weights;
+      } else {
+        for (const [section, score] of scores) {
+          if (weights.has(section))
+            scores.set(section, score + weights.get(section));
+          else scores.delete(section);
+        }
+      }
+    });
+
+    return [...scores]
+      .sort((a, b) => b[1] - a[1] || a[0] - b[0])
+      .slice(0, LupbookSearch.MAX_RESULTS)
+      .map(([section]) => section);
+  }
+
+  /* Link to section, on the page holding it */
+  href(idx) {
+    const [id, , page] = this.sections[idx];
+    let base = this.rootPage;
+    if (page !== 0) {
+      /* Page of section in multi-page books, as linked from main TOC */
+      const pageLink = this.mainTOC?.querySelector(
+        `a[href$="#${this.sections[page][0]}"]`
+      );
+      if (pageLink) base = pageLink.getAttribute("href").split("#")[0];
+    }
+    return `${base}#${id}`;
+  }
+
+  async onInput() {
+    const query = this.input.value;
+    const queryId = ++this.queryId;
+    let results;
+    try {
+      [this.sections, results] = await Promise.all([
+        this.load("docs"),
+        this.search(query)
+      ]);
+    } catch (err) {
+      results = err;
+    }
+
+    /* Newer query came in the meantime */
+    if (queryId !== this.queryId) return;
+    this.renderResults(query, results);
+  }
+
+  renderResults(query, results) {
+    this.active = -1;
+    if (!LupbookSearch.terms(query).length) {
+      this.resultList.replaceChildren();
+      this.showResults(false);
+      return;
+    }
+
+    const items = [];
+    if (results instanceof Error) {
+      items.push(this.message(`Search failed: ${results.message}`));
+    } else if (!results.length) {
+      items.push(this.message("No results"));
+    }
+    for (const idx of results instanceof Error ? [] : results) {
+      const [, title, page] = this.sections[idx];
+      const link = document.createElement("a");
+      link.className = "dropdown-item text-truncate";
+      link.href = this.href(idx);
+      link.textContent = title;
+      if (page !== idx) {
+        const pageTitle = document.createElement("small");
+        pageTitle.className = "d-block text-body-secondary text-truncate";
+        pageTitle.textContent = this.sections[page][1];
+        link.appendChild(pageTitle);
+      }
+      link.addEventListener("click", () => this.close());
+      const item = document.createElement("li");
+      item.appendChild(link);
+      items.push(item);
+    }
+    this.resultList.replaceChildren(...items);
+    this.showResults(true);
+  }
+
+  message(text) {
+    const item = document.createElement("li");
+    const span = document.createElement("span");
+    span.className = "dropdown-item-text text-body-secondary";
+    span.textContent = text;
+    item.appendChild(span);
+    return item;
+  }
+
+  showResults(show) {
+    this.resultList.classList.toggle(
+      "show",
+      show && this.resultList.children.length > 0
+    );
+  }
+
+  close() {
+    this.showResults(false);
+    this.input.blur();
+  }
+
+  onKeyDown(e) {
+    const links = [...this.resultList.querySelectorAll("a")];
+    switch (e.key) {
+      case "ArrowDown":
+      case "ArrowUp":
+        if (!links.length) return;
+        e.preventDefault();
+        this.showResults(true);
+        links[this.active]?.classList.remove("active");
+        this.active =
+          e.key === "ArrowDown"
+            ? (this.active + 1) % links.length
+            : (this.active - 1 + links.length) % links.length;
+        links[this.active].classList.add("active");
+        links[this.active].scrollIntoView({ block: "nearest" });
+        break;
+      case "Enter":
+        if (!links.length) return;
+        e.preventDefault();
+        links[Math.max(this.active, 0)].click();
+        break;
+      case "Escape":
+        this.close();
+        break;
+    }
+  }
+}
+
+/*
+ * Initialize search after page loading (if the book has an index)
+ */
+window.addEventListener("DOMContentLoaded", () => {
+  const elt = document.getElementById("lb-search");
+  if (elt !== null && document.getElementById("lupbook-search-manifest"))
+    new LupbookSearch(elt);
+});
@@ -11,6 +11,11 @@ function LupbookTOC() {
   const sectionTOCLevel = parseInt(pageTOC.dataset.level, 10);
   const pageTitle = document.getElementById("lb-page-title");
   const rootSection = document.getElementById("lb-root-section");
+  /* Section shown by default (multi-page books have one section per page) */
+  const pageSection =
+    pageBody.dataset.lbPage !== undefined
+      ? document.getElementById(pageBody.dataset.lbPage)
+      : rootSection;
 
   let currentSectionElt;
   let currentSectionTOC;
@@ -59,7 +64,7 @@ function LupbookTOC() {
     /* Toggle location in main TOC */
     if (currentSectionLvl != 0) {
       const mainTOCLink = mainTOC.querySelector(
-        `a[href="#${currentSectionElt.id}"]`
+        `a[href$="#${currentSectionElt.id}"]`
       );
       setMainTOC(mainTOCLink, show, currentSectionLvl);
     }
@@ -70,29 +75,41 @@ function LupbookTOC() {
     mainTOCOffcanvas.hide();
 
     /* Determine target book section */
-    const sectionElt =
+    const targetElt =
       location.hash !== ""
         ? document.getElementById(location.hash.substring(1))
-        : rootSection;
+        : pageSection;
+
+    /* Section of another page (e.g., link to the single-page book) */
+    if (targetElt === null) {
+      const pageLink = mainTOC.querySelector(`a[href$="${location.hash}"]`);
+      if (pageLink !== null && pageLink.pathname !== location.pathname) {
+        location.replace(pageLink.href);
+        return;
+      }
+      throw new Error("Incorrect hash location");
+    }
+
+    /* Anchor inside of a section (e.g., subsection, or search result): show
+     * the section holding it, then scroll to it */
+    const sectionElt = sectionOf(targetElt);
+    const scrollToTarget = () => {
+      if (targetElt !== sectionElt) targetElt.scrollIntoView();
+    };
 
     /* Section we're already onto */
     if (sectionElt === currentSectionElt) {
-      sectionElt.scrollTo({ top: 0, behavior: "smooth" });
+      if (targetElt === sectionElt)
+        sectionElt.scrollTo({ top: 0, behavior: "smooth" });
+      else scrollToTarget();
       return;
     }
 
     /* Check we're on the right type of section */
-    const sectionTag = sectionElt.tagName;
-    if (sectionElt === undefined || sectionTag !== "SECTION")
-      throw new Error("Incorrect hash location");
+    if (sectionElt === null) throw new Error("Incorrect hash location");
 
     /* Determine section level */
-    const sectionLvl = parseInt(
-      [...sectionElt.classList]
-        .find((cls) => cls.startsWith("level"))
-        .replace("level", ""),
-      10
-    );
+    const sectionLvl = sectionLevel(sectionElt);
 
     /* Get corresponding TOC in the aside */
     const sectionTOC = document.getElementById(`${sectionElt.id}-toc`);
@@ -110,6 +127,7 @@ function LupbookTOC() {
     bootstrap.ScrollSpy.getOrCreateInstance(pageBody).refresh();
 
     window.scrollTo({ top: 0, behavior: "instant" });
+    scrollToTarget();
 
     /* In case some sections contain components that need to be refreshed when
      * shown (such as CodeMirror for icode) */
@@ -120,6 +138,26 @@ function LupbookTOC() {
     );
   }
 
+  /* Level of section element */
+  function sectionLevel(section) {
+    return parseInt(
+      [...section.classList]
+        .find((cls) => cls.startsWith("level"))
+        .replace("level", ""),
+      10
+    );
+  }
+
+  /* Section shown as page body that holds element, or null if none (book
+   * sections have a level, unlike, e.g., footnotes) */
+  function sectionOf(elt) {
+    const selector = 'section[class*="level"]';
+    let section = elt.closest(selector);
+    while (section !== null && sectionLevel(section) > sectionTOCLevel)
+      section = section.parentElement.closest(selector);
+    return section;
+  }
+
   function dispatchShowEvents(section, level, event) {
     section.dispatchEvent(event);
     if (level >= sectionTOCLevel) {
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Run all the lupbook filters (activities and TOC) in a single pass over the
+document, instead of chaining separate filter processes
+"""
+
+import panflute
+
+import lupbook
+import lupbook_assets
+import lupbook_deps
+import lupbook_search
+import lupbook_trace
+import toc_filter
+
+# Prep our data structures, before processing each node
+def _prepare_book_filters(doc):
+    # Profiling trace, if enabled (see lupbook_trace)
+    doc.lupbook_trace = lupbook_trace.trace_path(doc)
+    if doc.lupbook_trace:
+        lupbook_trace.enable()
+
+    lupbook._prepare_lupbook_filters(doc)
+    toc_filter._prepare_toc_filter(doc)
+
+# Called on each element of input document
+def _process_book_filters(element, doc):
+    # TOC collection only looks at headers, while activities replace code
+    # blocks, so both can share the same traversal
+    toc_filter._process_toc_filter(element, doc)
+    return lupbook._process_lupbook_filters(element, doc)
+
+# Finalize our output after processing the entire document
+def _finalize_book_filters(doc):
+    lupbook._finalize_lupbook_filters(doc)
+    toc_filter._finalize_toc_filter(doc)
+    lupbook_assets.finalize_assets(doc)
+    lupbook_search.finalize_search(doc, [b.to_json() for b in doc.content])
+
+    # Dependencies of the output on the files included by activities, which
+    # only the filters know about (see Makefile)
+    target = doc.get_metadata("lupbook-deps-target", default = None)
+    if target:
+        lupbook_deps.write_deps(target, [*doc.lupbook_includes,
+                                         *lupbook_deps.lupbook_sources(),
+                                         *lupbook_deps.plugin_sources()])
+
+    if doc.lupbook_trace:
+        lupbook_trace.finish(doc.lupbook_trace)
+
+def filter_doc(doc):
+    """ Apply all the filters to an already loaded document """
+    return panflute.run_filter(_process_book_filters,
+                               prepare = _prepare_book_filters,
+                               finalize = _finalize_book_filters,
+                               doc = doc)
+
+if __name__ == "__main__":
+    panflute.run_filter(_process_book_filters,
+                        prepare = _prepare_book_filters,
+                        finalize = _finalize_book_filters)
@@ -3,12 +3,9 @@
 
 import re
 
-from dominate.tags import div, input_, span
-from dominate.util import raw
-
 import lupbook_filter
 import fib_schema
-import panflute
+from lupbook_html import div, input_, span, raw
 
 #
 # Activity HTML generation
@@ -47,16 +44,14 @@ class LupbookFIB(lupbook_filter.LupbookComponent):
 
         idx_blank = 0
         blanks = self.conf["blanks"]
-        casing = self.conf["casing"]
 
         with div(cls="card-body px-3 pt-0 pb-2 m-0"):
-            with div(id = f"{self.prefix_id}-casing-div", data_casing=str(casing)):
+            with div(id = f"{self.prefix_id}-casing-div"):
                 for idx_para, para in enumerate(paragraphs):
                     with div(cls="fib-text d-flex flex-row flex-wrap align-items-baseline"):
                         parts = para.split("|blank|")
                         for idx_part, part in enumerate(parts):
-                            formatted_text = panflute.convert_text(
-                                    part, output_format='html')
+                            formatted_text = self._markdown(part)
                             div(raw(formatted_text))
 
                             # If there is blank spaces behind, generate input HTML
@@ -66,17 +61,19 @@ class LupbookFIB(lupbook_filter.LupbookComponent):
                                 with div(cls="input-group input-group-sm px-2 w-auto"):
                                     input_(cls="form-control",
                                            type = "text",
-                                           placeholder = blank["type"],
-                                           data_answer = blank["answer"])
+                                           placeholder = blank["type"])
                                     span(str(idx_blank),
                                          cls = "input-group-text fw-medium")
 
+    def data(self):
+        return { "casing": self.conf["casing"],
+                "answers": [blank["answer"] for blank in self.conf["blanks"]] }
+
     def _gen_testing_activity(self):
         div(id = f"{self.prefix_id}-testing-score",
             cls = "alert d-none")
         for i, blank in enumerate(self.conf["blanks"]):
-            formatted_text = panflute.convert_text(
-                    blank["feedback"], output_format = 'html')
+            formatted_text = self._markdown(blank["feedback"])
             with div(id=f"{self.prefix_id}-feedback-{i}",
                      cls="d-flex align-items-center fib-feedback-item m-1 p-2 border-start border-5 d-none"):
                 span(str(i + 1),
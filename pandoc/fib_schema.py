@@ -49,6 +49,6 @@ _fib_schema = {
     "additionalProperties": False
 }
 
-fib_validator = lupbook_schema.LupbookValidator(
+fib_validator = lupbook_schema.CompiledValidator(
         _fib_schema,
         format_checker = lupbook_schema.lupbook_format_checker)
@@ -1,11 +1,9 @@
 # Copyright (c) 2024 LupLab
 # SPDX-License-Identifier: AGPL-3.0-only
 
-from dominate.tags import div, span
-from dominate.util import raw
-
 import parsons_filter
 import hparsons_schema
+from lupbook_html import div, span, raw
 import panflute
 
 
@@ -44,7 +42,7 @@ class LupbookHParsons(parsons_filter.LupbookParsons):
                     with div(id = f"{self.prefix_id}-frags-{i}",
                              cls = "parsons-frags-group position-relative"
                              " rounded bg-white"):
-                        self._gen_frag_block(frag, "my-2 mx-1", i, i)
+                        self._gen_frag_block(frag, "my-2 mx-1", i)
 
             div("...and drop them here (click to remove)",
                 cls = "ps-2 pt-2 small fst-italic text-secondary")
@@ -50,6 +50,6 @@ _hparsons_schema = {
     "additionalProperties": False
 }
 
-hparsons_validator = lupbook_schema.LupbookValidator(
+hparsons_validator = lupbook_schema.CompiledValidator(
         _hparsons_schema,
         format_checker = lupbook_schema.lupbook_format_checker)
@@ -1,25 +1,15 @@
 # Copyright (c) 2021 LupLab
 # SPDX-License-Identifier: AGPL-3.0-only
 
-import base64
-import json
-
-from dominate.tags import button, div, i, li, textarea, ul
-
 import icode_schema
 import lupbook_filter
+from lupbook_html import button, div, i, li, textarea, ul
 
 
 #
 # Various helpers
 #
 
-def _encode_html_attr(obj):
-    """
-    Encode JSON portion into base64
-    """
-    return base64.b64encode(json.dumps(obj).encode()).decode()
-
 def _normalize_line_ranges(yaml_rangelist, max_lines):
     """
     Process a list of line ranges
@@ -76,10 +66,10 @@ def _negate_line_ranges(rangelist, max_lines):
 
     return negated
 
-def _encode_rdonly(yaml_ro, file_data):
-    if yaml_ro is None:
-        return ""
-
+def _readonly_ranges(yaml_ro, file_data):
+    """
+    Readonly lines of file: True if the whole file, or list of line ranges
+    """
     endl = file_data.count("\n") + 1
 
     if isinstance(yaml_ro, bool):
@@ -94,7 +84,7 @@ def _encode_rdonly(yaml_ro, file_data):
     if negate:
         rangelist = _negate_line_ranges(rangelist, endl)
 
-    return _encode_html_attr(rangelist)
+    return rangelist
 
 
 #
@@ -157,11 +147,9 @@ class LupbookICode(lupbook_filter.LupbookComponent):
                     textarea_args = {
                         "data_tab": f"{file_uid}-tab",
                         "data_filename": file_name,
+                        "data_mode": lupbook_filter.language(file_name),
                         "cls": "icode-srcfile"
                     }
-                    if src_file["readonly"]:
-                        textarea_args["data_readonly"] = _encode_rdonly(
-                                src_file["readonly"], src_file["data"])
 
                     with div(cls = "tab-pane"
                              + (" active" if active_tab == file_name else ""),
@@ -169,28 +157,31 @@ class LupbookICode(lupbook_filter.LupbookComponent):
                              role = "tabpanel"):
                         textarea(src_file["data"], **textarea_args)
 
+    def data(self):
+        # Tests to run, and readonly lines of source files by file name
+        readonly = { src_file["filename"]: _readonly_ranges(
+                        src_file["readonly"], src_file["data"])
+                    for src_file in self.conf["skeleton"]
+                    if src_file["readonly"] }
+        return { "tests": self.conf["tests"], "readonly": readonly }
+
     def _gen_testing_activity(self):
-        accord_div = div(cls = "accordion accordion-flush")
-
-        for idx, test in enumerate(self.conf["tests"]):
-            test_id = f"{self.prefix_id}-test-{idx:d}"
-
-            # One accordion item per test to run
-            accord_item_div = div(cls = "accordion-item icode-test",
-                data_params = _encode_html_attr(test))
-            with accord_item_div:
-                # Accordion header
-                with div(cls = "accordion-header"):
-                    with button(id = f"{test_id}-btn",
-                                cls = "accordion-button collapsed",
-                                type = "button",
-                                disabled = True,
-                                data_bs_toggle = "collapse",
-                                data_bs_target = "#{}".format(test_id)):
-                        i(cls = "bi bi-dash-circle-fill text-secondary me-1")
-                        div(test["name"])
-                # Accordion body
-                with div(id = test_id, cls = "accordion-collapse collapse"):
-                    div(id = f"{test_id}-testing", cls = "accordion-body")
-
-            accord_div += accord_item_div
+        with div(cls = "accordion accordion-flush"):
+            for idx, test in enumerate(self.conf["tests"]):
+                test_id = f"{self.prefix_id}-test-{idx:d}"
+
+                # One accordion item per test to run
+                with div(cls = "accordion-item icode-test"):
+                    # Accordion header
+                    with div(cls = "accordion-header"):
+                        with button(id = f"{test_id}-btn",
+                                    cls = "accordion-button collapsed",
+                                    type = "button",
+                                    disabled = True,
+                                    data_bs_toggle = "collapse",
+                                    data_bs_target = "#{}".format(test_id)):
+                            i(cls = "bi bi-dash-circle-fill text-secondary me-1")
+                            div(test["name"])
+                    # Accordion body
+                    with div(id = test_id, cls = "accordion-collapse collapse"):
+                        div(id = f"{test_id}-testing", cls = "accordion-body")
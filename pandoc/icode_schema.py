@@ -165,6 +165,6 @@ _icode_schema = {
     "additionalProperties": False
 }
 
-icode_validator = lupbook_schema.LupbookValidator(
+icode_validator = lupbook_schema.CompiledValidator(
         _icode_schema,
         format_checker = lupbook_schema.lupbook_format_checker)
@@ -3,14 +3,183 @@
 # Copyright (c) 2021 LupLab
 # SPDX-License-Identifier: AGPL-3.0-only
 
+import json
+import sys
+
 import panflute
 
-import fib_filter
-import icode_filter
-import matching_filter
-import mcq_filter
-import parsons_filter
-import hparsons_filter
+import lupbook_cache
+import lupbook_filter
+import lupbook_ids
+import lupbook_parallel
+import lupbook_registry
+import lupbook_trace
+
+# Prep our data structures, before processing each node
+def _prepare_lupbook_filters(doc):
+    # Additional activity types declared by the book, mapping activity ids to
+    # their implementation (e.g., `myactivity: myactivity.py:LupbookMine`)
+    lupbook_registry.register_activities(
+            doc.get_metadata("lupbook-activities", default = {}))
+
+    # In-memory cache of included files, which outlives the document if the
+    # process builds several ones (e.g., filter daemon)
+    lupbook_filter.include_cache.max_size = \
+            lupbook_cache.include_cache_size(doc)
+    lupbook_filter.include_cache.reset_stats()
+
+    # Persistent cache of converted markdown fragments, shared across builds
+    doc.lupbook_md_cache = lupbook_cache.LupbookCache.open("markdown", doc)
+
+    # Two-phase mode: markdown fragments of all the activities are collected
+    # while processing the document, and converted at once when finalizing
+    if doc.get_metadata("lupbook-markdown-batch", default = True):
+        doc.lupbook_md_batch = lupbook_filter.MarkdownBatch(doc.lupbook_md_cache)
+    else:
+        doc.lupbook_md_batch = None
+
+    # Persistent cache of rendered activities, shared across builds
+    doc.lupbook_activity_cache = lupbook_cache.LupbookCache.open("activities",
+                                                                 doc)
+
+    # Generated blocks which may contain placeholders to be resolved
+    doc.lupbook_blocks = []
+
+    # All activity blocks (rendered, cached or pending), to find out which
+    # scripts and styles the document needs once finalized
+    doc.lupbook_activities = []
+
+    # Data of the activities (e.g., answers), keyed by activity ID, gathered
+    # into a single data island once finalized
+    doc.lupbook_data = {}
+
+    # Freshly rendered activities to store in cache once finalized
+    doc.lupbook_uncached = []
+
+    # Files included by the activities, with the digest of their content
+    doc.lupbook_includes = {}
+
+    # Whether some activities are randomized (and thus differ with each build)
+    doc.lupbook_random = False
+
+    # Parallel mode: activities are collected while processing the document,
+    # and rendered by a pool of worker processes when finalizing
+    doc.lupbook_jobs = lupbook_parallel.jobs_count(doc)
+    doc.lupbook_pending = []
+
+    # IDs of the activities, in document order, either as index entries or as
+    # indices into the pending list (until rendered). In parallel mode, or if
+    # the document is a single source of the book, IDs are registered
+    # first-come and non-unique IDs are only reported once all the activities
+    # are rendered, in document order: by `_check_ids()`, or by the caller for
+    # a single source (e.g., `lupbook_chapters`, in book order).
+    doc.lupbook_id_entries = []
+
+    # Index of activity IDs, shared with the worker processes. IDs must be
+    # unique within this document only, even if the same process processes
+    # several documents (e.g., build API or filter daemon). If the document is
+    # a single source of the book (e.g., incremental builds), only the entries
+    # of that source are replaced.
+    doc.lupbook_ids = lupbook_ids.IdIndex.open(doc,
+                                               shared = doc.lupbook_jobs > 1)
+    doc.lupbook_ids_source = doc.get_metadata("lupbook-ids-source",
+                                              default = None)
+    if doc.lupbook_ids_source is None:
+        doc.lupbook_ids.clear()
+    else:
+        doc.lupbook_ids.remove_source(doc.lupbook_ids_source)
+
+def _required_types(types):
+    # Activity types also need the scripts and styles of the types they derive
+    # from (e.g., hparsons activities need those of parsons)
+    required = set(types)
+    for activity_type in types:
+        cls = lupbook_registry.get_activity(activity_type)
+        if cls is None:
+            continue
+        required.update(c.activity_id() for c in cls.__mro__
+                        if "activity_id" in vars(c)
+                        and c is not lupbook_filter.LupbookComponent)
+    return required
+
+def set_activity_assets(doc, types, modes):
+    # Activity types used by the document and CodeMirror modes of its code
+    # editors, so that the template only includes what they need (e.g.,
+    # `$if(lupbook-types.icode)$` or `$if(lupbook-modes.python)$`)
+    doc.metadata["lupbook-types"] = { t: True
+                                     for t in sorted(_required_types(types)) }
+    doc.metadata["lupbook-modes"] = { m: True for m in sorted(modes) }
+
+def _collect_activity_assets(doc):
+    doc.lupbook_types = set()
+    doc.lupbook_modes = set()
+    for block in doc.lupbook_activities:
+        doc.lupbook_types |= lupbook_filter.activity_types(block.text)
+        doc.lupbook_modes |= lupbook_filter.editor_modes(block.text)
+    set_activity_assets(doc, doc.lupbook_types, doc.lupbook_modes)
+
+def set_activity_data(doc, data):
+    # Data of the activities as a single JSON island, which the template
+    # embeds verbatim (e.g., `<script type="application/json"
+    # id="lupbook-data">$lupbook-data$</script>`). Only strings can contain
+    # `<`, so escaping it keeps the island from closing its script element.
+    data = { ident: d for ident, d in data.items() if d }
+    if not data:
+        if "lupbook-data" in doc.metadata:
+            del doc.metadata["lupbook-data"]
+        return
+    text = json.dumps(data, separators = (",", ":"), sort_keys = True)
+    doc.metadata["lupbook-data"] = panflute.MetaBlocks(
+            panflute.RawBlock(text.replace("<", "\\u003c"), 'html'))
+
+def activity_data(doc):
+    """ Data of the activities of (finalized) document, keyed by activity ID """
+    if "lupbook-data" not in doc.metadata:
+        return {}
+    return json.loads(doc.metadata["lupbook-data"].content[0].text)
+
+def activity_ids(doc):
+    """ ID index entries of the activities of (finalized) document, in order """
+    return doc.lupbook_id_entries
+
+def _activity_cache_key(lb_filter, text):
+    # Markdown conversions depend on the version of pandoc
+    return lupbook_cache.digest("activity", lb_filter.activity_id(),
+                                lb_filter.code_version(),
+                                lupbook_filter._pandoc_version(), text)
+
+def _is_activity_fresh(entry):
+    # Included files must not have changed since the activity was rendered
+    return all(lupbook_cache.file_digest(fname) == digest
+               for fname, digest in json.loads(entry)["includes"])
+
+def _id_entry(doc, ident, activity_type, text):
+    return { "id": ident, "type": activity_type,
+            "source": doc.lupbook_ids_source, "line": None,
+            "digest": lupbook_ids.activity_digest(text) }
+
+def _register_activity(doc, ident, lb_filter, text):
+    entry = _id_entry(doc, ident, lb_filter.activity_id(), text)
+    if doc.lupbook_jobs > 1 or doc.lupbook_ids_source is not None:
+        doc.lupbook_ids.add(ident, entry["type"], entry["source"],
+                            digest = entry["digest"])
+    else:
+        doc.lupbook_ids.register(ident, entry["type"], entry["source"],
+                                 digest = entry["digest"])
+    doc.lupbook_id_entries.append(entry)
+
+def _get_cached_activity(doc, key, lb_filter, text):
+    entry = doc.lupbook_activity_cache.get(key, _is_activity_fresh)
+    if entry is None:
+        return None
+    entry = json.loads(entry)
+
+    # Cached activities still take part in the uniqueness check of IDs
+    _register_activity(doc, entry["id"], lb_filter, text)
+    doc.lupbook_includes.update(entry["includes"])
+    doc.lupbook_data[entry["id"]] = entry["data"]
+
+    return panflute.RawBlock(entry["html"], 'html')
 
 def _process_lupbook_filters(element, doc):
     # Quit early when incorrect type of element
@@ -22,24 +191,139 @@ def _process_lupbook_filters(element, doc):
     # Otherwise, we don't have a good way of pointing where errors are.
     # => if element.ident == "": raise Exception
 
-    # Find the corresponding lupbook filter if any
+    # Find the corresponding lupbook filter if any (imported on first use)
     # NOTE: we only look at the first element class
-    lb_filters = [
-        fib_filter.LupbookFIB,
-        hparsons_filter.LupbookHParsons,
-        icode_filter.LupbookICode,
-        matching_filter.LupbookMatching,
-        mcq_filter.LupbookMCQ,
-        parsons_filter.LupbookParsons,
-        ]
-    lb_filter_map = { f.activity_id(): f for f in lb_filters }
-    try:
-        lb_filter = lb_filter_map[element.classes[0]]
-    except KeyError:
+    if not element.classes:
         return
+    lb_filter = lupbook_registry.get_activity(element.classes[0])
+    if lb_filter is None:
+        return
+
+    # Skip loading, validation and rendering if activity was already rendered
+    key = None
+    if doc.lupbook_activity_cache is not None:
+        key = _activity_cache_key(lb_filter, element.text)
+        block = _get_cached_activity(doc, key, lb_filter, element.text)
+        if block is not None:
+            doc.lupbook_activities.append(block)
+            return block
+
+    # Leave an empty block for now, to be filled once rendered by a worker
+    if doc.lupbook_jobs > 1:
+        block = panflute.RawBlock("", 'html')
+        doc.lupbook_id_entries.append(len(doc.lupbook_pending))
+        doc.lupbook_pending.append((lb_filter.activity_id(), element.text,
+                                    key, block))
+        doc.lupbook_activities.append(block)
+        return block
 
     # Found an element we know how to process!
-    return lb_filter(element.text).process()
+    with lupbook_trace.span("activity", type = lb_filter.activity_id()) as args:
+        activity = lb_filter(element.text)
+        args["activity"] = activity.conf["id"]
+        _register_activity(doc, activity.conf["id"], lb_filter, element.text)
+        block = activity.process(doc.lupbook_md_batch, doc.lupbook_md_cache)
+    doc.lupbook_blocks.append(block)
+    doc.lupbook_activities.append(block)
+    doc.lupbook_data[activity.conf["id"]] = activity.data()
+
+    includes = [(fname, lupbook_cache.file_digest(fname))
+                for fname in activity.includes]
+    doc.lupbook_includes.update(includes)
+    doc.lupbook_random |= activity.conf.get("random", False)
+
+    # Randomized activities get shuffled anew by each build
+    if doc.lupbook_activity_cache is not None \
+            and not activity.conf.get("random", False):
+        doc.lupbook_uncached.append((key, activity.conf["id"], includes,
+                                     doc.lupbook_data[activity.conf["id"]],
+                                     block))
+
+    return block
+
+def _check_ids(doc, results):
+    """
+    Fill in IDs of rendered pending activities, and report the first
+    non-unique ID in document order, whichever activity got to register it
+    (unless left to the caller)
+    """
+    first = {}
+    for i, entry in enumerate(doc.lupbook_id_entries):
+        if isinstance(entry, int):
+            activity_id, text, _, _ = doc.lupbook_pending[entry]
+            result = results[entry]
+            if "error" in result:
+                raise Exception(result["error"])
+            entry = _id_entry(doc, result["id"], activity_id, text)
+            doc.lupbook_id_entries[i] = entry
+
+        if doc.lupbook_ids_source is None and entry["id"] in first:
+            raise lupbook_ids.non_unique_error(entry, first[entry["id"]])
+        first[entry["id"]] = entry
+
+def _render_pending_activities(doc):
+    activities = [(activity_id, text)
+                  for activity_id, text, _, _ in doc.lupbook_pending]
+    results = lupbook_parallel.render_activities(
+            activities, doc.lupbook_jobs, doc.lupbook_md_cache,
+            doc.lupbook_md_batch is not None,
+            (doc.lupbook_ids.path, doc.lupbook_ids_source))
+
+    # Check results and IDs in document order
+    _check_ids(doc, results)
+
+    for (_, _, key, block), result in zip(doc.lupbook_pending, results):
+        block.text = result["html"]
+        doc.lupbook_data[result["id"]] = result["data"]
+        doc.lupbook_includes.update(result["includes"])
+        doc.lupbook_random |= result["random"]
+        if doc.lupbook_activity_cache is not None and not result["random"]:
+            doc.lupbook_uncached.append((key, result["id"],
+                                         result["includes"], result["data"],
+                                         block))
+
+# Finalize our output after processing the entire document
+def _finalize_lupbook_filters(doc):
+    if doc.lupbook_pending:
+        with lupbook_trace.span("render_pending",
+                                count = len(doc.lupbook_pending)):
+            _render_pending_activities(doc)
+    else:
+        _check_ids(doc, [])
+
+    # Convert all the markdown fragments in one pandoc run, and splice them
+    # into the generated activities
+    if doc.lupbook_md_batch is not None:
+        with lupbook_trace.span("markdown_batch",
+                                count = len(doc.lupbook_md_batch.fragments)):
+            doc.lupbook_md_batch.convert()
+        for block in doc.lupbook_blocks:
+            block.text = doc.lupbook_md_batch.resolve(block.text)
+
+    if doc.lupbook_activity_cache is not None:
+        for key, ident, includes, data, block in doc.lupbook_uncached:
+            entry = { "id": ident, "includes": includes, "data": data,
+                     "html": block.text }
+            doc.lupbook_activity_cache.put(key, json.dumps(entry))
+
+    if doc.get_metadata("lupbook-stats", default = False):
+        sys.stderr.write("Include cache: {}.\n".format(
+            lupbook_filter.include_cache.stats()))
+
+    _collect_activity_assets(doc)
+    set_activity_data(doc, doc.lupbook_data)
+    doc.lupbook_ids.close()
+
+    caches = [("Activity", doc.lupbook_activity_cache),
+              ("Markdown", doc.lupbook_md_cache)]
+    for name, cache in caches:
+        if cache is None:
+            continue
+        if doc.get_metadata("lupbook-stats", default = False):
+            sys.stderr.write("{} cache: {}.\n".format(name, cache.stats()))
+        cache.close()
 
 if __name__ == "__main__":
-    panflute.run_filter(_process_lupbook_filters)
+    panflute.run_filter(_process_lupbook_filters,
+                        prepare = _prepare_lupbook_filters,
+                        finalize = _finalize_lupbook_filters)
@@ -0,0 +1,320 @@
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Assets referenced by the template (scripts, stylesheets and the files they
+refer to), exposed to the template as the `lupbook-assets` map, e.g.
+`$lupbook-assets.xterm-js$`
+
+By default, assets are referenced where they are, to be embedded into the book
+by pandoc. In split-output mode (`lupbook-assets-dir` set to a directory), they
+that the book uses (the same the template references, see `used_assets()`) are
+instead copied into that directory under content-hashed names, next to
+their gzip and brotli variants (the latter if the `brotli` module is
+installed), along with a manifest mapping their logical names to their hashed
+names. The book then references them by URL (`lupbook-assets-url`, by default
+the name of the directory, i.e. relative to a book written next to it), so that
+browsers can cache unchanged assets indefinitely across book updates.
+
+With `lupbook-bundle`, the front-end modules are also available as a single
+script and a single stylesheet (see `lupbook_bundle`), as `bundle-js` and
+`bundle-css`.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+import lupbook_bundle
+import lupbook_search
+
+# Lupbook directory (where `modules/`, `node_modules/` and `build/` are)
+LBDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Assets of the template, in order, as `(root, path, requires)` where the root
+# is the lupbook directory ("lbdir") or the book's directory ("book"), and
+# `requires` lists the conditions under which the template references the
+# asset: activity types (e.g., "types.icode") and CodeMirror modes (e.g.,
+# "modes.python") used by the book, search enabled ("search"), or front-end
+# modules not bundled ("unbundled")
+ASSETS = [
+    ("lbdir", "node_modules/@xterm/xterm/lib/xterm.js", ["types.icode"]),
+    ("lbdir", "node_modules/@xterm/addon-fit/lib/addon-fit.js",
+     ["types.icode"]),
+    ("lbdir", "node_modules/@xterm/xterm/css/xterm.css", ["types.icode"]),
+    ("lbdir", "node_modules/codemirror/lib/codemirror.css", ["types.icode"]),
+    ("lbdir", "node_modules/codemirror/lib/codemirror.js", ["types.icode"]),
+    ("lbdir", "node_modules/codemirror/addon/edit/matchbrackets.js",
+     ["types.icode"]),
+    ("lbdir", "node_modules/codemirror/mode/clike/clike.js",
+     ["types.icode", "modes.clike"]),
+    ("lbdir", "node_modules/codemirror/mode/gas/gas.js",
+     ["types.icode", "modes.gas"]),
+    ("lbdir", "node_modules/codemirror/mode/go/go.js",
+     ["types.icode", "modes.go"]),
+    ("lbdir", "node_modules/codemirror/mode/javascript/javascript.js",
+     ["types.icode", "modes.javascript"]),
+    ("lbdir", "node_modules/codemirror/mode/python/python.js",
+     ["types.icode", "modes.python"]),
+    ("lbdir", "node_modules/codemirror/mode/shell/shell.js",
+     ["types.icode", "modes.shell"]),
+    ("lbdir", "node_modules/bootstrap/dist/css/bootstrap.min.css", []),
+    ("lbdir", "node_modules/bootstrap-icons/font/bootstrap-icons.min.css", []),
+    ("lbdir", "node_modules/bootstrap/dist/js/bootstrap.min.js", []),
+    ("lbdir", "build/lupbookvm.js", ["types.icode"]),
+    ("lbdir", "modules/lupbook.js", ["unbundled"]),
+    ("lbdir", "modules/toc.js", ["unbundled"]),
+    ("lbdir", "modules/search.js", ["unbundled", "search"]),
+    ("lbdir", "modules/fib.js", ["unbundled", "types.fib"]),
+    ("lbdir", "modules/icode.js", ["unbundled", "types.icode"]),
+    ("lbdir", "modules/matching.js", ["unbundled", "types.matching"]),
+    ("lbdir", "modules/mcq.js", ["unbundled", "types.mcq"]),
+    ("lbdir", "modules/parsons.js", ["unbundled", "types.parsons"]),
+    ("lbdir", "modules/hparsons.js", ["unbundled", "types.hparsons"]),
+    ("lbdir", "modules/lupbook.css", ["unbundled"]),
+    ("lbdir", "modules/fib.css", ["unbundled", "types.fib"]),
+    ("lbdir", "modules/icode.css", ["unbundled", "types.icode"]),
+    ("lbdir", "modules/matching.css", ["unbundled", "types.matching"]),
+    ("lbdir", "modules/mcq.css", ["unbundled", "types.mcq"]),
+    ("lbdir", "modules/parsons.css", ["unbundled", "types.parsons"]),
+    ("book", "template.css", []),
+]
+
+# Manifest of published assets, in the assets directory
+MANIFEST = "manifest.json"
+
+# Length of the content hash in the names of published assets
+HASH_LEN = 12
+
+# References to other files in stylesheets (e.g., fonts)
+_CSS_URL_RE = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+# URLs which aren't relative paths
+_ABSOLUTE_URL_RE = re.compile(r'^([a-z][a-z0-9+.-]*:|/|#)', re.IGNORECASE)
+
+def assets_dir(doc = None):
+    """ Directory assets are published into, or None if not split """
+    path = os.environ.get("LUPBOOK_ASSETS_DIR")
+    if doc is not None:
+        path = doc.get_metadata("lupbook-assets-dir", default = path)
+    return path or None
+
+def assets_url(doc, out_dir):
+    """ URL the book references the assets published into `out_dir` by """
+    return doc.get_metadata("lupbook-assets-url", default = None) \
+            or os.path.basename(os.path.normpath(out_dir))
+
+def default_dir(output):
+    """ Assets directory of the book built into `output` """
+    return os.path.join(os.path.dirname(os.path.abspath(output)), "assets")
+
+def template_key(path):
+    """ Key of asset in the `lupbook-assets` template map """
+    return os.path.basename(path).replace(".", "-")
+
+def _source(root, path):
+    return os.path.join(LBDIR, path) if root == "lbdir" \
+            else os.path.join(os.curdir, path)
+
+def used_assets(doc, bundled = False):
+    """
+    Assets the template references for document (i.e., once `lupbook-types`
+    and `lupbook-modes` are set), as `(root, path, optional)`
+    """
+    met = { f"types.{t}" for t in doc.get_metadata("lupbook-types",
+                                                   default = {}) }
+    met.update(f"modes.{m}" for m in doc.get_metadata("lupbook-modes",
+                                                      default = {}))
+    if lupbook_search.is_enabled(doc):
+        met.add("search")
+    if not bundled:
+        met.add("unbundled")
+    return [(root, path, bool(requires)) for root, path, requires in ASSETS
+            if met.issuperset(requires)]
+
+#
+# Compression
+#
+
+def _write(fname, data):
+    """ Write file atomically, so readers never see a partial file """
+    tmp = f"{fname}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, fname)
+
+def compress(fname, data = None):
+    """
+    Write the gzip and brotli variants of file next to it, unless they
+    wouldn't be any smaller (e.g., fonts)
+    """
+    if data is None:
+        with open(fname, 'rb') as f:
+            data = f.read()
+
+    variants = [(".gz", gzip.compress(data, compresslevel = 9, mtime = 0))]
+    if brotli is not None:
+        variants.append((".br", brotli.compress(data)))
+    elif not getattr(compress, "warned", False):
+        compress.warned = True
+        sys.stderr.write("Warning: brotli module not found, no .br files\n")
+
+    for ext, compressed in variants:
+        if len(compressed) < len(data):
+            _write(fname + ext, compressed)
+        elif os.path.exists(fname + ext):
+            os.remove(fname + ext)
+
+#
+# Publication
+#
+
+class Publisher:
+    """ Copy of assets into a directory, under content-hashed names """
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        # Logical name of each asset, mapped to its published name
+        self.manifest = {}
+
+    @staticmethod
+    def _logical_name(fname):
+        fname = os.path.abspath(fname)
+        if fname.startswith(LBDIR + os.sep):
+            return os.path.relpath(fname, LBDIR)
+        return os.path.relpath(fname)
+
+    def publish(self, fname, name = None):
+        """
+        Publish file (if not already), return its published name. Files whose
+        name is already content-hashed (e.g., bundles) are given their logical
+        `name`, and keep their own.
+        """
+        hashed = name is not None
+        if not hashed:
+            name = self._logical_name(fname)
+        if name in self.manifest:
+            return self.manifest[name]
+
+        if not os.path.isfile(fname):
+            raise Exception(f"Asset '{name}' not found ({fname})")
+        with open(fname, 'rb') as f:
+            data = f.read()
+        if fname.endswith(".css"):
+            data = self._rewrite_css(fname, data)
+
+        if hashed:
+            published = os.path.basename(fname)
+        else:
+            stem, ext = os.path.splitext(os.path.basename(fname))
+            digest = hashlib.sha256(data).hexdigest()[:HASH_LEN]
+            published = f"{stem}.{digest}{ext}"
+        target = os.path.join(self.out_dir, published)
+
+        # Same name means same content, so only new files need writing
+        if not os.path.exists(target):
+            _write(target, data)
+            compress(target, data)
+
+        self.manifest[name] = published
+        return published
+
+    def _rewrite_css(self, fname, data):
+        """ Publish the files stylesheet refers to, and refer to those """
+        def replace(match):
+            quote, url = match.groups()
+            if _ABSOLUTE_URL_RE.match(url):
+                return match.group(0)
+
+            path, sep, suffix = url.partition("#")
+            ref = os.path.join(os.path.dirname(fname), path.split("?")[0])
+            if not os.path.isfile(ref):
+                return match.group(0)
+            return f"url({quote}{self.publish(ref)}{sep}{suffix}{quote})"
+
+        return _CSS_URL_RE.sub(replace, data.decode('utf-8')).encode('utf-8')
+
+    def write_manifest(self):
+        data = json.dumps(self.manifest, indent = 1, sort_keys = True) + "\n"
+        _write(os.path.join(self.out_dir, MANIFEST), data.encode('utf-8'))
+
+def publish_data(out_dir, stem, ext, data):
+    """
+    Publish data generated by the build (e.g., search index) into `out_dir`
+    under a content-hashed name, return that name
+    """
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LEN]
+    published = f"{stem}.{digest}{ext}"
+    target = os.path.join(out_dir, published)
+    if not os.path.exists(target):
+        _write(target, data)
+        compress(target, data)
+    return published
+
+def publish_assets(out_dir, assets, bundle = None):
+    """
+    Publish template assets (list of `(root, path, optional)`, see
+    `used_assets()`) and bundle (if any) into `out_dir`, return the publisher
+    and the published assets. Optional assets which are missing (e.g., VM not
+    built) are skipped with a warning.
+    """
+    os.makedirs(out_dir, exist_ok = True)
+    publisher = Publisher(out_dir)
+    published = []
+    for root, path, optional in assets:
+        fname = _source(root, path)
+        if optional and not os.path.isfile(fname):
+            sys.stderr.write(f"Warning: asset '{path}' not found, skipped\n")
+            continue
+        publisher.publish(fname)
+        published.append((root, path))
+    if bundle is not None:
+        publisher.publish(bundle.js, "bundle.js")
+        publisher.publish(bundle.css, "bundle.css")
+        if bundle.map is not None:
+            publisher.publish(bundle.map, "bundle.js.map")
+    publisher.write_manifest()
+    return publisher, published
+
+def _bundle(doc, split):
+    """ Bundle of the modules of the activity types used by the book """
+    source_map = None
+    if lupbook_bundle.has_source_map(doc):
+        source_map = "file" if split else "inline"
+    types = doc.get_metadata("lupbook-types", default = {})
+    return lupbook_bundle.get_bundle(lupbook_bundle.modules(types), source_map,
+                                     doc)
+
+def finalize_assets(doc):
+    """ Set `lupbook-assets` template map, publishing assets if split """
+    out_dir = assets_dir(doc)
+    bundle = None
+    if lupbook_bundle.is_enabled(doc):
+        bundle = _bundle(doc, out_dir is not None)
+        # Also when enabled from the environment
+        doc.metadata["lupbook-bundle"] = True
+
+    if out_dir is None:
+        urls = { template_key(path): f"{LBDIR}/{path}" if root == "lbdir"
+                else f"./{path}" for root, path, _ in ASSETS }
+        if bundle is not None:
+            urls.update({ "bundle-js": bundle.js, "bundle-css": bundle.css })
+    else:
+        # Only the assets the template references are published
+        url = assets_url(doc, out_dir)
+        publisher, published = publish_assets(
+                out_dir, used_assets(doc, bundle is not None), bundle)
+        urls = { template_key(path):
+                f"{url}/{publisher.publish(_source(root, path))}"
+                for root, path in published }
+        if bundle is not None:
+            urls["bundle-js"] = f"{url}/{publisher.manifest['bundle.js']}"
+            urls["bundle-css"] = f"{url}/{publisher.manifest['bundle.css']}"
+    doc.metadata["lupbook-assets"] = urls
@@ -0,0 +1,152 @@
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Python API for building books: pandoc parses the markdown sources and writes
+the HTML output, while all the lupbook filters run in-process over the loaded
+document
+"""
+
+import glob
+import io
+import os
+import subprocess
+
+import panflute
+
+import book_filter
+import lupbook_assets
+import lupbook_deps
+import lupbook_ids
+import lupbook_pages
+
+# Lupbook directory (where `modules/`, `node_modules/` and `build/` are)
+LBDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _pandoc_options(flag, values):
+    options = []
+    for key, value in (values or {}).items():
+        options += [flag, key if value is True else f"{key}={value}"]
+    return options
+
+def default_sources(src_dir):
+    """ Markdown sources of book, in order """
+    return sorted(glob.glob("*.md", root_dir = src_dir))
+
+def build_options(sources, template, metadata, variables, embed,
+                  pages = False):
+    """ Build options recorded with the dependencies of the output """
+    return { "sources": list(sources), "template": template,
+            "metadata": metadata or {}, "variables": variables,
+            "embed": embed, "pages": pages }
+
+def read_book(sources, metadata = None, src_dir = None, pandoc = "pandoc"):
+    """ Parse markdown sources into a single document """
+    args = [pandoc, "--from=markdown", "--to=json"]
+    args += _pandoc_options("-M", metadata)
+    proc = subprocess.run(args + list(sources), cwd = src_dir,
+                          stdout = subprocess.PIPE, check = True)
+
+    doc = panflute.load(io.StringIO(proc.stdout.decode('utf-8')))
+    doc.format = "html"
+    return doc
+
+def filter_book(doc, src_dir = None):
+    """ Apply lupbook filters to document """
+    # Included files are resolved relative to the source directory
+    cwd = os.getcwd()
+    if src_dir is not None:
+        os.chdir(src_dir)
+    try:
+        return book_filter.filter_doc(doc)
+    finally:
+        os.chdir(cwd)
+
+def write_book(doc, output, template = None, variables = None, embed = True,
+               src_dir = None, pandoc = "pandoc"):
+    """ Write document as a standalone HTML book """
+    with io.StringIO() as f:
+        panflute.dump(doc, f)
+        write_json(f.getvalue(), output, template, variables, embed, src_dir,
+                   pandoc)
+
+def write_json(data, output, template = None, variables = None, embed = True,
+               src_dir = None, pandoc = "pandoc"):
+    """ Write JSON document (as text) as a standalone HTML book """
+    args = [pandoc, "--from=json", "--to=html", "--output", output,
+            "--standalone", "--section-divs"]
+    if embed:
+        args.append("--embed-resources")
+    if template is not None:
+        args += ["--template", template]
+    args += _pandoc_options("-V", variables)
+    subprocess.run(args, input = data.encode('utf-8'), cwd = src_dir,
+                   check = True)
+
+def split_options(output, metadata, embed, split_assets, pages = False):
+    """
+    Metadata and embedding option of build, publishing assets next to `output`
+    instead of embedding them if `split_assets` (see `lupbook_assets`), or if
+    output has several `pages` which would otherwise embed them all
+    """
+    if not split_assets and not (pages and embed):
+        return metadata, embed
+    return { "lupbook-assets-dir": lupbook_assets.default_dir(output),
+            **(metadata or {}) }, False
+
+def write_output(doc, output, template = None, variables = None, embed = True,
+                 src_dir = None, pandoc = "pandoc", pages = False,
+                 compress = False):
+    """
+    Write document as a single page, or as one page per section (see
+    `lupbook_pages`), with compressed variants if `compress`
+    """
+    if pages:
+        fnames = lupbook_pages.write_pages(doc, output, template, variables,
+                                           embed, src_dir, pandoc)
+    else:
+        write_book(doc, output, template, variables, embed, src_dir, pandoc)
+        fnames = [output]
+    if compress:
+        for fname in fnames:
+            lupbook_assets.compress(fname)
+
+def build_book(src_dir, output, sources = None, template = "template.html",
+               metadata = None, variables = None, embed = True,
+               pandoc = "pandoc", if_changed = False, split_assets = False,
+               pages = False):
+    """
+    Build book from the markdown sources of `src_dir` (all `*.md` files by
+    default) into `output`, along with its dependency files (see
+    `lupbook_deps`). If `if_changed`, skip the build and return None when
+    `output` is up-to-date. If `split_assets`, assets are published into
+    `assets/` next to `output`, and compressed variants of `output` are
+    written. If `pages`, each section of the main TOC gets its own page next
+    to `output` (which then implies `split_assets` unless not embedding).
+    """
+    if sources is None:
+        sources = default_sources(src_dir)
+    variables = { "lbdir": LBDIR, **(variables or {}) }
+    output = os.path.abspath(output)
+    split = split_assets or (pages and embed)
+    metadata, embed = split_options(output, metadata, embed, split_assets,
+                                    pages)
+
+    options = build_options(sources, template, metadata, variables, embed,
+                            pages)
+    if if_changed and lupbook_deps.is_up_to_date(output, options):
+        return None
+
+    # Index of activity IDs kept next to the book, for other tools to query
+    metadata = { "lupbook-ids": lupbook_ids.default_path(output),
+                **(metadata or {}) }
+
+    doc = read_book(sources, metadata, src_dir, pandoc)
+    doc = filter_book(doc, src_dir)
+    write_output(doc, output, template, variables, embed, src_dir, pandoc,
+                 pages, compress = split)
+
+    inputs = lupbook_deps.book_inputs(src_dir, sources, template,
+                                      doc.lupbook_includes)
+    lupbook_deps.write_deps(output, inputs, options)
+    return doc
@@ -0,0 +1,446 @@
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Bundles of the front-end modules (`modules/*.js` and `modules/*.css`): the
+modules of the activities used by the book, concatenated in dependency order
+into a single minified script and a single minified stylesheet, instead of one
+tag per module
+
+Bundles are named after their content (`bundle.<hash>.js`), built into the
+cache directory and only rebuilt when one of their modules changes. The script
+can come with a source map mapping it back to the modules, inlined into the
+bundle unless split into its own file (e.g., when assets are published, see
+`lupbook_assets`).
+
+Minification is conservative, so that it cannot change the meaning of the
+code: comments, indentation and blank lines are removed, but lines are kept
+(no reliance on automatic semicolon insertion) and so is the content of
+literals.
+"""
+
+import base64
+import bisect
+import json
+import os
+import re
+import sys
+import tempfile
+
+import lupbook_cache
+
+# Lupbook directory (where `modules/` is)
+LBDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules, in dependency order: the activity types using each (None if always
+# needed), and the module itself
+MODULES = [
+    (None, "lupbook"),
+    (None, "toc"),
+    (None, "search"),
+    ("fib", "fib"),
+    ("icode", "icode"),
+    ("matching", "matching"),
+    ("mcq", "mcq"),
+    ("parsons", "parsons"),
+    # Derives from parsons
+    ("hparsons", "hparsons"),
+]
+
+# Length of the content hash in the names of bundles
+HASH_LEN = 12
+
+# Description of a bundle, in its directory
+DESCRIPTION = "bundle.json"
+
+def is_enabled(doc = None):
+    """ Whether the template should reference bundles instead of modules """
+    enabled = os.environ.get("LUPBOOK_BUNDLE")
+    if doc is not None:
+        enabled = doc.get_metadata("lupbook-bundle", default = enabled)
+    return bool(enabled)
+
+def has_source_map(doc = None):
+    """ Whether bundles come with a source map """
+    enabled = os.environ.get("LUPBOOK_SOURCE_MAP")
+    if doc is not None:
+        enabled = doc.get_metadata("lupbook-source-map", default = enabled)
+    return bool(enabled)
+
+def modules(types = None):
+    """ Modules needed by the given activity types (all if None) """
+    return [module for activity_type, module in MODULES
+            if activity_type is None or types is None or activity_type in types]
+
+#
+# Minification
+#
+
+# Tokens after which a slash starts a regular expression rather than a division
+_REGEX_PREFIXES = set("(,=:[!&|?{};+-*%<>~^") | { "", "return", "typeof",
+                                                  "case", "do", "else", "in",
+                                                  "of", "new", "delete",
+                                                  "void", "throw",
+                                                  "instanceof", "yield",
+                                                  "await" }
+
+_WORD_RE = re.compile(r'[\w$]+')
+
+def _skip_literal(src, i, quote):
+    """ End of string literal starting at `i` (the index of its quote) """
+    i += 1
+    while i < len(src) and src[i] != quote:
+        i += 2 if src[i] == "\\" else 1
+    return i + 1
+
+def _skip_regex(src, i):
+    """
+    End of regular expression literal starting at `i`, or None if it isn't one
+    after all (e.g., division after `a++`)
+    """
+    i += 1
+    in_class = False
+    while i < len(src):
+        c = src[i]
+        if c == "\\":
+            i += 1
+        elif c == "[":
+            in_class = True
+        elif c == "]":
+            in_class = False
+        elif c == "/" and not in_class:
+            break
+        elif c == "\n":
+            return None
+        i += 1
+    if i >= len(src):
+        return None
+    match = _WORD_RE.match(src, i + 1)
+    return match.end() if match else i + 1
+
+def _strip_js_comments(src):
+    """
+    Remove the comments of script, keeping its lines. Return the code, and the
+    (0-based) lines which start within a template literal (and thus must be
+    kept as they are).
+    """
+    out = []
+    verbatim = set()
+    newlines = [k for k, c in enumerate(src) if c == "\n"]
+    i, n = 0, len(src)
+    # Brace depth in each template literal substitution (`${...}`) we're in
+    substitutions = []
+    prev = ""
+    in_template = False
+
+    def mark_lines(start, end):
+        # Lines starting within literal spanning `src[start:end]`
+        verbatim.update(range(bisect.bisect_left(newlines, start) + 1,
+                              bisect.bisect_left(newlines, end) + 1))
+
+    while i < n:
+        if in_template:
+            # Template literal, up to its end or its next substitution
+            j = i
+            while j < n and src[j] != "`" and not src.startswith("${", j):
+                j += 2 if src[j] == "\\" else 1
+            if src.startswith("${", j):
+                j += 2
+                substitutions.append(0)
+                prev = "{"
+            else:
+                j += 1
+                prev = "`"
+            in_template = False
+            mark_lines(i, j)
+            out.append(src[i:j])
+            i = j
+            continue
+
+        c = src[i]
+        if c in " \t\r\n":
+            out.append(c)
+            i += 1
+        elif src.startswith("//", i):
+            j = src.find("\n", i)
+            i = n if j < 0 else j
+        elif src.startswith("/*", i):
+            j = src.find("*/", i + 2)
+            j = n if j < 0 else j + 2
+            # Comments spanning lines still separate them, and the code after
+            # them stays in the same column
+            comment = src[i:j]
+            out.append("\n" * comment.count("\n")
+                       + " " * len(comment.rsplit("\n", 1)[-1]))
+            i = j
+        elif c in "'\"":
+            j = _skip_literal(src, i, c)
+            mark_lines(i, j)
+            out.append(src[i:j])
+            prev = c
+            i = j
+        elif c == "`":
+            out.append(c)
+            in_template = True
+            i += 1
+        elif c == "/" and prev in _REGEX_PREFIXES \
+                and _skip_regex(src, i) is not None:
+            j = _skip_regex(src, i)
+            out.append(src[i:j])
+            prev = "/"
+            i = j
+        elif c == "}" and substitutions and substitutions[-1] == 0:
+            # End of template literal substitution
+            substitutions.pop()
+            out.append(c)
+            in_template = True
+            i += 1
+        else:
+            # Words and increments (after which a slash is a division) are
+            # single tokens, other characters are tokens on their own
+            match = _WORD_RE.match(src, i)
+            j = match.end() if match \
+                    else i + 2 if src.startswith(("++", "--"), i) else i + 1
+            if c == "{" and substitutions:
+                substitutions[-1] += 1
+            elif c == "}" and substitutions:
+                substitutions[-1] -= 1
+            out.append(src[i:j])
+            prev = src[i:j]
+            i = j
+
+    return "".join(out), verbatim
+
+def minify_js(src):
+    """
+    Minify script, return its lines along with the line and column they start
+    at in the source
+    """
+    code, verbatim = _strip_js_comments(src)
+    lines = code.split("\n")
+    result = []
+    for idx, line in enumerate(lines):
+        # Lines within template literals are kept as they are, and so are the
+        # ends of the lines where such literals start
+        ends_in_literal = idx + 1 in verbatim
+        if idx in verbatim:
+            text, col = line, 0
+        else:
+            text = line.lstrip()
+            col = len(line) - len(text)
+        if not ends_in_literal:
+            text = text.rstrip()
+        if text or idx in verbatim or ends_in_literal:
+            result.append((text, idx, col))
+    return result
+
+# Whitespace around these characters is useless in stylesheets
+_CSS_SPACE_RE = re.compile(r'\s*([{};,])\s*|(:)\s+|\s+')
+
+def _css_tokens(src):
+    """ Split stylesheet into code, strings and comments, as `(kind, text)` """
+    i = 0
+    while i < len(src):
+        starts = [k for k in (src.find("'", i), src.find('"', i),
+                              src.find("/*", i)) if k >= 0]
+        j = min(starts, default = len(src))
+        if j > i:
+            yield "code", src[i:j]
+        if j == len(src):
+            return
+        if src.startswith("/*", j):
+            end = src.find("*/", j + 2)
+            i = len(src) if end < 0 else end + 2
+            yield "comment", src[j:i]
+        else:
+            i = _skip_literal(src, j, src[j])
+            yield "string", src[j:i]
+
+def minify_css(src):
+    """ Minify stylesheet """
+    # Comments removed first, so that the code around them can be merged
+    chunks = [""]
+    for kind, text in _css_tokens(src):
+        if kind == "string":
+            chunks += [text, ""]
+        elif kind == "code":
+            chunks[-1] += text
+        else:
+            chunks[-1] += " "
+
+    # Strings (e.g., data URLs) are kept as they are
+    css = "".join(chunk if idx % 2 else _CSS_SPACE_RE.sub(
+                      lambda m: m.group(1) or m.group(2) or " ", chunk)
+                  for idx, chunk in enumerate(chunks))
+    return css.replace(";}", "}").strip() + "\n"
+
+#
+# Source maps
+#
+
+_BASE64 = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+
+def _vlq(value):
+    """ Base64 VLQ encoding of integer (see the source map specification) """
+    value = (-value << 1) | 1 if value < 0 else value << 1
+    encoded = ""
+    while True:
+        digit = value & 31
+        value >>= 5
+        if value:
+            digit |= 32
+        encoded += _BASE64[digit]
+        if not value:
+            return encoded
+
+def _source_map(fname, sources, mapping):
+    """
+    Source map of script, given the source of each of its lines as `(source
+    index, line, column)`, or None
+    """
+    lines = []
+    prev = (0, 0, 0)
+    for origin in mapping:
+        if origin is None:
+            lines.append("")
+            continue
+        lines.append("A" + "".join(_vlq(value - last)
+                                   for value, last in zip(origin, prev)))
+        prev = origin
+
+    contents = []
+    for name in sources:
+        with open(os.path.join(LBDIR, name), encoding = 'utf-8') as f:
+            contents.append(f.read())
+    return { "version": 3, "file": fname, "sources": sources,
+            "sourcesContent": contents, "names": [],
+            "mappings": ";".join(lines) }
+
+#
+# Bundles
+#
+
+class Bundle:
+    """ Script and stylesheet bundling modules, built in `path` """
+    def __init__(self, path, description):
+        self.path = path
+        self.js = os.path.join(path, description["js"])
+        self.css = os.path.join(path, description["css"])
+        self.map = os.path.join(path, description["map"]) \
+                if description["map"] else None
+        # Size of each module and its minified size, by file
+        self.report = description["report"]
+
+    def report_lines(self):
+        """ Bytes saved by minification, per file and in total """
+        total, minified = 0, 0
+        lines = []
+        for name, (size, min_size) in self.report.items():
+            total += size
+            minified += min_size
+            lines.append(f"{name:<24} {size:>9} -> {min_size:>9} bytes"
+                         f" ({size - min_size} saved)")
+        percent = 100 * (total - minified) / total if total else 0
+        lines.append(f"{'total':<24} {total:>9} -> {minified:>9} bytes"
+                     f" ({total - minified} saved, {percent:.0f}%)")
+        return lines
+
+def _bundle_js(names, report):
+    out = []
+    mapping = []
+    for idx, name in enumerate(names):
+        with open(os.path.join(LBDIR, name), encoding = 'utf-8') as f:
+            src = f.read()
+        lines = minify_js(src)
+        out += [text for text, _, _ in lines]
+        mapping += [(idx, line, col) for _, line, col in lines]
+        report[name] = (len(src.encode('utf-8')),
+                        sum(len(text.encode('utf-8')) + 1
+                            for text, _, _ in lines))
+    return "\n".join(out) + "\n", mapping
+
+def _bundle_css(names, report):
+    out = []
+    for name in names:
+        with open(os.path.join(LBDIR, name), encoding = 'utf-8') as f:
+            src = f.read()
+        css = minify_css(src)
+        out.append(css)
+        report[name] = (len(src.encode('utf-8')), len(css.encode('utf-8')))
+    return "".join(out)
+
+def _write(fname, data):
+    with open(fname, 'w', encoding = 'utf-8') as f:
+        f.write(data)
+
+def _build(path, module_names, source_map):
+    """ Build bundle into directory `path`, return its description """
+    os.makedirs(path, exist_ok = True)
+    report = {}
+
+    js_names = [f"modules/{m}.js" for m in module_names]
+    js, mapping = _bundle_js(js_names, report)
+    js_fname = f"bundle.{lupbook_cache.digest(js)[:HASH_LEN]}.js"
+    map_fname = None
+    if source_map:
+        smap = json.dumps(_source_map(js_fname, js_names, mapping),
+                          separators = (",", ":"))
+        if source_map == "inline":
+            # Works wherever the script ends up (e.g., embedded into the book)
+            url = "data:application/json;charset=utf-8;base64," \
+                    + base64.b64encode(smap.encode('utf-8')).decode()
+        else:
+            map_fname = url = js_fname + ".map"
+            _write(os.path.join(path, map_fname), smap)
+        js += f"//# sourceMappingURL={url}\n"
+    _write(os.path.join(path, js_fname), js)
+
+    css_names = [f"modules/{m}.css" for m in module_names
+                 if os.path.exists(os.path.join(LBDIR, f"modules/{m}.css"))]
+    css = _bundle_css(css_names, report)
+    css_fname = f"bundle.{lupbook_cache.digest(css)[:HASH_LEN]}.css"
+    _write(os.path.join(path, css_fname), css)
+
+    description = { "js": js_fname, "css": css_fname, "map": map_fname,
+                   "report": report }
+    # Written last, so that incomplete bundles aren't used
+    _write(os.path.join(path, DESCRIPTION), json.dumps(description, indent = 1))
+    return description
+
+def _bundles_dir(doc = None):
+    path = lupbook_cache.cache_dir(doc)
+    if path is None:
+        # Bundles must outlive the filters, for pandoc to embed them
+        return os.path.join(tempfile.gettempdir(), f"lupbook-{os.getuid()}",
+                            "bundles")
+    return os.path.join(path, "bundles")
+
+def get_bundle(module_names, source_map = None, doc = None):
+    """
+    Bundle of modules, built unless already in cache. `source_map` is None
+    (no source map), "inline" or "file".
+    """
+    names = [f"modules/{m}.{ext}" for m in module_names
+             for ext in ("js", "css")]
+    key = lupbook_cache.digest(
+            lupbook_cache.file_digest(os.path.abspath(__file__)),
+            str(source_map),
+            *(f"{name}:{lupbook_cache.file_digest(os.path.join(LBDIR, name))}"
+              for name in names))
+    path = os.path.join(_bundles_dir(doc), key[:32])
+
+    description = None
+    if lupbook_cache.cache_dir(doc) is not None:
+        try:
+            with open(os.path.join(path, DESCRIPTION), encoding = 'utf-8') as f:
+                description = json.load(f)
+        except (OSError, ValueError):
+            pass
+    if description is None:
+        description = _build(path, module_names, source_map)
+    bundle = Bundle(path, description)
+
+    if doc is not None and doc.get_metadata("lupbook-stats", default = False):
+        sys.stderr.write("Bundle {}:\n  {}\n".format(
+            os.path.basename(bundle.js), "\n  ".join(bundle.report_lines())))
+    return bundle
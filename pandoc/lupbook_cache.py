@@ -0,0 +1,271 @@
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Caches shared between filters
+"""
+
+import collections
+import hashlib
+import os
+import sqlite3
+import time
+import types
+
+# Default bound on the size of each cache, in bytes
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+# Default bound on the size of the in-memory cache of included files, in bytes
+DEFAULT_INCLUDE_CACHE_SIZE = 32 * 1024 * 1024
+
+def cache_dir(doc = None):
+    """
+    Directory where caches are stored, or None if caching is disabled
+    """
+    # Caching can be disabled from the environment or from the metadata
+    if os.environ.get("LUPBOOK_NO_CACHE"):
+        return None
+    if doc is not None and doc.get_metadata("lupbook-no-cache", default = False):
+        return None
+
+    path = os.environ.get("LUPBOOK_CACHE_DIR")
+    if doc is not None:
+        path = doc.get_metadata("lupbook-cache-dir", default = path)
+    if not path:
+        xdg_cache = os.environ.get("XDG_CACHE_HOME",
+                                   os.path.join(os.path.expanduser("~"), ".cache"))
+        path = os.path.join(xdg_cache, "lupbook")
+    return path
+
+def cache_max_size(doc = None):
+    """
+    Size bound of each cache, in bytes
+    """
+    size = os.environ.get("LUPBOOK_CACHE_SIZE", DEFAULT_MAX_SIZE)
+    if doc is not None:
+        size = doc.get_metadata("lupbook-cache-size", default = size)
+    return int(size)
+
+def include_cache_size(doc = None):
+    """
+    Size bound of the in-memory cache of included files, in bytes
+    """
+    size = os.environ.get("LUPBOOK_INCLUDE_CACHE_SIZE",
+                          DEFAULT_INCLUDE_CACHE_SIZE)
+    if doc is not None:
+        size = doc.get_metadata("lupbook-include-cache-size", default = size)
+    return int(size)
+
+def digest(*parts):
+    """ Content-addressed key made of all the given parts """
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode()
+        h.update(len(part).to_bytes(8, "little"))
+        h.update(part)
+    return h.hexdigest()
+
+def file_digest(fname):
+    """ Digest of file content, or None if file cannot be read """
+    try:
+        with open(fname, 'rb') as fin:
+            return hashlib.sha256(fin.read()).hexdigest()
+    except OSError:
+        return None
+
+def code_digest(modules):
+    """
+    Digest of the source code of the given modules, and of all the modules of
+    ours they import (directly or not)
+    """
+    local_dir = os.path.dirname(os.path.abspath(__file__))
+
+    sources = {}
+    todo = list(modules)
+    while todo:
+        module = todo.pop()
+        fname = getattr(module, "__file__", None)
+        if fname is None or fname in sources \
+                or os.path.dirname(os.path.abspath(fname)) != local_dir:
+            continue
+        sources[fname] = file_digest(fname)
+        todo.extend(m for m in vars(module).values()
+                    if isinstance(m, types.ModuleType))
+
+    return digest(*(f"{os.path.basename(f)}:{d}"
+                    for f, d in sorted(sources.items())))
+
+#
+# Key-value store with LRU eviction, backed by an SQLite database so that it
+# can safely be shared by concurrent builds
+#
+# The connection is in autocommit mode, so that no process holds the write lock
+# for longer than a single statement: inserts are committed right away, and
+# usage updates (for LRU eviction) are kept in memory and written in a single
+# short transaction when closing.
+#
+class LupbookCache:
+    def __init__(self, path, name, max_size = DEFAULT_MAX_SIZE):
+        os.makedirs(path, exist_ok = True)
+        self.path = path
+        self.name = name
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # Last use of each entry read since opening
+        self.used = {}
+        self.db = sqlite3.connect(os.path.join(path, f"{name}.sqlite"),
+                                  timeout = 60, isolation_level = None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # Commits only sync the log at checkpoints, as each insert is one
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                        "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                        "size INTEGER NOT NULL, used REAL NOT NULL)")
+
+    @classmethod
+    def open(cls, name, doc = None):
+        """
+        Open cache according to configuration, or return None if disabled
+        """
+        path = cache_dir(doc)
+        if path is None:
+            return None
+        return cls(path, name, cache_max_size(doc))
+
+    def get(self, key, is_valid = None):
+        """
+        Return value stored for key, if any and if still valid according to
+        the given predicate
+        """
+        row = self.db.execute("SELECT value FROM entries WHERE key = ?",
+                              (key,)).fetchone()
+        if row is None or (is_valid is not None and not is_valid(row[0])):
+            self.misses += 1
+            return None
+
+        # Keep track of usage for LRU eviction (written when closing)
+        self.hits += 1
+        self.used[key] = time.time()
+        return row[0]
+
+    def put(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                        (key, value, len(value.encode()), time.time()))
+
+    def evict(self):
+        """ Remove least recently used entries until cache fits its bound """
+        total = self.db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_size:
+            return
+
+        rows = self.db.execute("SELECT key, size FROM entries ORDER BY used")
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_size:
+                break
+            evicted.append((key,))
+            total -= size
+        self.db.executemany("DELETE FROM entries WHERE key = ?", evicted)
+
+    def close(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.db.executemany("UPDATE entries SET used = ? WHERE key = ?",
+                                [(used, key) for key, used in self.used.items()])
+            self.evict()
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+        self.used = {}
+        self.db.close()
+
+    def stats(self):
+        return f"{self.hits} hits, {self.misses} misses"
+
+#
+# In-memory cache of included files (e.g., parsed YAML or decoded text), kept
+# for the lifetime of the process (e.g., filter daemon or watch mode)
+#
+def file_stamp(fname):
+    """ Modification time and size of file, to detect changes """
+    st = os.stat(fname)
+    return (st.st_mtime_ns, st.st_size)
+
+class IncludeCache:
+    def __init__(self, max_size = DEFAULT_INCLUDE_CACHE_SIZE):
+        self.max_size = max_size
+        # (kind, resolved path) -> (stamps of files the value depends on,
+        # size, value), in LRU order
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.parses_saved = 0
+
+    def get(self, kind, fname):
+        """
+        Return value stored for file, if none of the files it depends on
+        changed since (otherwise None)
+        """
+        key = (kind, os.path.realpath(fname))
+        entry = self.entries.get(key)
+        try:
+            fresh = entry is not None \
+                    and all(file_stamp(f) == stamp for f, stamp in entry[0])
+        except OSError:
+            fresh = False
+        if not fresh:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        self.bytes_saved += entry[1]
+        if kind == "yaml":
+            self.parses_saved += 1
+        return entry[2]
+
+    def put(self, kind, fname, value, stamps):
+        """
+        Store value for file, which depends on the files of `stamps` (list of
+        `(path, stamp)`, taken before reading them)
+        """
+        key = (kind, os.path.realpath(fname))
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[1]
+
+        stamps = [(os.path.realpath(f), stamp) for f, stamp in stamps]
+        size = sum(stamp[1] for _, stamp in stamps)
+        if size > self.max_size:
+            return
+        self.entries[key] = (stamps, size, value)
+        self.size += size
+
+        # Evict least recently used entries
+        while self.size > self.max_size:
+            _, (_, size, _) = self.entries.popitem(last = False)
+            self.size -= size
+
+    def add_stats(self, stats):
+        """ Account for the statistics of another cache (e.g., of a worker) """
+        self.hits += stats["hits"]
+        self.misses += stats["misses"]
+        self.bytes_saved += stats["bytes_saved"]
+        self.parses_saved += stats["parses_saved"]
+
+    def raw_stats(self):
+        return { "hits": self.hits, "misses": self.misses,
+                "bytes_saved": self.bytes_saved,
+                "parses_saved": self.parses_saved }
+
+    def stats(self):
+        return f"{self.hits} hits, {self.misses} misses," \
+                f" {self.bytes_saved} bytes and {self.parses_saved} parses saved"
@@ -0,0 +1,415 @@
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Incremental builds: each chapter (i.e., markdown source) is parsed and filtered
+on its own into an intermediate JSON document, kept in the build directory.
+Only the chapters which changed, or whose included files changed, are processed
+again (in parallel), and the book is then assembled from all the chapters.
+
+Unlike regular builds, where pandoc parses all the chapters as one document,
+reference links, footnotes and example lists cannot span several chapters.
+"""
+
+import concurrent.futures
+import contextlib
+import glob
+import io
+import json
+import os
+import re
+import subprocess
+
+import panflute
+
+import lupbook
+import lupbook_assets
+import lupbook_build
+import lupbook_cache
+import lupbook_deps
+import lupbook_ids
+import lupbook_search
+import lupbook_trace
+import toc_filter
+
+@contextlib.contextmanager
+def _in_dir(path):
+    """ Run in given directory (included files are relative to it) """
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+def _code_digest(src_dir):
+    """ Digest of the filters, and of the book's own Python code (plugins) """
+    sources = sorted(lupbook_deps.lupbook_sources()) \
+            + sorted(lupbook_deps.plugin_sources(src_dir))
+    return lupbook_cache.digest(*(f"{os.path.basename(f)}:"
+                                  f"{lupbook_cache.file_digest(f)}"
+                                  for f in sources))
+
+def _pandoc_version(pandoc):
+    proc = subprocess.run([pandoc, "--version"], stdout = subprocess.PIPE,
+                          check = True)
+    return proc.stdout.decode('utf-8').splitlines()[0]
+
+def _book_config(meta):
+    """ Metadata configuring the filters, shared by all the chapters """
+    return { k: v for k, v in meta.items() if k.startswith("lupbook-") }
+
+def _chapters_dir(output):
+    """ Where intermediate documents of chapters are kept """
+    output = os.path.abspath(output)
+    return os.path.join(os.path.dirname(output), ".lupbook-chapters",
+                        os.path.basename(output))
+
+def included_files(output):
+    """
+    Files included by the activities of the chapters of the last build of
+    `output` (relative to the source directory)
+    """
+    fnames = set()
+    for state_fname in glob.glob(os.path.join(_chapters_dir(output),
+                                              "*.state.json")):
+        try:
+            with open(state_fname, encoding = 'utf-8') as f:
+                fnames.update(fname for fname, _ in json.load(f)["includes"])
+        except (OSError, ValueError):
+            continue
+    return fnames
+
+#
+# Chapter state, kept next to its intermediate document
+#
+class _Chapter:
+    def __init__(self, source, chapters_dir):
+        self.source = source
+        name = source.replace(os.sep, "%")
+        self.ast_fname = os.path.join(chapters_dir, f"{name}.json")
+        self.state_fname = os.path.join(chapters_dir, f"{name}.state.json")
+        self.data = None
+
+        try:
+            with open(self.state_fname, encoding = 'utf-8') as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            self.state = None
+
+    def is_fresh(self, key):
+        """ Whether intermediate document is up-to-date (except config) """
+        if self.state is None or self.state["key"] != key \
+                or self.state["random"] \
+                or not os.path.exists(self.ast_fname):
+            return False
+        return all(lupbook_cache.file_digest(fname) == digest
+                   for fname, digest in self.state["includes"])
+
+    def save_state(self, state):
+        self.state = state
+        with open(self.state_fname, "w", encoding = 'utf-8') as f:
+            json.dump(state, f)
+
+    def meta(self):
+        """ Chapter's own metadata, in pandoc's JSON representation """
+        if self.data is not None:
+            return self.data["meta"]
+        return self.state["meta"]
+
+def _parse_chapters(chapters, metadata, src_dir, pandoc, jobs):
+    """ Parse markdown sources of chapters (pandoc runs in parallel) """
+    def parse(chapter):
+        args = [pandoc, "--from=markdown", "--to=json"]
+        args += lupbook_build._pandoc_options("-M", metadata)
+        proc = subprocess.run(args + [chapter.source], cwd = src_dir,
+                              stdout = subprocess.PIPE, check = True)
+        chapter.data = json.loads(proc.stdout)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = jobs) as executor:
+        list(executor.map(parse, chapters))
+
+#
+# Worker side
+#
+
+def _meta_string(value):
+    return { "t": "MetaString", "c": value }
+
+def _init_worker(src_dir):
+    # Included files are relative to the source directory
+    os.chdir(src_dir)
+
+def _filter_chapter(job):
+    """
+    Apply activity filters to parsed chapter and save resulting document,
+    return summary of chapter (headers, activity IDs, included files)
+    """
+    source, data, config, ast_fname, ids_path = job
+
+    # Filters are configured by the whole book, and activities of a chapter are
+    # rendered sequentially since chapters are already processed in parallel.
+    # Activity IDs are registered in the index of the book, as entries of the
+    # chapter (non-unique IDs across chapters are reported by the caller).
+    data = dict(data, meta = { **data["meta"], **config,
+                              "lupbook-jobs": _meta_string("1"),
+                              "lupbook-ids": _meta_string(ids_path),
+                              "lupbook-ids-source": _meta_string(source) })
+    doc = panflute.load(io.StringIO(json.dumps(data)))
+    doc.format = "html"
+
+    # Profiling events are written out by the caller, with those of the other
+    # chapters
+    trace = lupbook_trace.trace_path(doc)
+    if trace:
+        lupbook_trace.enable()
+
+    # Headers are collected for the TOC, built once all chapters are assembled
+    headers = []
+    def action(element, doc):
+        if isinstance(element, panflute.Header):
+            headers.append((element.level, element.identifier,
+                            panflute.stringify(element)))
+        return lupbook._process_lupbook_filters(element, doc)
+
+    try:
+        doc = panflute.run_filter(action,
+                                  prepare = lupbook._prepare_lupbook_filters,
+                                  finalize = lupbook._finalize_lupbook_filters,
+                                  doc = doc)
+    except Exception as e:
+        raise Exception(f"Chapter '{source}': {type(e).__name__}: {e}")
+
+    with open(ast_fname, "w", encoding = 'utf-8') as f:
+        panflute.dump(doc, f)
+
+    summary = { "headers": headers,
+               "ids": lupbook.activity_ids(doc),
+               "includes": sorted(doc.lupbook_includes.items()),
+               "random": doc.lupbook_random,
+               "types": sorted(doc.lupbook_types),
+               "modes": sorted(doc.lupbook_modes),
+               "data": lupbook.activity_data(doc) }
+    if trace:
+        summary["trace"] = (os.path.abspath(trace), lupbook_trace.take_events())
+    return summary
+
+#
+# Assembly
+#
+
+def _check_ids(chapters, ids):
+    """
+    Report the first activity ID used by several chapters, in book order
+    (chapters register their IDs in the index first-come)
+    """
+    first = {}
+    for chapter in chapters:
+        for entry in ids[chapter]:
+            other = first.setdefault(entry["id"], entry)
+            if other is not entry:
+                raise lupbook_ids.non_unique_error(entry, other)
+
+def _base_idents(idents):
+    """
+    Header identifiers before pandoc made them unique within their chapter
+    (e.g., `intro-1` for the second `intro` header)
+    """
+    seen = set()
+    bases = []
+    for ident in idents:
+        match = re.fullmatch(r'(.+)-\d+', ident)
+        bases.append(match.group(1) if match and match.group(1) in seen
+                     else ident)
+        seen.add(ident)
+    return bases
+
+def _unique_idents(bases, used):
+    """ Make header identifiers unique across the book, the way pandoc does """
+    idents = []
+    for base in bases:
+        ident = base
+        n = 1
+        while ident and ident in used:
+            ident = f"{base}-{n}"
+            n += 1
+        used.add(ident)
+        idents.append(ident)
+    return idents
+
+def _rename_headers(node, idents):
+    """ Set identifiers of the headers of JSON document, in document order """
+    if isinstance(node, list):
+        for child in node:
+            _rename_headers(child, idents)
+    elif isinstance(node, dict):
+        if node.get("t") == "Header":
+            node["c"][1][0] = next(idents)
+        _rename_headers(node.get("c"), idents)
+
+def _assemble(chapters, meta):
+    """ Assemble chapters into the JSON document of the whole book """
+    docs = []
+    for chapter in chapters:
+        with open(chapter.ast_fname, encoding = 'utf-8') as f:
+            docs.append(json.load(f))
+
+    # TOC is built from the header summaries of the chapters
+    doc = panflute.load(io.StringIO(json.dumps({
+        "pandoc-api-version": docs[0]["pandoc-api-version"],
+        "meta": meta, "blocks": [] })))
+    toc_filter._prepare_toc_filter(doc)
+
+    blocks = []
+    used = set()
+    for chapter, chapter_doc in zip(chapters, docs):
+        headers = chapter.state["headers"]
+        old_idents = [ident for _, ident, _ in headers]
+        idents = _unique_idents(_base_idents(old_idents), used)
+
+        chapter_blocks = chapter_doc["blocks"]
+        if idents != old_idents:
+            _rename_headers(chapter_blocks, iter(idents))
+        blocks += chapter_blocks
+
+        for (level, _, title), ident in zip(headers, idents):
+            toc_filter._add_toc_node(doc, level, ident, title)
+
+    toc_filter._finalize_toc_filter(doc)
+    lupbook.set_activity_assets(
+            doc, {t for chapter in chapters for t in chapter.state["types"]},
+            {m for chapter in chapters for m in chapter.state["modes"]})
+    lupbook.set_activity_data(
+            doc, { ident: data for chapter in chapters
+                  for ident, data in chapter.state["data"].items() })
+    lupbook_assets.finalize_assets(doc)
+    lupbook_search.finalize_search(doc, blocks)
+
+    data = doc.to_json()
+    data["blocks"] = blocks
+    return data
+
+def build_book(src_dir, output, sources = None, template = "template.html",
+               metadata = None, variables = None, embed = True,
+               pandoc = "pandoc", jobs = None, if_changed = False,
+               split_assets = False, pages = False):
+    """
+    Build book incrementally from the markdown sources of `src_dir` (all
+    `*.md` files by default) into `output`, processing up to `jobs` chapters in
+    parallel (all cores by default), along with its dependency files (see
+    `lupbook_deps`). Return the list of rebuilt chapters, or None if skipped
+    because `output` is up-to-date and `if_changed`. See
+    `lupbook_build.build_book()` for `split_assets` and `pages`.
+    """
+    if sources is None:
+        sources = lupbook_build.default_sources(src_dir)
+    if not sources:
+        raise Exception("No markdown sources")
+    variables = { "lbdir": lupbook_build.LBDIR, **(variables or {}) }
+    output = os.path.abspath(output)
+    split = split_assets or (pages and embed)
+    metadata, embed = lupbook_build.split_options(output, metadata, embed,
+                                                  split_assets, pages)
+    metadata = metadata or {}
+    src_dir = os.path.abspath(src_dir or ".")
+
+    options = lupbook_build.build_options(sources, template, metadata,
+                                          variables, embed, pages)
+    if if_changed and lupbook_deps.is_up_to_date(output, options):
+        return None
+    if not jobs or jobs <= 0:
+        jobs = os.cpu_count() or 1
+
+    chapters_dir = _chapters_dir(output)
+    os.makedirs(chapters_dir, exist_ok = True)
+    chapters = [_Chapter(source, chapters_dir) for source in sources]
+
+    # First, find chapters which changed (or whose included files changed)
+    no_cache = os.environ.get("LUPBOOK_NO_CACHE") \
+            or metadata.get("lupbook-no-cache")
+    code = _code_digest(src_dir)
+    version = _pandoc_version(pandoc)
+    keys = {}
+    for chapter in chapters:
+        with open(os.path.join(src_dir, chapter.source), 'rb') as f:
+            keys[chapter] = lupbook_cache.digest(
+                    code, version, json.dumps(metadata, sort_keys = True),
+                    f.read())
+
+    with _in_dir(src_dir):
+        stale = [c for c in chapters if no_cache or not c.is_fresh(keys[c])]
+    _parse_chapters(stale, metadata, src_dir, pandoc, jobs)
+
+    # Metadata of later chapters overrides the metadata of earlier ones
+    meta = {}
+    for chapter in chapters:
+        meta.update(chapter.meta())
+    config = _book_config(meta)
+    config_key = lupbook_cache.digest(json.dumps(config, sort_keys = True))
+
+    # Then, chapters affected by a change of the book configuration
+    reconf = [c for c in chapters
+              if c not in stale and c.state["config"] != config_key]
+    _parse_chapters(reconf, metadata, src_dir, pandoc, jobs)
+    stale = [c for c in chapters if c in stale or c in reconf]
+
+    # Index of activity IDs: entries of unchanged chapters are kept (or
+    # restored, e.g., if the index was removed), while rebuilt chapters
+    # register theirs anew
+    ids_path = metadata.get("lupbook-ids") or lupbook_ids.index_path() \
+            or lupbook_ids.default_path(output)
+    index = lupbook_ids.IdIndex(ids_path)
+    try:
+        index.retain_sources(c.source for c in chapters if c not in stale)
+        for chapter in chapters:
+            if chapter not in stale:
+                index.replace_source(chapter.source, chapter.state["ids"])
+    finally:
+        index.close()
+
+    # Filter chapters in parallel (or in-process if only one)
+    work = [(c.source, c.data, config, c.ast_fname, ids_path) for c in stale]
+    if len(work) > 1 and jobs > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers = min(jobs, len(work)),
+                initializer = _init_worker,
+                initargs = (src_dir,)) as executor:
+            summaries = list(executor.map(_filter_chapter, work))
+    else:
+        with _in_dir(src_dir):
+            summaries = [_filter_chapter(job) for job in work]
+
+    ids = { c: c.state["ids"] for c in chapters if c not in stale }
+    ids.update((c, s["ids"]) for c, s in zip(stale, summaries))
+    _check_ids(chapters, ids)
+
+    trace = None
+    for chapter, summary in zip(stale, summaries):
+        if "trace" in summary:
+            trace, events = summary.pop("trace")
+            if not lupbook_trace.enabled():
+                lupbook_trace.enable()
+            lupbook_trace.add_events(events)
+        chapter.save_state({ "key": keys[chapter], "config": config_key,
+                            "meta": chapter.data["meta"], **summary })
+
+    with _in_dir(src_dir):
+        data = _assemble(chapters, meta)
+    if trace:
+        lupbook_trace.finish(trace)
+    if pages:
+        doc = panflute.load(io.StringIO(json.dumps(data)))
+        lupbook_build.write_output(doc, output, template, variables, embed,
+                                   src_dir, pandoc, pages, compress = split)
+    else:
+        lupbook_build.write_json(json.dumps(data), output, template, variables,
+                                 embed, src_dir, pandoc)
+        if split:
+            lupbook_assets.compress(output)
+
+    includes = set()
+    for chapter in chapters:
+        includes.update(fname for fname, _ in chapter.state["includes"])
+    inputs = lupbook_deps.book_inputs(src_dir, sources, template, includes)
+    lupbook_deps.write_deps(output, inputs, options)
+    return [c.source for c in stale]
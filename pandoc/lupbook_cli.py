@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Command-line interface of lupbook
+"""
+
+import argparse
+import os
+import sys
+
+import lupbook_build
+
+def _parse_assignments(values):
+    """ Turn list of `KEY[=VALUE]` into dictionary """
+    result = {}
+    for item in values or []:
+        key, sep, value = item.partition("=")
+        result[key] = value if sep else True
+    return result
+
+#
+# Commands
+#
+
+def _cmd_build(args):
+    metadata = _parse_assignments(args.metadata)
+    if args.no_cache:
+        metadata["lupbook-no-cache"] = True
+    if args.bundle:
+        metadata["lupbook-bundle"] = True
+    if args.source_map:
+        metadata["lupbook-source-map"] = True
+    if args.no_search:
+        metadata["lupbook-no-search"] = True
+
+    # Chapters are processed in parallel, instead of activities
+    if args.incremental:
+        import lupbook_chapters
+        rebuilt = lupbook_chapters.build_book(
+                args.src_dir, args.output,
+                sources = args.sources or None,
+                template = args.template,
+                metadata = metadata,
+                variables = _parse_assignments(args.variable),
+                embed = not args.no_embed,
+                pandoc = args.pandoc,
+                jobs = args.jobs,
+                if_changed = args.if_changed,
+                split_assets = args.split_assets,
+                pages = args.pages)
+        if rebuilt is None:
+            sys.stderr.write(f"{args.output} is up-to-date\n")
+        else:
+            sys.stderr.write(f"Rebuilt {len(rebuilt)} chapter(s)\n")
+        return
+
+    if args.jobs is not None:
+        metadata["lupbook-jobs"] = args.jobs
+
+    doc = lupbook_build.build_book(args.src_dir, args.output,
+                                   sources = args.sources or None,
+                                   template = args.template,
+                                   metadata = metadata,
+                                   variables = _parse_assignments(args.variable),
+                                   embed = not args.no_embed,
+                                   pandoc = args.pandoc,
+                                   if_changed = args.if_changed,
+                                   split_assets = args.split_assets,
+                                   pages = args.pages)
+    if doc is None:
+        sys.stderr.write(f"{args.output} is up-to-date\n")
+
+def _cmd_watch(args):
+    import lupbook_watch
+
+    metadata = _parse_assignments(args.metadata)
+    if args.no_cache:
+        metadata["lupbook-no-cache"] = True
+
+    try:
+        lupbook_watch.watch(args.src_dir, args.output,
+                            host = args.host,
+                            port = args.port,
+                            sources = args.sources or None,
+                            template = args.template,
+                            metadata = metadata,
+                            variables = _parse_assignments(args.variable),
+                            pandoc = args.pandoc,
+                            jobs = args.jobs)
+    except KeyboardInterrupt:
+        pass
+
+def _cmd_lint(args):
+    import lupbook_lint
+
+    errors, count = lupbook_lint.lint(args.src_dir, args.sources or None,
+                                      args.jobs)
+    return 0 if lupbook_lint.report(errors, count) else 1
+
+def _cmd_verify(args):
+    import lupbook_verify
+
+    entries = lupbook_verify.verify(args.src_dir, args.sources or None,
+                                    args.jobs, args.timeout,
+                                    cache = not args.no_cache,
+                                    report = lupbook_verify.report_activity)
+    return 0 if lupbook_verify.summary(entries) else 1
+
+def _cmd_ids(args):
+    import json
+    import lupbook_ids
+
+    path = args.index or lupbook_ids.default_path(args.output)
+    if not os.path.exists(path):
+        sys.stderr.write(f"No activity ID index at {path}\n")
+        return 1
+
+    index = lupbook_ids.IdIndex(path)
+    if args.ids:
+        entries = [index.lookup(ident) for ident in args.ids]
+    else:
+        entries = index.entries()
+    index.close()
+
+    missing = [ident for ident, entry in zip(args.ids, entries) if entry is None]
+    entries = [entry for entry in entries if entry is not None]
+    if args.json:
+        print(json.dumps(entries, indent = 2))
+    else:
+        for entry in entries:
+            print(f"{entry['id']}\t{lupbook_ids.describe(entry)}"
+                  f"\t{entry['digest'] or ''}")
+    for ident in missing:
+        sys.stderr.write(f"No activity with id '{ident}'\n")
+    return 1 if missing else 0
+
+def _cmd_daemon(args):
+    # Only import daemon (and thus all the filters) when needed
+    import lupbook_daemon
+
+    if args.stop:
+        if not lupbook_daemon.stop(args.socket):
+            sys.stderr.write("No lupbook daemon running\n")
+            return 1
+        return 0
+
+    lupbook_daemon.serve(args.socket, args.idle_timeout)
+
+#
+# Argument parsing
+#
+
+def _add_source_arguments(parser, output):
+    parser.add_argument("sources", nargs = "*",
+                        help = "markdown sources, relative to source directory"
+                        " (default: all *.md files)")
+    parser.add_argument("-C", "--src-dir", default = ".",
+                        help = "source directory (default: %(default)s)")
+    parser.add_argument("-o", "--output", default = output,
+                        help = "output file (default: %(default)s)")
+    parser.add_argument("--template", default = "template.html",
+                        help = "HTML template, relative to source directory"
+                        " (default: %(default)s)")
+    parser.add_argument("-M", "--metadata", action = "append",
+                        metavar = "KEY[=VALUE]", help = "document metadata")
+    parser.add_argument("-V", "--variable", action = "append",
+                        metavar = "KEY[=VALUE]", help = "template variable")
+    parser.add_argument("--no-cache", action = "store_true",
+                        help = "do not use nor update caches")
+    parser.add_argument("--pandoc", default = os.environ.get("PANDOC", "pandoc"),
+                        help = "pandoc executable (default: %(default)s)")
+
+def _add_build_arguments(parser):
+    _add_source_arguments(parser, "build/book.html")
+    parser.add_argument("--no-embed", action = "store_true",
+                        help = "reference resources instead of embedding them")
+    parser.add_argument("--split-assets", action = "store_true",
+                        help = "publish assets under content-hashed names in"
+                        " assets/ next to the output, along with compressed"
+                        " variants, instead of embedding them")
+    parser.add_argument("--pages", action = "store_true",
+                        help = "write one page per section of the main TOC"
+                        " next to the output (implies --split-assets unless"
+                        " --no-embed)")
+    parser.add_argument("--bundle", action = "store_true",
+                        help = "reference the front-end modules as a single"
+                        " minified script and stylesheet")
+    parser.add_argument("--source-map", action = "store_true",
+                        help = "with --bundle, add a source map to the script")
+    parser.add_argument("--no-search", action = "store_true",
+                        help = "do not build the full-text search index")
+    parser.add_argument("-j", "--jobs", type = int,
+                        help = "number of processes rendering activities, or"
+                        " chapters if incremental (0 for all cores)")
+    parser.add_argument("-i", "--incremental", action = "store_true",
+                        help = "only rebuild the chapters which changed")
+    parser.add_argument("--if-changed", action = "store_true",
+                        help = "skip build if no input changed since the last"
+                        " one (according to its dependency manifest)")
+
+def _add_watch_arguments(parser):
+    _add_source_arguments(parser, "build/preview/book.html")
+    parser.add_argument("-j", "--jobs", type = int,
+                        help = "number of processes rebuilding chapters"
+                        " (default: all cores)")
+    parser.add_argument("--host", default = "127.0.0.1",
+                        help = "address of preview server (default: %(default)s)")
+    parser.add_argument("-p", "--port", type = int, default = 8000,
+                        help = "port of preview server (default: %(default)s)")
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = "lupbook")
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    build_parser = commands.add_parser("build", help = "build book")
+    _add_build_arguments(build_parser)
+    build_parser.set_defaults(func = _cmd_build)
+
+    watch_parser = commands.add_parser("watch",
+                                       help = "rebuild book on changes and"
+                                       " serve it with live reload")
+    _add_watch_arguments(watch_parser)
+    watch_parser.set_defaults(func = _cmd_watch)
+
+    lint_parser = commands.add_parser("lint",
+                                      help = "check activities without"
+                                      " building book")
+    lint_parser.add_argument("sources", nargs = "*",
+                             help = "markdown sources, relative to source"
+                             " directory (default: all *.md files)")
+    lint_parser.add_argument("-C", "--src-dir", default = ".",
+                             help = "source directory (default: %(default)s)")
+    lint_parser.add_argument("-j", "--jobs", type = int, default = 0,
+                             help = "number of processes checking activities"
+                             " (default: all cores)")
+    lint_parser.set_defaults(func = _cmd_lint)
+
+    verify_parser = commands.add_parser("verify",
+                                        help = "check that the reference"
+                                        " solutions of icode activities pass"
+                                        " their tests")
+    verify_parser.add_argument("sources", nargs = "*",
+                               help = "markdown sources, relative to source"
+                               " directory (default: all *.md files)")
+    verify_parser.add_argument("-C", "--src-dir", default = ".",
+                               help = "source directory (default: %(default)s)")
+    verify_parser.add_argument("-j", "--jobs", type = int, default = 0,
+                               help = "number of processes verifying"
+                               " activities (default: all cores)")
+    verify_parser.add_argument("-t", "--timeout", type = float,
+                               default = 30,
+                               help = "time limit of each test, in seconds"
+                               " (default: %(default)s)")
+    verify_parser.add_argument("--no-cache", action = "store_true",
+                               help = "verify all activities, even those which"
+                               " passed and haven't changed since")
+    verify_parser.set_defaults(func = _cmd_verify)
+
+    ids_parser = commands.add_parser("ids",
+                                     help = "query activity ID index of"
+                                     " built book")
+    ids_parser.add_argument("ids", nargs = "*",
+                            help = "activity IDs to look up (default: all)")
+    ids_parser.add_argument("-o", "--output", default = "build/book.html",
+                            help = "built book (default: %(default)s)")
+    ids_parser.add_argument("--index",
+                            help = "index file (default: next to built book)")
+    ids_parser.add_argument("--json", action = "store_true",
+                            help = "print entries as JSON")
+    ids_parser.set_defaults(func = _cmd_ids)
+
+    daemon_parser = commands.add_parser("daemon",
+                                        help = "run filter daemon in foreground")
+    daemon_parser.add_argument("--socket", help = "path of the Unix socket")
+    daemon_parser.add_argument("--idle-timeout", type = float, default = 15 * 60,
+                               help = "seconds of inactivity before exiting"
+                               " (default: %(default)s)")
+    daemon_parser.add_argument("--stop", action = "store_true",
+                               help = "stop running daemon")
+    daemon_parser.set_defaults(func = _cmd_daemon)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Thin pandoc filter forwarding the document to the lupbook filter daemon (see
+`lupbook_daemon.py`), or running the filters in-process if no daemon is
+available
+"""
+
+import hashlib
+import io
+import json
+import os
+import socket
+import stat
+import struct
+import sys
+import tempfile
+
+def filter_env(environ):
+    """ Environment variables which affect the filters """
+    return { k: v for k, v in environ.items()
+            if k.startswith("LUPBOOK_")
+            or k in ("PANDOC_VERSION", "XDG_CACHE_HOME") }
+
+def _user_dir():
+    """
+    Directory of the user's sockets in the shared temporary directory, which
+    only the user can access (or another user could create our socket first)
+    """
+    path = os.path.join(tempfile.gettempdir(),
+                        f"lupbook-daemon-{os.getuid()}")
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() \
+            or st.st_mode & 0o077:
+        raise PermissionError(f"Directory '{path}' is not private to the user")
+    return path
+
+def socket_path():
+    """ Path of the daemon socket, specific to user and lupbook directory """
+    path = os.environ.get("LUPBOOK_DAEMON_SOCKET")
+    if path:
+        return path
+
+    lbdir = os.path.dirname(os.path.abspath(__file__))
+    suffix = hashlib.sha256(lbdir.encode()).hexdigest()[:8]
+    rundir = os.environ.get("XDG_RUNTIME_DIR")
+    if rundir:
+        return os.path.join(rundir, f"lupbook-{os.getuid()}-{suffix}.sock")
+    return os.path.join(_user_dir(), f"daemon-{suffix}.sock")
+
+def connect(path = None):
+    """
+    Connect to the daemon socket, which must be the user's own: the daemon
+    receives the documents, and its output ends up in the book
+    """
+    path = path or socket_path()
+    st = os.lstat(path)
+    if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+        raise PermissionError(f"Socket '{path}' does not belong to the user")
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        # Also check the process listening on it, where possible (Linux)
+        if hasattr(socket, "SO_PEERCRED"):
+            creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                    struct.calcsize("3i"))
+            if struct.unpack("3i", creds)[1] != os.getuid():
+                raise PermissionError(f"Daemon on socket '{path}' does not"
+                                      " belong to the user")
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+def recv_message(sock):
+    """ Read header line and payload until end of stream """
+    with sock.makefile('rb') as f:
+        header = f.readline()
+        if not header:
+            return None, None
+        return json.loads(header), f.read()
+
+def send_message(sock, header, payload = b""):
+    sock.sendall(json.dumps(header).encode() + b"\n" + payload)
+    sock.shutdown(socket.SHUT_WR)
+
+def _run_remote(fmt, data):
+    """ Have the daemon filter the document, return None if unavailable """
+    try:
+        sock = connect()
+    except PermissionError as e:
+        sys.stderr.write(f"Warning: {e}, filtering in-process\n")
+        return None
+    except OSError:
+        return None
+
+    with sock:
+        request = { "command": "filter", "format": fmt, "cwd": os.getcwd(),
+                   "env": filter_env(os.environ) }
+        try:
+            send_message(sock, request, data)
+            response, payload = recv_message(sock)
+        except OSError:
+            return None
+
+    # Daemon went away (e.g., reloading)
+    if response is None:
+        return None
+
+    sys.stderr.write(response.get("stderr", ""))
+    if response["status"] != "ok":
+        sys.stderr.write(response["message"])
+        sys.exit(1)
+    return payload
+
+def _run_local(fmt, data):
+    """ Filter the document in this process """
+    import panflute
+    import book_filter
+
+    doc = panflute.load(io.StringIO(data.decode('utf-8')))
+    doc.format = fmt
+    doc = book_filter.filter_doc(doc)
+    with io.StringIO() as f:
+        panflute.dump(doc, f)
+        return f.getvalue().encode('utf-8')
+
+if __name__ == "__main__":
+    fmt = sys.argv[1] if len(sys.argv) > 1 else "html"
+    data = sys.stdin.buffer.read()
+
+    output = _run_remote(fmt, data)
+    if output is None:
+        output = _run_local(fmt, data)
+    sys.stdout.buffer.write(output)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Long-running daemon keeping the lupbook filters (modules, compiled validators,
+caches) loaded in memory, and filtering documents forwarded by the pandoc-facing
+client (see `lupbook_client.py`)
+"""
+
+import contextlib
+import io
+import os
+import socket
+import sys
+import time
+import traceback
+
+import panflute
+
+import book_filter
+import lupbook_client
+import lupbook_deps
+
+# Default time after which an idle daemon quits, in seconds
+DEFAULT_IDLE_TIMEOUT = 15 * 60
+
+def _mtimes(fnames):
+    return { f: os.stat(f).st_mtime_ns for f in fnames }
+
+def _source_mtimes(src_dirs):
+    """
+    Modification times of the filter sources, and of the plugins of the books
+    in `src_dirs` (e.g., activity types declared by the book), to detect changes
+    """
+    fnames = lupbook_deps.lupbook_sources()
+    for src_dir in src_dirs:
+        fnames += lupbook_deps.plugin_sources(src_dir)
+    return _mtimes(fnames)
+
+@contextlib.contextmanager
+def _request_context(request):
+    """ Run in the directory and environment of the client """
+    cwd = os.getcwd()
+    env = os.environ.copy()
+    os.chdir(request["cwd"])
+    for key in lupbook_client.filter_env(env):
+        del os.environ[key]
+    os.environ.update(request["env"])
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(env)
+
+def _filter(request, data):
+    """ Apply filters to document, return output document """
+    with _request_context(request):
+        doc = panflute.load(io.StringIO(data.decode('utf-8')))
+        doc.format = request["format"]
+        doc = book_filter.filter_doc(doc)
+        with io.StringIO() as f:
+            panflute.dump(doc, f)
+            return f.getvalue().encode('utf-8')
+
+def _handle(conn, src_dirs, mtimes):
+    """ Handle one client connection, return False when asked to stop """
+    request, data = lupbook_client.recv_message(conn)
+    if request is None:
+        return True
+    if request["command"] == "stop":
+        lupbook_client.send_message(conn, { "status": "ok" })
+        return False
+
+    # Plugins are imported from the book's directory, and stay loaded
+    if request["cwd"] not in src_dirs:
+        src_dirs.add(request["cwd"])
+        mtimes.update(_mtimes(lupbook_deps.plugin_sources(request["cwd"])))
+
+    stderr = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(stderr):
+            output = _filter(request, data)
+        response = { "status": "ok", "stderr": stderr.getvalue() }
+    except Exception:
+        output = b""
+        response = { "status": "error", "stderr": stderr.getvalue(),
+                    "message": traceback.format_exc() }
+    lupbook_client.send_message(conn, response, output)
+    return True
+
+def serve(path = None, idle_timeout = DEFAULT_IDLE_TIMEOUT):
+    """
+    Serve filtering requests until idle for `idle_timeout` seconds, or until
+    the filter sources change (in which case the daemon restarts itself)
+    """
+    path = path or lupbook_client.socket_path()
+    src_dirs = set()
+    mtimes = _source_mtimes(src_dirs)
+
+    # Stale socket from a previous daemon which didn't exit cleanly
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(old_umask)
+    server.listen()
+    server.settimeout(1)
+    sys.stderr.write(f"Lupbook daemon listening on {path}\n")
+
+    reload = False
+    last_active = time.monotonic()
+    try:
+        while True:
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                if time.monotonic() - last_active > idle_timeout:
+                    sys.stderr.write("Lupbook daemon idle, exiting\n")
+                    break
+                if _source_mtimes(src_dirs) != mtimes:
+                    reload = True
+                    break
+                continue
+
+            # Never serve a request with stale filter code
+            if _source_mtimes(src_dirs) != mtimes:
+                conn.close()
+                reload = True
+                break
+
+            with conn:
+                conn.settimeout(None)
+                if not _handle(conn, src_dirs, mtimes):
+                    break
+            last_active = time.monotonic()
+    finally:
+        server.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+
+    if reload:
+        sys.stderr.write("Lupbook filter sources changed, reloading daemon\n")
+        os.execv(sys.executable, [sys.executable, os.path.abspath(__file__),
+                                  "--socket", path,
+                                  "--idle-timeout", str(idle_timeout)])
+
+def stop(path = None):
+    """ Ask running daemon to exit, return False if no daemon was running """
+    try:
+        sock = lupbook_client.connect(path)
+    except OSError:
+        return False
+    with sock:
+        lupbook_client.send_message(sock, { "command": "stop" })
+        lupbook_client.recv_message(sock)
+    return True
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description = "Lupbook filter daemon")
+    parser.add_argument("--socket", help = "path of the Unix socket")
+    parser.add_argument("--idle-timeout", type = float,
+                        default = DEFAULT_IDLE_TIMEOUT,
+                        help = "seconds of inactivity before exiting")
+    args = parser.parse_args()
+    serve(args.socket, args.idle_timeout)
@@ -0,0 +1,82 @@
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Dependencies of a built book, written next to it for build tools: a Makefile
+depfile (`<output>.d`) and a JSON manifest with the digest of each input
+(`<output>.deps.json`)
+"""
+
+import glob
+import json
+import os
+
+import lupbook_cache
+
+def _escape(path):
+    """ Escape path for make """
+    return path.replace("$", "$$").replace("#", "\\#").replace(" ", "\\ ")
+
+def lupbook_sources():
+    """ Code of the filters, on which every book depends """
+    return glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  "*.py"))
+
+def plugin_sources(src_dir = None):
+    """ Book's own Python code (e.g., activity types declared by the book) """
+    return glob.glob(os.path.join(src_dir or os.curdir, "*.py"))
+
+def book_inputs(src_dir, sources, template, includes):
+    """ All the files a book is built from """
+    src_dir = src_dir or os.curdir
+    fnames = [os.path.join(src_dir, fname)
+              for fname in [*sources, template, *includes]]
+    return fnames + lupbook_sources() + plugin_sources(src_dir)
+
+def write_deps(output, inputs, options = None):
+    """
+    Write depfile and manifest of `output`, built from `inputs` (files) and
+    `options` (anything else affecting the output, e.g., metadata)
+    """
+    output = os.path.abspath(output)
+    inputs = sorted({ os.path.abspath(fname) for fname in inputs })
+
+    with open(output + ".d", "w", encoding = 'utf-8') as f:
+        f.write(_escape(output) + ":")
+        for fname in inputs:
+            f.write(" \\\n  " + _escape(fname))
+        f.write("\n")
+
+        # Empty rules, so that make doesn't fail when an input is removed
+        for fname in inputs:
+            f.write("\n" + _escape(fname) + ":\n")
+
+    manifest = { "output": output,
+                "options": options,
+                "inputs": { fname: lupbook_cache.file_digest(fname)
+                           for fname in inputs } }
+    with open(output + ".deps.json", "w", encoding = 'utf-8') as f:
+        json.dump(manifest, f, indent = 2)
+        f.write("\n")
+
+def read_manifest(output):
+    """ Manifest of `output`, or None if missing """
+    try:
+        with open(os.path.abspath(output) + ".deps.json",
+                  encoding = 'utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def is_up_to_date(output, options = None):
+    """
+    Whether `output` exists, was built with the same `options`, and none of
+    its recorded inputs changed (by content, unlike make which compares
+    modification times)
+    """
+    manifest = read_manifest(output)
+    if manifest is None or not os.path.exists(output) \
+            or manifest["options"] != options:
+        return False
+    return all(lupbook_cache.file_digest(fname) == digest
+               for fname, digest in manifest["inputs"].items())
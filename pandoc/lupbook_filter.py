@@ -2,36 +2,297 @@
 Shared code between filters
 """
 
+import copy
+import mmap
 import os
+import re
+import secrets
 import sys
 
-from dominate.tags import button, div, h5, i
-from dominate.util import raw
 import jsonschema
 import panflute
 import yaml
 
+import lupbook_cache
+import lupbook_html
+import lupbook_trace
+from lupbook_html import button, div, h5, i, raw
+
+#
+# Assets of generated HTML
+#
+
+# Languages of source files, by extension, as CodeMirror MIME types
+LANGUAGES = {
+    ".c": "text/x-csrc",
+    ".h": "text/x-csrc",
+    ".cc": "text/x-c++src",
+    ".cpp": "text/x-c++src",
+    ".cxx": "text/x-c++src",
+    ".hh": "text/x-c++src",
+    ".hpp": "text/x-c++src",
+    ".java": "text/x-java",
+    ".go": "text/x-go",
+    ".js": "text/javascript",
+    ".py": "text/x-python",
+    ".s": "text/x-gas",
+    ".S": "text/x-gas",
+    ".sh": "text/x-sh",
+}
+
+# CodeMirror modes defining these MIME types (i.e., `mode/<mode>/<mode>.js`)
+EDITOR_MODES = {
+    "text/x-csrc": "clike",
+    "text/x-c++src": "clike",
+    "text/x-java": "clike",
+    "text/x-go": "go",
+    "text/javascript": "javascript",
+    "text/x-python": "python",
+    "text/x-gas": "gas",
+    "text/x-sh": "shell",
+}
+
+# Card of activity in generated HTML, with the type of the activity
+_CARD_RE = re.compile(r'<div class="card my-3 ([\w-]+)-container"')
+
+# Code editor in generated HTML, with its language
+_EDITOR_RE = re.compile(r'<textarea [^>]*\bdata-mode="([^"]+)"')
+
+# Title and prompt of activity in generated HTML, and the divs delimiting the
+# latter
+_TITLE_RE = re.compile(r'<h5 class="card-title">(.*?)</h5>', re.DOTALL)
+_PROMPT_RE = re.compile(r'<div class="card-text lupbook-description">')
+_DIV_RE = re.compile(r'<(/?)div\b')
+
+def language(fname):
+    """ Language of source file (MIME type), or None if unknown """
+    return LANGUAGES.get(os.path.splitext(fname)[1])
+
+def activity_types(html):
+    """ Types of the activities whose cards are in HTML """
+    return set(_CARD_RE.findall(html))
+
+def editor_modes(html):
+    """ CodeMirror modes of the code editors in HTML """
+    return {EDITOR_MODES[mime] for mime in _EDITOR_RE.findall(html)
+            if mime in EDITOR_MODES}
+
+def activity_text(html):
+    """
+    Titles and prompts (as HTML) of the activities whose cards are in HTML
+    """
+    prompts = []
+    for match in _PROMPT_RE.finditer(html):
+        # Prompts may hold divs of their own (e.g., code blocks)
+        depth = 1
+        for tag in _DIV_RE.finditer(html, match.end()):
+            depth += -1 if tag.group(1) else 1
+            if depth == 0:
+                prompts.append(html[match.end():tag.start()])
+                break
+    return _TITLE_RE.findall(html), prompts
+
 #
 # YAML loading
 #
+
+# Included files larger than this are read through a memory mapping
+MMAP_THRESHOLD = 1024 * 1024
+
+# Included files, shared by all the activities processed by this process
+include_cache = lupbook_cache.IncludeCache()
+
+def _read_text(fname):
+    """ Read UTF-8 file """
+    with open(fname, 'rb') as fin:
+        size = os.fstat(fin.fileno()).st_size
+        if size < MMAP_THRESHOLD:
+            return fin.read().decode('utf-8')
+
+        # Decode straight from the page cache, without an intermediate copy
+        with mmap.mmap(fin.fileno(), 0, access = mmap.ACCESS_READ) as data:
+            return str(data, 'utf-8')
+
 class LupbookLoader(yaml.SafeLoader):
-    def include(self, node):
-        """ Include YAML file """
+    def __init__(self, stream):
+        super().__init__(stream)
+        # Files included while loading, including nested inclusions, and their
+        # stamps when read (see `lupbook_cache.file_stamp()`)
+        self.includes = []
+        self.stamps = []
+
+    def _include(self, kind, node, read):
         fname = os.path.join(os.path.curdir, self.construct_scalar(node))
+
+        # Cached files bring along the files they include themselves
+        cached = include_cache.get(kind, fname)
+        if cached is not None:
+            data, includes, stamps = cached
+            self.includes.extend(includes)
+            self.stamps.extend(stamps)
+            return copy.deepcopy(data) if kind == "yaml" else data
+
+        start = len(self.includes)
+        self.includes.append(fname)
+        self.stamps.append((fname, lupbook_cache.file_stamp(fname)))
+        data = read(fname)
+
+        # Activities may modify their configuration (e.g., defaults), so keep
+        # a pristine copy of parsed YAML
+        include_cache.put(kind, fname,
+                          (copy.deepcopy(data) if kind == "yaml" else data,
+                           self.includes[start:], self.stamps[start:]),
+                          self.stamps[start:])
+        return data
+
+    def _read_yaml(self, fname):
         with open(fname, 'r') as fin:
-            return yaml.load(fin, LupbookLoader)
+            # Nested loader shares our lists of included files
+            loader = LupbookLoader(fin)
+            loader.includes = self.includes
+            loader.stamps = self.stamps
+            try:
+                return loader.get_single_data()
+            finally:
+                loader.dispose()
+
+    def include(self, node):
+        """ Include YAML file """
+        return self._include("yaml", node, self._read_yaml)
 
     def raw_include(self, node):
         """ Include file verbatim """
-        fname = os.path.join(os.path.curdir, self.construct_scalar(node))
-        with open(fname, 'rb') as fin:
-            return fin.read().decode('utf-8')
+        return self._include("raw", node, _read_text)
 
 # New `!include` command for including YAML file
 LupbookLoader.add_constructor('!include', LupbookLoader.include)
 # New `!raw_include` command for including data file
 LupbookLoader.add_constructor('!raw_include', LupbookLoader.raw_include)
 
+#
+# Markdown conversion
+#
+def _pandoc_version():
+    """ Version of pandoc that converts the fragments """
+    # Set by pandoc when running filters
+    if os.environ.get("PANDOC_VERSION"):
+        return os.environ["PANDOC_VERSION"]
+
+    # Otherwise ask pandoc directly
+    if not hasattr(_pandoc_version, 'version'):
+        _pandoc_version.version = \
+                panflute.run_pandoc(args = ["--version"]).splitlines()[0]
+    return _pandoc_version.version
+
+def _markdown_key(text):
+    """ Cache key of markdown fragment """
+    return lupbook_cache.digest("markdown", "html", _pandoc_version(), text)
+
+def convert_markdown(text, cache = None):
+    """ Convert markdown fragment into HTML, through the cache if any """
+    if cache is not None:
+        html = cache.get(_markdown_key(text))
+        if html is not None:
+            return html
+
+    with lupbook_trace.span("convert_text", cat = "pandoc", size = len(text)):
+        html = panflute.convert_text(text, output_format='html')
+
+    if cache is not None:
+        cache.put(_markdown_key(text), html)
+    return html
+
+class MarkdownBatch:
+    """
+    Defer the conversion of markdown fragments so they can all be converted by
+    a single pandoc run, instead of one pandoc run per fragment
+    """
+
+    # Fragments that could interact with other fragments if converted as part
+    # of the same document: headers (auto-generated identifiers), code blocks
+    # (numbered identifiers), raw HTML and fenced divs (possibly unclosed),
+    # footnotes, reference links, example lists. Also setext headers,
+    # horizontal rules and definitions (whose term could be the last paragraph
+    # of the previous fragment, across the separating marker).
+    _isolate_re = re.compile(
+            r'^ {0,3}(#|```|~~~|:::|[:~]\s|\[[^\]]*\]:|[=-]+\s*$)|<[\w!?/]'
+            r'|\[\^|\(@',
+            re.MULTILINE)
+
+    def __init__(self, cache = None):
+        # Unique token so our markers cannot clash with user content
+        self.nonce = secrets.token_hex(8)
+        self.cache = cache
+        self.fragments = []
+        self.indices = {}
+        self.results = None
+        self.placeholder_re = re.compile(
+                f"<!--lupbook-md:{self.nonce}:(\\d+)-->")
+
+    def add(self, text):
+        """ Register fragment and return placeholder to be resolved later """
+        if text not in self.indices:
+            self.indices[text] = len(self.fragments)
+            self.fragments.append(text)
+        return f"<!--lupbook-md:{self.nonce}:{self.indices[text]}-->"
+
+    def convert(self):
+        """ Convert all the registered fragments """
+        self.results = [None] * len(self.fragments)
+
+        # Reuse fragments converted by previous builds
+        todo = []
+        for idx, text in enumerate(self.fragments):
+            if self.cache is not None:
+                self.results[idx] = self.cache.get(_markdown_key(text))
+            if self.results[idx] is None:
+                todo.append(idx)
+
+        self._convert(todo)
+
+        if self.cache is not None:
+            for idx in todo:
+                self.cache.put(_markdown_key(self.fragments[idx]),
+                               self.results[idx])
+
+    def _convert(self, todo):
+        # Fragments that must be converted on their own
+        batch = []
+        for idx in todo:
+            if self._isolate_re.search(self.fragments[idx]):
+                self.results[idx] = convert_markdown(self.fragments[idx])
+            else:
+                batch.append(idx)
+
+        if not batch:
+            return
+
+        # Convert all other fragments in one go, separated by raw HTML markers
+        # which pandoc passes through verbatim
+        marker = f"<!--lupbook-split:{self.nonce}-->"
+        html = convert_markdown(
+                f"\n\n{marker}\n\n".join(self.fragments[idx] for idx in batch))
+        parts = html.split(marker)
+
+        # A fragment swallowed a marker (e.g., unterminated code block or raw
+        # HTML), so splitting is unreliable: convert fragments one by one
+        if len(parts) != len(batch):
+            for idx in batch:
+                self.results[idx] = convert_markdown(self.fragments[idx])
+            return
+
+        for i, (idx, part) in enumerate(zip(batch, parts)):
+            if i > 0:
+                part = part.removeprefix("\n")
+            if i < len(parts) - 1:
+                part = part.removesuffix("\n")
+            self.results[idx] = part
+
+    def resolve(self, html):
+        """ Replace placeholders by their converted fragments """
+        return self.placeholder_re.sub(
+                lambda m: self.results[int(m.group(1))], html)
+
 #
 # Generic class from which filters for the different interactive activities are
 # meant to derive
@@ -39,15 +300,23 @@ LupbookLoader.add_constructor('!raw_include', LupbookLoader.raw_include)
 class LupbookComponent:
     def __init__(self, yaml_config):
         # Load YAML config
+        loader = LupbookLoader(yaml_config)
         try:
-            self.conf = yaml.load(yaml_config, LupbookLoader)
+            with self._span("yaml") as args:
+                self.conf = loader.get_single_data()
+                args["activity"] = self._conf_id()
         except yaml.YAMLError as error:
-            sys.stderr.write("Error loading YAML configuration: ", error)
+            sys.stderr.write("Error loading YAML configuration: {}.\n"
+                             .format(error))
             raise
+        finally:
+            loader.dispose()
+        self.includes = loader.includes
 
         # Validate YAML against schema
         try:
-            self._yaml_validator().validate(self.conf)
+            with self._span("validate", activity = self._conf_id()):
+                self._yaml_validator().validate(self.conf)
 
         except jsonschema.exceptions.ValidationError as error:
             # User error in their YAML description
@@ -62,14 +331,36 @@ class LupbookComponent:
             raise
 
         self.prefix_id = f"{self.activity_id()}-{self.conf['id']}"
+        self.md_batch = None
+        self.md_cache = None
 
     @staticmethod
     def activity_id():
         raise NotImplementedError
 
+    @classmethod
+    def code_version(cls):
+        """ Digest of the code (filters and schemas) generating the activity """
+        modules = [sys.modules[c.__module__] for c in cls.__mro__
+                   if c is not object]
+        return lupbook_cache.code_digest(modules)
+
     def _activity_name(self):
         raise NotImplementedError
 
+    def _conf_id(self):
+        """ Activity ID, if any (even if configuration is invalid) """
+        if isinstance(self.conf, dict):
+            return self.conf.get("id")
+        return None
+
+    def _span(self, name, **args):
+        """ Profiling span of activity (see `lupbook_trace`) """
+        if hasattr(self, "conf"):
+            args.setdefault("activity", self._conf_id())
+        return lupbook_trace.span(name, cat = "activity",
+                                  type = self.activity_id(), **args)
+
     @staticmethod
     def _yaml_validator():
         raise NotImplementedError
@@ -81,10 +372,15 @@ class LupbookComponent:
     def _gen_description(self):
         with div(cls = "card-body"):
             h5(self.conf["title"], cls = "card-title")
-            prompt_html = panflute.convert_text(self.conf["prompt"],
-                                                output_format='html')
+            prompt_html = self._markdown(self.conf["prompt"])
             div(raw(prompt_html), cls = "card-text lupbook-description")
 
+    def _markdown(self, text):
+        """ Convert markdown text, or defer its conversion to the batch """
+        if self.md_batch is not None:
+            return self.md_batch.add(text)
+        return convert_markdown(text, self.md_cache)
+
     def _gen_activity(self):
         raise NotImplementedError
 
@@ -131,18 +427,31 @@ class LupbookComponent:
             div(self.conf["id"], cls = "text-end text-secondary small")
 
     def _generate_html(self):
-        root = div(id = self.conf["id"],
-                   cls = "card my-3 {}-container".format(self.activity_id()))
-        with root:
-            self._gen_header()
-            self._gen_description()
-            self._gen_activity()
-            self._gen_controls()
-            self._gen_testing()
-            self._gen_footer()
-
-        return panflute.RawBlock(root.render(), 'html')
-
-    def process(self):
+        # Each part of the card is written out as it is generated (see
+        # `lupbook_html`)
+        with lupbook_html.Writer() as writer:
+            with div(id = self.conf["id"],
+                     cls = "card my-3 {}-container".format(self.activity_id())):
+                for gen in [self._gen_header, self._gen_description,
+                            self._gen_activity, self._gen_controls,
+                            self._gen_testing, self._gen_footer]:
+                    with self._span(gen.__name__):
+                        gen()
+
+        return panflute.RawBlock(writer.getvalue(), 'html')
+
+    def data(self):
+        """
+        Data the script of the activity needs (e.g., answers), gathered with
+        that of the other activities into the data island of the book instead
+        of being scattered across the generated HTML
+        """
+        return {}
+
+    def process(self, md_batch = None, md_cache = None):
+        # When given a batch, markdown fragments are left as placeholders in
+        # the generated HTML until the batch is converted and resolved
+        self.md_batch = md_batch
+        self.md_cache = md_cache
         return self._generate_html()
 
@@ -0,0 +1,265 @@
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Streaming HTML writer, with the same API and output as dominate
+
+Tags are used exactly like dominate's (as context managers, or as leaves with
+their children as arguments), but instead of building a tree of objects which
+is serialized at the end, each tag is written into the buffer of the current
+`Writer` as soon as it is complete. Only the leaves of the context currently
+open are kept as objects, since a leaf can still become the child of the next
+tag (e.g., `div(raw(html))`).
+
+The markup is the same as dominate's `render()` (pretty-printed, with sorted
+attributes), so activities render identically with either.
+"""
+
+import numbers
+
+# Indentation of pretty-printed markup
+INDENT = "  "
+
+# Writers currently open (innermost last)
+_writers = []
+
+def escape(data):
+    """ Escape text or attribute value (same as `dominate.util.escape`) """
+    data = data.replace("&", "&amp;")
+    data = data.replace("<", "&lt;")
+    data = data.replace(">", "&gt;")
+    return data.replace('"', "&quot;")
+
+_escape = escape
+
+def _clean_attribute(attribute):
+    """ Attribute name from keyword argument (same shorthands as dominate) """
+    attribute = {
+        "cls": "class",
+        "className": "class",
+        "class_name": "class",
+        "klass": "class",
+        "fr": "for",
+        "html_for": "for",
+        "htmlFor": "for",
+        "phor": "for",
+    }.get(attribute, attribute)
+
+    # Reserved words (e.g., `for_`)
+    if attribute[0] == "_":
+        attribute = attribute[1:]
+    # Dashes
+    if attribute.startswith(("data_", "aria_")) or attribute == "http_equiv":
+        attribute = attribute.replace("_", "-").lower()
+    # Colons
+    if attribute.split("_")[0] in ("xlink", "xml", "xmlns"):
+        attribute = attribute.replace("_", ":", 1).lower()
+    return attribute
+
+def _current():
+    if not _writers:
+        raise Exception("HTML tags can only be created within a"
+                        " lupbook_html.Writer")
+    return _writers[-1]
+
+class _Frame:
+    """ Tag being written, i.e. opened but not closed yet """
+    __slots__ = ("tag", "level", "pretty", "inline", "pending")
+
+    def __init__(self, tag, level, pretty):
+        self.tag = tag
+        # Indentation level of children
+        self.level = level
+        self.pretty = pretty
+        # Whether all the children written so far were inline
+        self.inline = True
+        # Leaves created in this context, not written yet
+        self.pending = []
+
+class Writer:
+    """
+    Buffer which the tags created while the writer is open are written into
+
+        with Writer() as writer:
+            with div(cls = "card"):
+                ...
+        html = writer.getvalue()
+    """
+    def __init__(self):
+        self.buffer = []
+        self.frames = [_Frame(None, 0, True)]
+
+    def __enter__(self):
+        _writers.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _writers.remove(self)
+        if exc_type is None:
+            self._flush(self.frames[-1])
+
+    def getvalue(self):
+        return "".join(self.buffer)
+
+    def _flush(self, frame):
+        """ Write pending leaves of frame """
+        pending, frame.pending = frame.pending, []
+        for node in pending:
+            self._write_child(frame, node)
+
+    def _write_child(self, frame, node):
+        if frame.tag is not None and frame.pretty and not node.is_inline:
+            frame.inline = False
+            self.buffer.append("\n" + INDENT * frame.level)
+        node._write(self.buffer, frame.level, frame.pretty)
+
+class _Node:
+    __slots__ = ()
+    is_inline = True
+
+    def _take(self, writer):
+        """ Remove node from the leaves to write (it's a child of another) """
+        pending = writer.frames[-1].pending
+        for idx in range(len(pending) - 1, -1, -1):
+            if pending[idx] is self:
+                del pending[idx]
+                return
+
+class text(_Node):
+    """ Text, escaped unless specified otherwise """
+    __slots__ = ("text",)
+
+    def __init__(self, _text, escape = True):
+        self.text = _escape(_text) if escape else _text
+        _current().frames[-1].pending.append(self)
+
+    def _write(self, buffer, level, pretty):
+        buffer.append(self.text)
+
+def raw(s):
+    """ Raw HTML (not escaped) """
+    return text(s, escape = False)
+
+class html_tag(_Node):
+    __slots__ = ("attributes", "children")
+    is_single = False
+    is_inline = False
+    is_pretty = True
+
+    def __init__(self, *args, **kwargs):
+        writer = _current()
+        self.attributes = {}
+        self.children = []
+        self._add(writer, args)
+        for attribute, value in kwargs.items():
+            attribute = _clean_attribute(attribute)
+            self.attributes[attribute] = attribute if value is True else value
+        writer.frames[-1].pending.append(self)
+
+    def _add(self, writer, args):
+        for obj in args:
+            if isinstance(obj, numbers.Number):
+                obj = str(obj)
+            if isinstance(obj, str):
+                self.children.append(escape(obj))
+            elif isinstance(obj, _Node):
+                obj._take(writer)
+                self.children.append(obj)
+            elif isinstance(obj, dict):
+                for attribute, value in obj.items():
+                    attribute = _clean_attribute(attribute)
+                    self.attributes[attribute] = \
+                            attribute if value is True else value
+            elif hasattr(obj, "__iter__"):
+                self._add(writer, obj)
+            else:
+                raise ValueError(f"{obj!r} not a tag or string.")
+
+    def _name(self):
+        return type(self).__name__.rstrip("_")
+
+    def _open(self, buffer):
+        buffer.append("<" + self._name())
+        for attribute, value in sorted(self.attributes.items()):
+            if value in (False, None):
+                continue
+            buffer.append(f' {attribute}="{escape(str(value))}"')
+        buffer.append(">")
+
+    def _write(self, buffer, level, pretty):
+        """ Write complete leaf tag """
+        pretty = pretty and self.is_pretty
+        self._open(buffer)
+        if self.is_single:
+            return
+
+        inline = True
+        for child in self.children:
+            if isinstance(child, str):
+                buffer.append(child)
+                continue
+            if pretty and not child.is_inline:
+                inline = False
+                buffer.append("\n" + INDENT * (level + 1))
+            child._write(buffer, level + 1, pretty)
+
+        if pretty and not inline:
+            buffer.append("\n" + INDENT * level)
+        buffer.append(f"</{self._name()}>")
+
+    def __enter__(self):
+        writer = _current()
+        self._take(writer)
+
+        # Earlier siblings are complete by now
+        parent = writer.frames[-1]
+        writer._flush(parent)
+        if parent.tag is not None and parent.pretty and not self.is_inline:
+            parent.inline = False
+            writer.buffer.append("\n" + INDENT * parent.level)
+        self._open(writer.buffer)
+
+        frame = _Frame(self, parent.level + 1, parent.pretty and self.is_pretty)
+        writer.frames.append(frame)
+
+        # Children given as arguments come first
+        children, self.children = self.children, []
+        for child in children:
+            if isinstance(child, str):
+                writer.buffer.append(child)
+            else:
+                writer._write_child(frame, child)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        writer = _current()
+        frame = writer.frames.pop()
+        if exc_type is not None:
+            return
+
+        writer._flush(frame)
+        if frame.pretty and not frame.inline:
+            writer.buffer.append("\n" + INDENT * (frame.level - 1))
+        writer.buffer.append(f"</{self._name()}>")
+
+#
+# Tags (those of dominate used by activities)
+#
+
+class a(html_tag): pass
+class button(html_tag): pass
+class code(html_tag): pass
+class div(html_tag): pass
+class h5(html_tag): pass
+class i(html_tag):
+    is_inline = True
+class input_(html_tag):
+    is_single = True
+class label(html_tag): pass
+class li(html_tag): pass
+class p(html_tag): pass
+class pre(html_tag):
+    is_pretty = False
+class span(html_tag): pass
+class textarea(html_tag): pass
+class ul(html_tag): pass
@@ -0,0 +1,155 @@
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Index of the activity IDs of a book, mapping each ID to the type of its
+activity, its source file (when known) and the digest of its content
+
+The index is an SQLite database, so that worker processes can register the
+activities they render concurrently (uniqueness being enforced by the
+database), that incremental builds only update the entries of the chapters
+they rebuild, and that other tools can query it once the book is built.
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import weakref
+
+import lupbook_cache
+
+def index_path(doc = None):
+    """ Path of persistent index, or None if not persisted """
+    path = os.environ.get("LUPBOOK_IDS")
+    if doc is not None:
+        path = doc.get_metadata("lupbook-ids", default = path)
+    return path or None
+
+def default_path(output):
+    """ Path of the index of the book built into `output` """
+    return os.path.abspath(output) + ".ids.sqlite"
+
+def activity_digest(text):
+    """ Digest of the content of activity """
+    return lupbook_cache.digest("activity", text)
+
+def describe(entry):
+    """ Human-readable description of where activity is defined """
+    where = f"{entry['type']} activity"
+    if entry["source"]:
+        where += f" in {entry['source']}"
+        if entry["line"]:
+            where += f":{entry['line']}"
+    return where
+
+def non_unique_error(entry, other):
+    """ Error reporting that activity `entry` reuses the ID of `other` """
+    return Exception(f"Non-unique activity id '{entry['id']}'"
+                     f" ({describe(entry)}), already used by {describe(other)}")
+
+class IdIndex:
+    def __init__(self, path = None):
+        """ Open index stored at `path`, or in memory if None """
+        self.path = path
+        self._cleanup = None
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+
+        # Each registration commits right away, so that concurrent workers
+        # see each other's entries
+        self.db = sqlite3.connect(path or ":memory:", timeout = 60,
+                                  isolation_level = None)
+        if path is not None:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS ids ("
+                        "id TEXT PRIMARY KEY, type TEXT NOT NULL, "
+                        "source TEXT, line INTEGER, digest TEXT)")
+
+    @classmethod
+    def open(cls, doc = None, shared = False):
+        """
+        Open index according to configuration. If not persisted but `shared`
+        with worker processes, the index is kept in a temporary file until
+        closed.
+        """
+        path = index_path(doc)
+        if path is not None or not shared:
+            return cls(path)
+
+        # Removed when closed, or at exit (e.g., if the build fails)
+        tmp_dir = tempfile.mkdtemp(prefix = "lupbook-ids-")
+        index = cls(os.path.join(tmp_dir, "ids.sqlite"))
+        index._cleanup = weakref.finalize(index, shutil.rmtree, tmp_dir,
+                                          ignore_errors = True)
+        return index
+
+    def add(self, ident, activity_type, source = None, line = None,
+            digest = None):
+        """ Add activity to index, return False if ID is already used """
+        try:
+            self.db.execute("INSERT INTO ids VALUES (?, ?, ?, ?, ?)",
+                            (ident, activity_type, source, line, digest))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def register(self, ident, activity_type, source = None, line = None,
+                 digest = None):
+        """ Add activity to index, raise an exception if ID is already used """
+        if not self.add(ident, activity_type, source, line, digest):
+            entry = { "id": ident, "type": activity_type, "source": source,
+                     "line": line, "digest": digest }
+            raise non_unique_error(entry, self.lookup(ident))
+
+    def lookup(self, ident):
+        """ Entry of ID, or None """
+        row = self.db.execute("SELECT * FROM ids WHERE id = ?",
+                              (ident,)).fetchone()
+        return self._entry(row) if row is not None else None
+
+    def entries(self, source = False):
+        """ All entries, or only those of `source` """
+        if source is False:
+            rows = self.db.execute("SELECT * FROM ids ORDER BY source, line, id")
+        else:
+            rows = self.db.execute("SELECT * FROM ids WHERE source IS ?"
+                                   " ORDER BY line, id", (source,))
+        return [self._entry(row) for row in rows]
+
+    @staticmethod
+    def _entry(row):
+        return dict(zip(("id", "type", "source", "line", "digest"), row))
+
+    def clear(self):
+        self.db.execute("DELETE FROM ids")
+
+    def remove_source(self, source):
+        """ Forget entries of source (e.g., before it gets processed again) """
+        self.db.execute("DELETE FROM ids WHERE source IS ?", (source,))
+
+    def retain_sources(self, sources):
+        """ Forget entries of any other source (or without source) """
+        sources = list(sources)
+        self.db.execute("DELETE FROM ids WHERE source IS NULL"
+                        " OR source NOT IN ({})".format(
+                            ", ".join("?" * len(sources))), sources)
+
+    def replace_source(self, source, entries):
+        """ Replace entries of source at once """
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.remove_source(source)
+            for entry in entries:
+                self.register(entry["id"], entry["type"], source,
+                              entry.get("line"), entry.get("digest"))
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    def close(self):
+        self.db.close()
+        if self._cleanup is not None:
+            self._cleanup()
@@ -0,0 +1,272 @@
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Check the activities of a book without building it
+
+Activity code blocks are found by scanning the markdown sources (no pandoc
+involved), then loaded, validated and checked by the activity classes in
+parallel, so that all the errors of the book are reported in one go, with their
+location.
+"""
+
+import concurrent.futures
+import contextlib
+import io
+import os
+import re
+import sys
+
+import jsonschema
+import yaml
+
+import lupbook_build
+import lupbook_filter
+import lupbook_parallel
+import lupbook_ids
+import lupbook_registry
+
+# Opening or closing fence of a code block
+_FENCE_RE = re.compile(r'^([ \t]*)(`{3,}|~{3,})[ \t]*(.*?)[ \t]*$')
+
+#
+# Scanning
+#
+
+def _block_class(info):
+    """ First class of fenced code block, from its info string """
+    if info.startswith("{"):
+        match = re.search(r'(?:^|\s)\.([^\s}]+)', info[1:])
+        return match.group(1) if match else None
+    return info.split()[0] if info else None
+
+def scan_markdown(fname):
+    """
+    Fenced code blocks of markdown file, as list of `(line, class, text)`
+    (line of the opening fence, counting from 1)
+    """
+    with open(fname, encoding = 'utf-8') as f:
+        lines = f.read().splitlines()
+
+    blocks = []
+    i = 0
+    while i < len(lines):
+        match = _FENCE_RE.match(lines[i])
+        if not match or (match.group(2)[0] == "`" and "`" in match.group(3)):
+            i += 1
+            continue
+
+        indent, fence, info = match.groups()
+        start = i
+        i += 1
+        content = []
+        while i < len(lines):
+            closing = _FENCE_RE.match(lines[i])
+            if closing and not closing.group(3) \
+                    and len(closing.group(1)) <= len(indent) + 3 \
+                    and closing.group(2)[0] == fence[0] \
+                    and len(closing.group(2)) >= len(fence):
+                break
+            line = lines[i]
+            content.append(line[len(indent):] if line.startswith(indent)
+                           else line.lstrip())
+            i += 1
+        i += 1
+
+        blocks.append((start + 1, _block_class(info),
+                       "\n".join(content) + "\n"))
+    return blocks
+
+def read_declarations(fname):
+    """ Activity types declared in the metadata block of markdown file """
+    with open(fname, encoding = 'utf-8') as f:
+        lines = f.read().splitlines()
+    if not lines or lines[0].rstrip() != "---":
+        return {}
+
+    for end, line in enumerate(lines[1:], 1):
+        if line.rstrip() in ("---", "..."):
+            break
+    else:
+        return {}
+    try:
+        meta = yaml.safe_load("\n".join(lines[1:end]))
+    except yaml.YAMLError:
+        return {}
+    if not isinstance(meta, dict):
+        return {}
+    return meta.get("lupbook-activities") or {}
+
+#
+# Checking (worker side)
+#
+
+def _init_worker(cwd, declarations):
+    # Included files are relative to the source directory
+    os.chdir(cwd)
+    for activity_id, (module, class_name) in declarations.items():
+        lupbook_registry.register_activity(activity_id, module, class_name)
+
+def _node_line(text, path):
+    """ Line of the YAML node at `path` in activity text (counting from 0) """
+    try:
+        node = yaml.compose(text, Loader = yaml.SafeLoader)
+    except yaml.YAMLError:
+        return 0
+
+    for key in path:
+        if isinstance(node, yaml.MappingNode):
+            values = [v for k, v in node.value if k.value == key]
+        elif isinstance(node, yaml.SequenceNode) and isinstance(key, int) \
+                and key < len(node.value):
+            values = [node.value[key]]
+        else:
+            values = []
+        if not values:
+            break
+        node = values[0]
+    return node.start_mark.line
+
+def _path_str(path):
+    result = ""
+    for key in path:
+        result += f"[{key}]" if isinstance(key, int) else f".{key}"
+    return result.lstrip(".")
+
+def _load(text):
+    loader = lupbook_filter.LupbookLoader(text)
+    try:
+        return loader.get_single_data()
+    finally:
+        loader.dispose()
+
+def _schema_errors(cls, text, fname, line):
+    """ All the schema errors of activity, rather than just the first one """
+    validator = cls._yaml_validator()
+    validator = getattr(validator, "reference", validator)
+    errors = []
+    for error in validator.iter_errors(_load(text)):
+        message = error.message
+        if error.absolute_path:
+            message += f" (at '{_path_str(error.absolute_path)}')"
+        errors.append((fname, line + 1 + _node_line(text, error.absolute_path),
+                       message))
+    return errors
+
+def _error_message(error):
+    if type(error) is Exception:
+        return str(error)
+    return f"{type(error).__name__}: {error}"
+
+def _yaml_error(error, fname, line):
+    mark = getattr(error, "problem_mark", None)
+    if mark is None:
+        return (fname, line, _error_message(error))
+    message = ": ".join(m for m in (error.context, error.problem) if m)
+    if mark.name not in ("<unicode string>", "<file>"):
+        # Error in an included file
+        return (os.path.normpath(mark.name), mark.line + 1, message)
+    return (fname, line + 1 + mark.line, message)
+
+def _check_activity(fname, line, activity_type, text):
+    """ Activity ID (or None) and list of `(file, line, message)` errors """
+    cls = lupbook_registry.get_activity(activity_type)
+    ident = lupbook_parallel.guess_id(text)
+
+    # Activities report errors on stderr on their own
+    with contextlib.redirect_stderr(io.StringIO()):
+        try:
+            activity = cls(text)
+            return activity.conf["id"], []
+        except yaml.YAMLError as e:
+            errors = [_yaml_error(e, fname, line)]
+        except jsonschema.exceptions.ValidationError:
+            try:
+                errors = _schema_errors(cls, text, fname, line)
+            except Exception as e:
+                errors = [(fname, line, _error_message(e))]
+        except Exception as e:
+            errors = [(fname, line, _error_message(e))]
+
+    return ident if ident != "<unknown>" else None, \
+        [(f, l, f"{activity_type} activity '{ident}': {message}")
+         for f, l, message in errors]
+
+def _check_chunk(chunk):
+    return [_check_activity(*block) for block in chunk]
+
+#
+# Caller side
+#
+
+def lint(src_dir = None, sources = None, jobs = 0):
+    """
+    Check all the activities of book using `jobs` processes (0 for all cores),
+    return list of `(file, line, message)` errors and number of activities
+    """
+    src_dir = os.path.abspath(src_dir or os.curdir)
+    if not sources:
+        sources = lupbook_build.default_sources(src_dir)
+
+    # Activity types declared by the book itself
+    declarations = {}
+    for fname in sources:
+        declarations.update(read_declarations(os.path.join(src_dir, fname)))
+    lupbook_registry.register_activities(declarations)
+    activity_ids = set(lupbook_registry.activity_ids())
+
+    blocks = [(fname, line, cls, text) for fname in sources
+              for line, cls, text in scan_markdown(os.path.join(src_dir,
+                                                                fname))
+              if cls in activity_ids]
+
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+
+    initargs = (src_dir, lupbook_registry.declarations())
+    if jobs == 1 or len(blocks) < 2:
+        cwd = os.getcwd()
+        try:
+            _init_worker(*initargs)
+            results = _check_chunk(blocks)
+        finally:
+            os.chdir(cwd)
+    else:
+        chunk_size = max(1, -(-len(blocks) // (jobs * 4)))
+        chunks = [blocks[i:i + chunk_size]
+                  for i in range(0, len(blocks), chunk_size)]
+        results = []
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers = min(jobs, len(chunks)),
+                initializer = _init_worker, initargs = initargs) as executor:
+            for chunk_results in executor.map(_check_chunk, chunks):
+                results += chunk_results
+
+    # Uniqueness of IDs across the book
+    errors = []
+    index = lupbook_ids.IdIndex()
+    for (fname, line, activity_type, text), (ident, activity_errors) \
+            in zip(blocks, results):
+        errors += activity_errors
+        if ident is None:
+            continue
+        try:
+            index.register(ident, activity_type, fname, line,
+                           lupbook_ids.activity_digest(text))
+        except Exception as e:
+            errors.append((fname, line, str(e)))
+    index.close()
+
+    errors.sort(key = lambda e: (sources.index(e[0]) if e[0] in sources
+                                 else len(sources), e[0], e[1]))
+    return errors, len(blocks)
+
+def report(errors, count):
+    """ Print errors, return whether there was none """
+    for fname, line, message in errors:
+        sys.stderr.write(f"{fname}:{line}: {message}\n")
+    if errors:
+        sys.stderr.write(f"{len(errors)} error(s) in {count} activities\n")
+    else:
+        sys.stderr.write(f"{count} activities checked, no errors\n")
+    return not errors
@@ -0,0 +1,166 @@
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Multi-page output: one HTML page per section of the main TOC (down to
+`main-toc-depth`), instead of a single page holding the whole book
+
+The root page (content before the first section) is written to the output
+file, and each section to `<section id>.html` next to it. Every page has the
+same main TOC, linking to the pages, but only holds its own section (preceded
+by the headers of its super sections, which `toc.js` keeps hidden) and its own
+page TOC. Links to anchors of other pages are rewritten to point to them.
+"""
+
+import concurrent.futures
+import json
+import os
+import re
+
+import panflute
+
+import lupbook
+import lupbook_build
+import lupbook_filter
+import toc_filter
+
+# Identifiers defined in raw HTML (e.g., activities)
+_HTML_ID_RE = re.compile(r'\sid="([^"]+)"')
+
+class _Page:
+    def __init__(self, node, level, fname):
+        # Section of page in TOC (root node for root page)
+        self.node = node
+        self.level = level
+        self.fname = fname
+        self.blocks = []
+        # Headers of super sections, only there for the structure of the page
+        self.ancestors = []
+        # Types of the activities of the page, and modes of their editors
+        self.types = set()
+        self.modes = set()
+        # Identifiers defined in the raw HTML of the page (e.g., activities)
+        self.idents = set()
+
+def _page_fname(ident, root_fname):
+    fname = f"{ident}.html"
+    if fname == root_fname:
+        raise Exception(f"Page of section '{ident}' would overwrite the root"
+                        " page")
+    return fname
+
+def split_pages(doc, root_fname):
+    """ Split (filtered) document into pages """
+    # TOC of the final document, i.e. with unique identifiers
+    toc_filter._prepare_toc_filter(doc)
+    doc.walk(toc_filter._process_toc_filter)
+    nodes = { sect["id"]: (sect, level)
+             for sect, level in toc_filter._page_sections(doc)
+             if level > 0 }
+
+    root = _Page(doc.toc_all[0][0], 0, root_fname)
+    pages = [root]
+    headers = []
+    for block in doc.content:
+        if isinstance(block, panflute.Header) \
+                and block.level <= doc.main_toc_depth \
+                and block.identifier in nodes:
+            node, level = nodes[block.identifier]
+            headers = [h for h in headers if h.level < block.level]
+            page = _Page(node, level, _page_fname(node["id"], root_fname))
+            page.ancestors = list(headers)
+            pages.append(page)
+            headers.append(block)
+        pages[-1].blocks.append(block)
+    return pages
+
+def _rewrite_links(pages):
+    """
+    Point links to anchors of other pages to these pages, return the page of
+    each anchor (and collect the activity assets of each page on the way)
+    """
+    locations = {}
+    def collect(element, doc):
+        if getattr(element, "identifier", None):
+            locations.setdefault(element.identifier, page.fname)
+        elif isinstance(element, panflute.RawBlock) and element.format == "html":
+            for ident in _HTML_ID_RE.findall(element.text):
+                locations.setdefault(ident, page.fname)
+                page.idents.add(ident)
+            page.types |= lupbook_filter.activity_types(element.text)
+            page.modes |= lupbook_filter.editor_modes(element.text)
+
+    for page in pages:
+        for block in page.blocks:
+            block.walk(collect)
+
+    def rewrite(element, doc):
+        if isinstance(element, panflute.Link) and element.url.startswith("#"):
+            location = locations.get(element.url[1:])
+            if location is not None and location != page.fname:
+                element.url = location + element.url
+
+    for page in pages:
+        for block in page.blocks:
+            block.walk(rewrite)
+    return locations
+
+def _page_json(doc, page, pages, locations, main_toc, api_version, data):
+    def href(ident):
+        location = locations.get(ident, page.fname)
+        return f"#{ident}" if location == page.fname else f"{location}#{ident}"
+
+    if main_toc is not None:
+        doc.metadata["main-toc"] = main_toc
+    if doc.toc_depth > 0:
+        doc.metadata["page-toc"] = toc_filter._page_toc(
+                doc, [(page.node, page.level)], href)
+    doc.metadata["lupbook-root-page"] = pages[0].fname
+    # Pages only include the scripts and styles of their own activities
+    lupbook.set_activity_assets(doc, page.types, page.modes)
+    lupbook.set_activity_data(doc, { ident: d for ident, d in data.items()
+                                    if ident in page.idents })
+    if page.level > 0:
+        doc.metadata["lupbook-page"] = page.node["id"]
+    elif "lupbook-page" in doc.metadata:
+        del doc.metadata["lupbook-page"]
+
+    return json.dumps({ "pandoc-api-version": api_version,
+                       "meta": doc.metadata.to_json()["c"],
+                       "blocks": [b.to_json() for b in page.ancestors
+                                  + page.blocks] })
+
+def write_pages(doc, output, template = None, variables = None, embed = True,
+                src_dir = None, pandoc = "pandoc", jobs = None):
+    """
+    Write (filtered) document as one page per section, return the paths of
+    the pages (the root page first, written to `output`)
+    """
+    out_dir = os.path.dirname(os.path.abspath(output))
+    pages = split_pages(doc, os.path.basename(output))
+    locations = _rewrite_links(pages)
+
+    # Same main TOC on every page
+    page_of = { page.node["id"]: page.fname for page in pages[1:] }
+    main_toc = None
+    if doc.main_toc_depth > 0:
+        main_toc = toc_filter._main_toc(
+                doc, lambda ident: f"{page_of.get(ident, pages[0].fname)}"
+                f"#{ident}")
+
+    # Data island of each page only holds the data of its own activities
+    activity_data = lupbook.activity_data(doc)
+
+    api_version = list(doc.api_version)
+    data = [(_page_json(doc, page, pages, locations, main_toc, api_version,
+                        activity_data),
+             os.path.join(out_dir, page.fname)) for page in pages]
+
+    # pandoc runs in its own processes, so threads are enough
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers = jobs or os.cpu_count() or 1) as executor:
+        list(executor.map(
+            lambda args: lupbook_build.write_json(
+                *args, template, variables, embed, src_dir, pandoc),
+            data))
+    return [fname for _, fname in data]
@@ -0,0 +1,174 @@
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Render activities in parallel, using a pool of worker processes
+
+Activities are independent from one another, except for the uniqueness of their
+IDs, which workers register in the index of the caller (see `lupbook_ids`).
+Workers register IDs first-come, so the caller reports non-unique IDs itself,
+in document order.
+"""
+
+import concurrent.futures
+import os
+import re
+
+import lupbook_cache
+import lupbook_filter
+import lupbook_ids
+import lupbook_registry
+import lupbook_trace
+
+def jobs_count(doc = None):
+    """
+    Number of worker processes to render activities with (1 means that
+    activities are rendered sequentially, by the filter process itself)
+    """
+    jobs = os.environ.get("LUPBOOK_JOBS", 1)
+    if doc is not None:
+        jobs = doc.get_metadata("lupbook-jobs", default = jobs)
+    jobs = int(jobs)
+
+    # 0 means as many workers as CPU cores
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    return jobs
+
+def guess_id(text):
+    """ Find activity ID in activity config, even if invalid YAML """
+    match = re.search(r'^id\s*:\s*["\']?([^"\'\s#]+)', text, re.MULTILINE)
+    return match.group(1) if match else "<unknown>"
+
+#
+# Worker side
+#
+
+# Configuration of worker process
+_worker = {}
+
+def _init_worker(cwd, declarations, md_cache, md_batch, include_cache_size,
+                 trace, ids):
+    # Included files are relative to the filter's working directory
+    os.chdir(cwd)
+
+    # Activity types declared by the book
+    for activity_id, (module, class_name) in declarations.items():
+        lupbook_registry.register_activity(activity_id, module, class_name)
+
+    # Each worker only sees a subset of the activities: uniqueness of IDs is
+    # checked against the shared index (and reported by the caller)
+    path, source = ids
+    _worker["ids"] = lupbook_ids.IdIndex(path)
+    _worker["ids_source"] = source
+
+    _worker["md_cache"] = md_cache
+    _worker["md_batch"] = md_batch
+    lupbook_filter.include_cache.max_size = include_cache_size
+    if trace:
+        lupbook_trace.enable()
+
+def _render_chunk(chunk):
+    """
+    Render chunk of activities, return one result per activity, the
+    statistics of the include cache and the profiling events
+    """
+    lupbook_filter.include_cache.reset_stats()
+
+    # The markdown cache is shared with the other workers, which it doesn't
+    # lock out while open (see `lupbook_cache.LupbookCache`)
+    md_cache = None
+    if _worker["md_cache"] is not None:
+        md_cache = lupbook_cache.LupbookCache(*_worker["md_cache"])
+    try:
+        results = _render_activities(chunk, md_cache)
+    finally:
+        if md_cache is not None:
+            md_cache.close()
+
+    return results, lupbook_filter.include_cache.raw_stats(), \
+            lupbook_trace.take_events()
+
+def _render_activities(chunk, md_cache):
+    md_batch = lupbook_filter.MarkdownBatch(md_cache) \
+            if _worker["md_batch"] else None
+
+    results = []
+    for activity_id, text in chunk:
+        try:
+            with lupbook_trace.span("activity", type = activity_id) as args:
+                activity = lupbook_registry.get_activity(activity_id)(text)
+                args["activity"] = activity.conf["id"]
+                _worker["ids"].add(
+                        activity.conf["id"], activity_id, _worker["ids_source"],
+                        digest = lupbook_ids.activity_digest(text))
+                block = activity.process(md_batch, md_cache)
+        except Exception as e:
+            results.append({ "error": f"{activity_id} activity"
+                            f" '{guess_id(text)}': {type(e).__name__}: {e}" })
+            continue
+
+        includes = [(fname, lupbook_cache.file_digest(fname))
+                    for fname in activity.includes]
+        results.append({ "id": activity.conf["id"],
+                        "includes": includes,
+                        "random": activity.conf.get("random", False),
+                        "data": activity.data(),
+                        "html": block.text })
+
+    # Convert the markdown fragments of the whole chunk at once
+    if md_batch is not None:
+        try:
+            with lupbook_trace.span("markdown_batch",
+                                    count = len(md_batch.fragments)):
+                md_batch.convert()
+        except Exception as e:
+            ids = ", ".join(f"'{r['id']}'" for r in results if "id" in r)
+            raise Exception(f"Markdown conversion of activities {ids}:"
+                            f" {type(e).__name__}: {e}")
+        for result in results:
+            if "html" in result:
+                result["html"] = md_batch.resolve(result["html"])
+
+    return results
+
+#
+# Caller side
+#
+
+def render_activities(activities, jobs, md_cache = None, md_batch = True,
+                      ids = (None, None)):
+    """
+    Render list of `(activity_id, text)` using `jobs` worker processes, and
+    return one result per activity, in the same order. Activities are
+    registered in the ID index at path `ids[0]`, as part of source `ids[1]`.
+    A result is either a dictionary with the rendered `html`, the activity
+    `id`, its `includes`, its `data` and whether it's `random`, or a
+    dictionary with an `error` message.
+    """
+    if not activities:
+        return []
+
+    # Several chunks per worker to balance load, but each chunk costs one
+    # pandoc run for its markdown fragments
+    chunk_size = max(1, -(-len(activities) // (jobs * 4)))
+    chunks = [activities[i:i + chunk_size]
+              for i in range(0, len(activities), chunk_size)]
+
+    cache_conf = None
+    if md_cache is not None:
+        cache_conf = (md_cache.path, md_cache.name, md_cache.max_size)
+    initargs = (os.getcwd(), lupbook_registry.declarations(), cache_conf,
+                md_batch, lupbook_filter.include_cache.max_size,
+                lupbook_trace.enabled(), ids)
+
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers = min(jobs, len(chunks)),
+            initializer = _init_worker, initargs = initargs) as executor:
+        for chunk_results, stats, events in executor.map(_render_chunk,
+                                                         chunks):
+            results += chunk_results
+            lupbook_filter.include_cache.add_stats(stats)
+            lupbook_trace.add_events(events)
+    return results
@@ -0,0 +1,94 @@
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Registry of activity types
+
+Activity types are declared by the module and class implementing them, and
+are only imported (along with their schema and its validator) the first time an
+activity of that type is found.
+"""
+
+import importlib
+import importlib.util
+import os
+import sys
+
+# Declared activity types: activity id (i.e., code block class) -> (module path,
+# class name)
+_activities = {}
+
+# Activity classes already imported: activity id -> class
+_classes = {}
+
+def register_activity(activity_id, module, class_name):
+    """
+    Declare activity type, implemented by class `class_name` of `module`, which
+    is either a module name or the path of a Python file
+    """
+    if _activities.get(activity_id) != (module, class_name):
+        _activities[activity_id] = (module, class_name)
+        _classes.pop(activity_id, None)
+
+def register_activities(declarations):
+    """
+    Declare activity types from a mapping of activity ids to `module:Class`
+    (or `module.Class`) strings, e.g., from the document metadata
+    """
+    for activity_id, decl in declarations.items():
+        module, sep, class_name = decl.rpartition(":")
+        if not sep:
+            module, sep, class_name = decl.rpartition(".")
+        if not sep or not module or not class_name:
+            raise Exception(f"Invalid declaration '{decl}' of activity"
+                            f" '{activity_id}'")
+        register_activity(activity_id, module, class_name)
+
+def declarations():
+    """ All declared activity types, as activity id -> (module, class name) """
+    return dict(_activities)
+
+def activity_ids():
+    """ Identifiers of all declared activity types """
+    return list(_activities)
+
+def _import(module):
+    if not module.endswith(".py"):
+        return importlib.import_module(module)
+
+    # Python file, relative to the current (i.e., source) directory
+    fname = os.path.abspath(module)
+    name = os.path.splitext(os.path.basename(fname))[0]
+    if name in sys.modules \
+            and getattr(sys.modules[name], "__file__", None) == fname:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, fname)
+    mod = importlib.util.module_from_spec(spec)
+    sys.modules[name] = mod
+    spec.loader.exec_module(mod)
+    return mod
+
+def get_activity(activity_id):
+    """ Class of activity type, or None if no such activity type """
+    if activity_id in _classes:
+        return _classes[activity_id]
+    if activity_id not in _activities:
+        return None
+
+    module, class_name = _activities[activity_id]
+    cls = getattr(_import(module), class_name)
+    if cls.activity_id() != activity_id:
+        raise Exception(f"Activity class '{class_name}' of module '{module}'"
+                        f" is for activity '{cls.activity_id()}', not"
+                        f" '{activity_id}'")
+
+    _classes[activity_id] = cls
+    return cls
+
+# Built-in activity types
+register_activity("fib", "fib_filter", "LupbookFIB")
+register_activity("hparsons", "hparsons_filter", "LupbookHParsons")
+register_activity("icode", "icode_filter", "LupbookICode")
+register_activity("matching", "matching_filter", "LupbookMatching")
+register_activity("mcq", "mcq_filter", "LupbookMCQ")
+register_activity("parsons", "parsons_filter", "LupbookParsons")
@@ -1,6 +1,7 @@
 # Copyright (c) 2021 LupLab
 # SPDX-License-Identifier: AGPL-3.0-only
 
+import numbers
 import re
 import sys
 
@@ -33,24 +34,269 @@ def _extend_with_default(validator_class):
 LupbookValidator = _extend_with_default(jsonschema.Draft4Validator)
 
 
-### Check that the ID of each interactive component is
-# 1/ a valid HTML5 ID and 2/ a unique ID across the textbook
+### Check that the ID of each interactive component is a valid HTML5 ID
+# (uniqueness across the textbook is checked by `lupbook_ids`)
 lupbook_format_checker = jsonschema.FormatChecker()
 
+# Allow all alphanumeric characters and hyphens, but that's it
+_LUPBOOK_ID_RE = re.compile(r'[\w\-]+')
+
 # Function called for format set to "id_valid" in JSON schema
 @lupbook_format_checker.checks('lupbook_id')
 def _check_lupbook_id(value):
-    # Keep track of all the IDs across format validation calls
-    if not hasattr(_check_lupbook_id, 'all_ids'):
-        _check_lupbook_id.all_ids = set()
-
-    # Allow all alphanumeric characters and hyphens, but that's it
-    if not re.fullmatch(r'[\w\-]+', value):
+    if not _LUPBOOK_ID_RE.fullmatch(value):
         sys.stderr.write(f"Invalid activity id '{value}'\n")
         return False
-    if value in _check_lupbook_id.all_ids:
-        sys.stderr.write(f"Non-unique activity id '{value}'\n")
+    return True
+
+def _valid_lupbook_id(value):
+    """ Whether value is a valid ID, without reporting it """
+    return isinstance(value, str) and _LUPBOOK_ID_RE.fullmatch(value) is not None
+
+
+### Compile schemas into plain Python functions
+# Interpreting schemas with `LupbookValidator` on each activity is slow, so
+# schemas are turned into the source code of a function checking an instance
+# (and filling in defaults) in one go. Only valid instances take that path: as
+# soon as the compiled function fails, the instance is validated again by
+# `LupbookValidator`, so that errors are reported exactly as before.
+
+class _Unsupported(Exception):
+    pass
+
+# Schema keywords understood by the compiler (others make the whole schema
+# fall back to `LupbookValidator`)
+_ANNOTATIONS = { "title", "description", "default", "$schema" }
+_KEYWORDS = _ANNOTATIONS | {
+    "type", "properties", "required", "additionalProperties", "items",
+    "minItems", "maxItems", "minLength", "maxLength", "pattern", "enum",
+    "format", "minimum", "maximum", "exclusiveMinimum", "exclusiveMaximum",
+    "allOf", "anyOf", "oneOf", "not" }
+
+# Draft 4 types (booleans are neither integers nor numbers)
+_TYPES = {
+    "string": "isinstance({0}, str)",
+    "integer": "(isinstance({0}, int) and not isinstance({0}, bool))",
+    "number": "(isinstance({0}, _Number) and not isinstance({0}, bool))",
+    "boolean": "isinstance({0}, bool)",
+    "object": "isinstance({0}, dict)",
+    "array": "isinstance({0}, list)",
+    "null": "{0} is None" }
+
+def _enum_equal(value, member):
+    """ Equality as in JSON (e.g., `true` isn't `1`) """
+    if isinstance(value, bool) != isinstance(member, bool):
         return False
+    return value == member
 
-    _check_lupbook_id.all_ids.add(value)
-    return True
+def _side_effects(schema):
+    """ Whether validating against schema fills in defaults or reports IDs """
+    if isinstance(schema, dict):
+        return "default" in schema or "format" in schema \
+            or any(_side_effects(v) for v in schema.values())
+    if isinstance(schema, list):
+        return any(_side_effects(v) for v in schema)
+    return False
+
+class _Compiler:
+    def __init__(self, format_checker):
+        self.format_checker = format_checker
+        self.namespace = { "_Number": numbers.Number,
+                          "_enum_equal": _enum_equal,
+                          "_valid_lupbook_id": _valid_lupbook_id,
+                          "_format_checker": format_checker }
+        self.functions = []
+        self.count = 0
+
+    def _name(self, prefix):
+        self.count += 1
+        return f"_{prefix}{self.count}"
+
+    def _const(self, value):
+        name = self._name("c")
+        self.namespace[name] = value
+        return name
+
+    def function(self, schema):
+        """ Generate function validating an instance, return its name """
+        name = self._name("validate")
+        lines = [f"def {name}(x):"]
+        self._schema(schema, "x", lines, 1)
+        lines.append("    return True")
+        self.functions.append("\n".join(lines))
+        return name
+
+    def _schema(self, schema, var, lines, level):
+        """ Append code checking `var` against schema """
+        if not isinstance(schema, dict) or not _KEYWORDS.issuperset(schema):
+            raise _Unsupported(schema)
+
+        def emit(line, indent = 0):
+            lines.append("    " * (level + indent) + line)
+
+        # Same order as `LupbookValidator`, for defaults to be filled in the
+        # same way
+        for keyword, value in schema.items():
+            if keyword in _ANNOTATIONS or keyword.startswith("exclusive"):
+                continue
+
+            if keyword == "type":
+                types = [value] if isinstance(value, str) else value
+                if not all(t in _TYPES for t in types):
+                    raise _Unsupported(value)
+                check = " or ".join(_TYPES[t].format(var) for t in types)
+                if len(types) > 1:
+                    check = f"({check})"
+                emit(f"if not {check}: return False")
+
+            elif keyword == "properties":
+                emit(f"if isinstance({var}, dict):")
+                for prop, subschema in value.items():
+                    if not isinstance(subschema, dict):
+                        raise _Unsupported(subschema)
+                    if "default" not in subschema:
+                        continue
+                    default = subschema["default"]
+                    if callable(default):
+                        emit(f"{var}.setdefault({prop!r},"
+                             f" {self._const(default)}({var}))", 1)
+                    else:
+                        emit(f"{var}.setdefault({prop!r},"
+                             f" {self._const(default)})", 1)
+                for prop, subschema in value.items():
+                    sub = self._name("v")
+                    emit(f"if {prop!r} in {var}:", 1)
+                    emit(f"{sub} = {var}[{prop!r}]", 2)
+                    self._schema(subschema, sub, lines, level + 2)
+                emit("pass", 1)
+
+            elif keyword == "required":
+                check = " and ".join(f"{prop!r} in {var}" for prop in value)
+                emit(f"if isinstance({var}, dict) and not ({check}):"
+                     " return False")
+
+            elif keyword == "additionalProperties":
+                if "patternProperties" in schema:
+                    raise _Unsupported(schema)
+                known = self._const(frozenset(schema.get("properties", ())))
+                if value is False:
+                    emit(f"if isinstance({var}, dict)"
+                         f" and not {known}.issuperset({var}): return False")
+                elif isinstance(value, dict):
+                    key, sub = self._name("k"), self._name("v")
+                    emit(f"if isinstance({var}, dict):")
+                    emit(f"for {key}, {sub} in {var}.items():", 1)
+                    emit(f"if {key} not in {known}:", 2)
+                    self._schema(value, sub, lines, level + 3)
+                elif value is not True:
+                    raise _Unsupported(value)
+
+            elif keyword == "items":
+                if not isinstance(value, dict):
+                    raise _Unsupported(value)
+                sub = self._name("v")
+                emit(f"if isinstance({var}, list):")
+                emit(f"for {sub} in {var}:", 1)
+                self._schema(value, sub, lines, level + 2)
+
+            elif keyword in ("minItems", "maxItems", "minLength", "maxLength"):
+                kind = "list" if keyword.endswith("Items") else "str"
+                op = "<" if keyword.startswith("min") else ">"
+                emit(f"if isinstance({var}, {kind}) and len({var}) {op} {value!r}:"
+                     " return False")
+
+            elif keyword == "pattern":
+                regex = self._const(re.compile(value))
+                emit(f"if isinstance({var}, str) and not {regex}.search({var}):"
+                     " return False")
+
+            elif keyword == "enum":
+                if all(isinstance(v, str) for v in value):
+                    emit(f"if not (isinstance({var}, str) and {var} in"
+                         f" {self._const(frozenset(value))}): return False")
+                elif all(v is None or isinstance(v, (str, bool, int, float))
+                         for v in value):
+                    emit(f"if not any(_enum_equal({var}, m) for m in"
+                         f" {self._const(tuple(value))}): return False")
+                else:
+                    raise _Unsupported(value)
+
+            elif keyword == "format":
+                if self.format_checker is None:
+                    continue
+                if value == "lupbook_id" \
+                        and self.format_checker is lupbook_format_checker:
+                    # Invalid IDs are reported by `LupbookValidator`
+                    emit(f"if not _valid_lupbook_id({var}): return False")
+                else:
+                    emit(f"if not _format_checker.conforms({var}, {value!r}):"
+                         " return False")
+
+            elif keyword in ("minimum", "maximum"):
+                exclusive = schema.get("exclusive" + keyword.capitalize(), False)
+                if keyword == "minimum":
+                    op = "<=" if exclusive else "<"
+                else:
+                    op = ">=" if exclusive else ">"
+                emit(f"if {_TYPES['number'].format(var)}"
+                     f" and {var} {op} {value!r}: return False")
+
+            elif keyword == "allOf":
+                for subschema in value:
+                    self._schema(subschema, var, lines, level)
+
+            else:
+                # Branches which may fail are checked by separate functions;
+                # any side effect would differ from `LupbookValidator`
+                if _side_effects(value):
+                    raise _Unsupported(value)
+                if keyword == "not":
+                    emit(f"if {self.function(value)}({var}): return False")
+                else:
+                    calls = [f"{self.function(v)}({var})" for v in value]
+                    if keyword == "anyOf":
+                        emit(f"if not ({' or '.join(calls)}): return False")
+                    else:
+                        # Like `LupbookValidator`, evaluate all the branches
+                        emit(f"if [{', '.join(calls)}].count(True) != 1:"
+                             " return False")
+
+class CompiledValidator:
+    """
+    Validator of a schema compiled on first use, with the same behavior as
+    `LupbookValidator` (defaults, `lupbook_id` format, errors)
+    """
+    def __init__(self, schema, format_checker = None):
+        self.schema = schema
+        self.format_checker = format_checker
+        self.reference = LupbookValidator(schema,
+                                          format_checker = format_checker)
+        self.source = None
+        self._validate = None
+
+    def compile(self):
+        compiler = _Compiler(self.format_checker)
+        try:
+            name = compiler.function(self.schema)
+        except _Unsupported:
+            # Leave it to `LupbookValidator`
+            self._validate = False
+            return
+
+        self.source = "\n\n".join(compiler.functions) + "\n"
+        title = self.schema.get("title", "schema")
+        exec(compile(self.source, f"<compiled {title}>", "exec"),
+             compiler.namespace)
+        self._validate = compiler.namespace[name]
+
+    def validate(self, instance):
+        """ Validate instance, filling in defaults """
+        if self._validate is None:
+            self.compile()
+
+        if self._validate:
+            if self._validate(instance):
+                return
+
+        # Invalid instance (or schema not compiled): report the error
+        self.reference.validate(instance)
@@ -0,0 +1,241 @@
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Full-text search: an inverted index of the book built along with its TOC, which
+`modules/search.js` queries without scanning the page
+
+Each section of the TOC (down to `section-toc-depth`) is a document of the
+index, made of its title, its text, and the titles and prompts of its
+activities, up to its first subsection. Terms are lowercase words without
+accents, and map to the sections holding them (as indices in the list of
+sections), along with a weight (the more in titles, the higher).
+
+The index is split into shards by the first characters of its terms, so that a
+query only loads the list of sections and the shards of its own terms (which
+also hold the terms the last word of the query is a prefix of). Small shards
+are merged with the following ones, so that small books don't end up with
+many tiny ones.
+
+In split-output mode (`lupbook-assets-dir` set), the list and the shards are
+published next to the assets as content-hashed scripts, loaded on demand.
+Otherwise, they're embedded as JSON data islands, only parsed on demand. Either
+way, the template gets them as `$lupbook-search$`, along with the manifest of
+the index. Search can be disabled with `lupbook-no-search` (or the
+`LUPBOOK_NO_SEARCH` environment variable).
+"""
+
+import collections
+import html
+import json
+import os
+import re
+import sys
+import unicodedata
+
+import panflute
+
+import lupbook_assets
+import lupbook_filter
+import lupbook_trace
+
+# Weight of the terms of each part of sections
+TITLE_WEIGHT = 10
+ACTIVITY_TITLE_WEIGHT = 5
+PROMPT_WEIGHT = 2
+TEXT_WEIGHT = 1
+
+# Number of leading characters of terms that shards are keyed by
+SHARD_PREFIX = 2
+
+# Shards are merged until they reach about this size, in bytes
+SHARD_SIZE = 16 * 1024
+
+# Longer words aren't indexed (e.g., encoded data in code)
+MAX_TERM_LEN = 32
+
+_WORD_RE = re.compile(r'\w+')
+_TAG_RE = re.compile(r'<[^>]*>')
+
+# Elements whose text continues the words around them
+_INLINES = { "Emph", "Underline", "Strong", "Strikeout", "Superscript",
+            "Subscript", "SmallCaps", "Quoted", "Cite", "Link", "Image",
+            "Span" }
+
+def is_enabled(doc = None):
+    """ Whether books come with a search index """
+    if os.environ.get("LUPBOOK_NO_SEARCH"):
+        return False
+    return doc is None \
+            or not doc.get_metadata("lupbook-no-search", default = False)
+
+def terms(text):
+    """ Terms of text, in order (see `LupbookSearch.terms()` in search.js) """
+    text = text.lower()
+    if not text.isascii():
+        text = "".join(c for c in unicodedata.normalize("NFKD", text)
+                       if not unicodedata.combining(c))
+    return [t for t in _WORD_RE.findall(text) if len(t) <= MAX_TERM_LEN]
+
+def _html_text(markup):
+    return html.unescape(_TAG_RE.sub(" ", markup))
+
+#
+# Indexing
+#
+
+class _Indexer:
+    """ Text of the sections of JSON document, by weight """
+    def __init__(self, doc):
+        self.toc_depth = doc.toc_depth
+        self.main_toc_depth = doc.main_toc_depth
+        self.titles = { node["id"]: node["title"]
+                       for nodes in doc.toc_all for node in nodes }
+        # Sections, as `[id, title, index of the section of their page]`
+        self.sections = []
+        self.texts = []
+        self.page = 0
+
+        root = doc.toc_all[0][0]
+        self._start(root["id"], root["title"], 0)
+
+    def _start(self, ident, title, level):
+        if level <= self.main_toc_depth:
+            self.page = len(self.sections)
+        self.sections.append([ident, title, self.page])
+        self.text = collections.defaultdict(list)
+        self.texts.append(self.text)
+        self.text[TITLE_WEIGHT].append(title)
+
+    def _raw_html(self, markup):
+        titles, prompts = lupbook_filter.activity_text(markup)
+        if not titles and not prompts:
+            self.text[TEXT_WEIGHT].append(f" {_html_text(markup)} ")
+            return
+        # Only the description of activities is indexed, not their content
+        for title in titles:
+            self.text[ACTIVITY_TITLE_WEIGHT].append(f" {_html_text(title)} ")
+        for prompt in prompts:
+            self.text[PROMPT_WEIGHT].append(f" {_html_text(prompt)} ")
+
+    def walk(self, node):
+        if isinstance(node, list):
+            for child in node:
+                self.walk(child)
+            return
+        if not isinstance(node, dict):
+            return
+
+        kind, content = node.get("t"), node.get("c")
+        if kind == "Str":
+            self.text[TEXT_WEIGHT].append(content)
+        elif kind in ("Space", "SoftBreak", "LineBreak"):
+            self.text[TEXT_WEIGHT].append(" ")
+        elif kind in ("Code", "CodeBlock", "Math"):
+            self.text[TEXT_WEIGHT].append(f" {content[1]} ")
+        elif kind in ("RawBlock", "RawInline"):
+            if content[0] == "html":
+                self._raw_html(content[1])
+        elif kind == "Header" and content[0] <= self.toc_depth \
+                and content[1][0] and content[1][0] in self.titles:
+            self._start(content[1][0], self.titles[content[1][0]], content[0])
+        else:
+            self.walk(content)
+            if kind not in _INLINES:
+                self.text[TEXT_WEIGHT].append(" ")
+
+    def postings(self):
+        """ Sections of each term, as `(section index, weight)` in order """
+        index = collections.defaultdict(list)
+        for idx, text in enumerate(self.texts):
+            weights = collections.Counter()
+            for weight, parts in text.items():
+                for term in terms("".join(parts)):
+                    weights[term] += weight
+            for term, weight in weights.items():
+                index[term].append((idx, weight))
+        return index
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii = False, separators = (",", ":"),
+                      sort_keys = True)
+
+def _shards(index):
+    """
+    Shards of index, as `(keys, {term: postings})`, where postings are flat
+    lists of `section index delta, weight`
+    """
+    shards = []
+    size = SHARD_SIZE
+    for term in sorted(index):
+        key = term[:SHARD_PREFIX]
+        if size >= SHARD_SIZE and (not shards or key not in shards[-1][0]):
+            shards.append(([], {}))
+            size = 0
+        keys, shard_terms = shards[-1]
+        if not keys or keys[-1] != key:
+            keys.append(key)
+
+        postings = []
+        prev = 0
+        for idx, weight in index[term]:
+            postings += [idx - prev, weight]
+            prev = idx
+        shard_terms[term] = postings
+        size += len(term) + len(_dumps(postings)) + 4
+    return shards
+
+#
+# Output
+#
+
+def _island(name, data):
+    # Only strings can contain `<`, so escaping it keeps the island from
+    # closing its script element
+    text = _dumps(data).replace("<", "\\u003c")
+    return f'<script id="lupbook-search-{name}" type="application/json">' \
+            f'{text}</script>'
+
+def _publish(out_dir, name, data):
+    script = f"LupbookSearch.define({_dumps(name)}, {_dumps(data)});\n"
+    return lupbook_assets.publish_data(out_dir, "search", ".js",
+                                       script.encode('utf-8'))
+
+@lupbook_trace.traced("search_finalize", cat = "search")
+def finalize_search(doc, blocks):
+    """
+    Index JSON blocks of (finalized) document, and set `lupbook-search`
+    template variable
+    """
+    if not is_enabled(doc):
+        if "lupbook-search" in doc.metadata:
+            del doc.metadata["lupbook-search"]
+        return
+
+    indexer = _Indexer(doc)
+    indexer.walk(blocks)
+    index = indexer.postings()
+    shards = _shards(index)
+
+    parts = { "docs": indexer.sections }
+    parts.update({ str(idx): shard for idx, (_, shard) in enumerate(shards) })
+    manifest = { "prefix": SHARD_PREFIX,
+                "keys": { key: idx for idx, (keys, _) in enumerate(shards)
+                         for key in keys } }
+
+    islands = []
+    out_dir = lupbook_assets.assets_dir(doc)
+    if out_dir is None:
+        islands = [_island(name, data) for name, data in parts.items()]
+    else:
+        manifest["url"] = lupbook_assets.assets_url(doc, out_dir)
+        manifest["files"] = { name: _publish(out_dir, name, data)
+                             for name, data in parts.items() }
+    doc.metadata["lupbook-search"] = panflute.MetaBlocks(panflute.RawBlock(
+            "\n".join([_island("manifest", manifest), *islands]), 'html'))
+
+    if doc.get_metadata("lupbook-stats", default = False):
+        size = sum(len(_dumps(data)) for data in parts.values())
+        sys.stderr.write(f"Search index: {len(indexer.sections)} sections,"
+                         f" {len(index)} terms, {len(shards)} shards,"
+                         f" {size} bytes.\n")
@@ -0,0 +1,107 @@
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Profiling traces of the filters, in the Chrome trace event format (to be
+opened with https://ui.perfetto.dev or chrome://tracing)
+
+Tracing is enabled by setting `LUPBOOK_TRACE` (environment) or `lupbook-trace`
+(metadata) to the path of the trace file to write.
+"""
+
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+# Number of slowest activities reported once the trace is written
+TOP_ACTIVITIES = 10
+
+# Recorded events, or None when tracing is disabled
+_events = None
+
+def trace_path(doc = None):
+    """ Path of trace file, or None if tracing is disabled """
+    path = os.environ.get("LUPBOOK_TRACE")
+    if doc is not None:
+        path = doc.get_metadata("lupbook-trace", default = path)
+    return path or None
+
+def enable():
+    """ Start recording events (discarding previous ones) """
+    global _events
+    _events = []
+
+def enabled():
+    return _events is not None
+
+def take_events():
+    """ Return recorded events, and start over (e.g., in worker processes) """
+    global _events
+    events, _events = _events, []
+    return events or []
+
+def add_events(events):
+    """ Add events recorded by another process """
+    if _events is not None:
+        _events.extend(events)
+
+@contextlib.contextmanager
+def span(name, cat = "lupbook", **args):
+    """
+    Record duration of the enclosed code as a span, with the given arguments
+    (the yielded dictionary can be filled in while the span is open)
+    """
+    if _events is None:
+        yield args
+        return
+
+    start = time.perf_counter_ns()
+    try:
+        yield args
+    finally:
+        end = time.perf_counter_ns()
+        _events.append({ "name": name, "cat": cat, "ph": "X",
+                        "ts": start / 1000, "dur": (end - start) / 1000,
+                        "pid": os.getpid(), "tid": threading.get_native_id(),
+                        "args": args })
+
+def traced(name, cat = "lupbook"):
+    """ Decorator recording each call of function as a span """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, cat):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _summary(events):
+    """ Slowest activities """
+    activities = sorted((e for e in events if e["name"] == "activity"),
+                        key = lambda e: e["dur"], reverse = True)
+    if not activities:
+        return ""
+
+    lines = [f"Slowest activities (out of {len(activities)}):\n"]
+    for e in activities[:TOP_ACTIVITIES]:
+        lines.append("  {:9.2f} ms  {} '{}'\n".format(
+            e["dur"] / 1000, e["args"].get("type"),
+            e["args"].get("activity", "<unknown>")))
+    return "".join(lines)
+
+def finish(path):
+    """
+    Write recorded events to trace file, report slowest activities, and stop
+    recording
+    """
+    global _events
+    events, _events = _events or [], None
+
+    with open(path, "w", encoding = 'utf-8') as f:
+        json.dump({ "traceEvents": events, "displayTimeUnit": "ms" }, f)
+    sys.stderr.write(_summary(events))
+    sys.stderr.write(f"Trace written to {path}\n")
@@ -0,0 +1,393 @@
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Verify that the reference solutions of icode activities pass their tests
+
+The `key` files of each activity (its skeleton files by default) are written
+into a temporary sandbox directory, where the tests run the way they do in the
+browser's VM (see `IcodeTest` in `modules/icode.js`): pre-commands, commands,
+checks of the output of the last command, then post-commands, stopping at the
+first failing command, and skipping the remaining tests after a failing
+`fatal` test. Commands run on the local machine, which thus needs the same
+tools as the VM (e.g., gcc).
+
+Activities are verified in parallel, with two caches keyed by the digest of
+the key files. The outputs of the build steps (e.g., compiled programs) are
+cached along with the commands which built them, so that the build only runs
+again if a key file or a build command changed, and the results of passing
+activities are cached along with all their tests, so that verifying the book
+again after an edit only runs the activities which changed (or failed).
+"""
+
+import base64
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import icode_filter
+import lupbook_build
+import lupbook_cache
+import lupbook_lint
+import lupbook_parallel
+import lupbook_registry
+
+# Default time limit of each test, in seconds
+DEFAULT_TIMEOUT = 30
+
+#
+# Sandbox
+#
+
+def _sandbox_path(sandbox, fname):
+    """ Path of file in sandbox, which must not escape it """
+    path = os.path.normpath(os.path.join(sandbox, fname))
+    if os.path.isabs(fname) or not path.startswith(sandbox + os.sep):
+        raise Exception(f"File '{fname}' is outside of the sandbox")
+    return path
+
+def _materialize(sandbox, skeleton):
+    """ Write the key files of activity into sandbox """
+    for src_file in skeleton:
+        path = _sandbox_path(sandbox, src_file["filename"])
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path, "w", encoding = 'utf-8') as f:
+            f.write(src_file["key"])
+
+def _run(cmd, sandbox, timeout):
+    """
+    Run shell command in sandbox, return `(return code, stdout, stderr)`, or
+    None if it timed out (then killing everything it started)
+    """
+    proc = subprocess.Popen(cmd, shell = True, cwd = sandbox,
+                            stdin = subprocess.DEVNULL,
+                            stdout = subprocess.PIPE, stderr = subprocess.PIPE,
+                            start_new_session = True)
+    try:
+        stdout, stderr = proc.communicate(timeout = max(timeout, 0))
+    except subprocess.TimeoutExpired:
+        with contextlib.suppress(ProcessLookupError):
+            os.killpg(proc.pid, signal.SIGKILL)
+        proc.communicate()
+        return None
+    return proc.returncode, stdout.decode('utf-8', errors = 'replace'), \
+            stderr.decode('utf-8', errors = 'replace')
+
+def _snapshot(sandbox):
+    """ Digest of each file of sandbox, by path relative to it """
+    files = {}
+    for root, _, fnames in os.walk(sandbox):
+        for fname in fnames:
+            path = os.path.join(root, fname)
+            files[os.path.relpath(path, sandbox)] = \
+                    lupbook_cache.file_digest(path)
+    return files
+
+def _save_outputs(sandbox, before):
+    """ Files of sandbox created or changed since snapshot, and removed ones """
+    after = _snapshot(sandbox)
+    files = []
+    for fname, digest in sorted(after.items()):
+        if before.get(fname) == digest:
+            continue
+        path = os.path.join(sandbox, fname)
+        with open(path, 'rb') as f:
+            data = base64.b64encode(f.read()).decode('ascii')
+        files.append((fname, os.stat(path).st_mode & 0o777, data))
+    return { "files": files,
+            "removed": sorted(set(before) - set(after)) }
+
+def _restore_outputs(sandbox, outputs):
+    for fname, mode, data in outputs["files"]:
+        path = _sandbox_path(sandbox, fname)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path, 'wb') as f:
+            f.write(base64.b64decode(data))
+        os.chmod(path, mode)
+    for fname in outputs["removed"]:
+        os.remove(_sandbox_path(sandbox, fname))
+
+#
+# Tests (worker side)
+#
+
+def _check_output(check, sandbox, result):
+    """ Evaluate check against last command, return error message or None """
+    if check["output"] == "file":
+        desc = f"file {check['filename']}"
+        try:
+            path = _sandbox_path(sandbox, check["filename"])
+        except Exception as e:
+            return str(e)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read().decode('utf-8', errors = 'replace')
+        except OSError:
+            return f"Output {desc} does not exist"
+    else:
+        desc = check["output"]
+        data = result[1 if desc == "stdout" else 2]
+
+    if check["type"] == "regex":
+        if not re.search(check["content"], data):
+            return f"Output {desc} does not match regular expression" \
+                    f" {check['content']!r}: {data!r}"
+    elif data != check["content"]:
+        return f"Output {desc} differs from expected value" \
+                f" {check['content']!r}: {data!r}"
+    return None
+
+def _run_test(test, sandbox, timeout):
+    """ Run test in sandbox, return error message (None if passed) """
+    deadline = time.monotonic() + timeout
+    error = None
+    result = None
+
+    for cmd in test["precmds"] + test["cmds"]:
+        result = _run(cmd, sandbox, deadline - time.monotonic())
+        if result is None:
+            return f"Command '{cmd}' timed out after {timeout:g} s"
+        if result[0] != 0:
+            error = f"Command '{cmd}' failed with exit code {result[0]}:" \
+                    f" {result[2].strip()}"
+            break
+
+    # Checks only apply to the output of the last command, if all succeeded
+    if error is None and result is not None:
+        errors = [_check_output(check, sandbox, result)
+                  for check in test["checks"]]
+        errors = [e for e in errors if e is not None]
+        if errors:
+            error = "; ".join(errors)
+
+    # Post commands always run, and their results are ignored
+    for cmd in test["postcmds"]:
+        if _run(cmd, sandbox, deadline - time.monotonic()) is None:
+            return f"Command '{cmd}' timed out after {timeout:g} s"
+    return error
+
+def _build_steps(tests):
+    """
+    Number of build steps of tests, i.e., leading `fatal` tests without checks
+    (e.g., compilation), whose outputs the other tests use
+    """
+    count = 0
+    for test in tests:
+        if not test["fatal"] or test["checks"]:
+            break
+        count += 1
+    return count
+
+def _run_tests(conf, timeout, build_cache = None, build_key = None):
+    """
+    Results of the tests of activity, as `(name, status, time, error)`, where
+    the time of build steps restored from `build_cache` is None
+    """
+    results = []
+    tests = conf["tests"]
+    builds = _build_steps(tests)
+    sandbox = tempfile.mkdtemp(prefix = "lupbook-verify-")
+    try:
+        try:
+            _materialize(sandbox, conf["skeleton"])
+        except Exception as e:
+            return [(None, "fail", 0, str(e))]
+
+        # Skip the build steps if their outputs are cached
+        if builds and build_cache is not None:
+            cached = build_cache.get(build_key)
+            if cached is not None:
+                _restore_outputs(sandbox, json.loads(cached))
+                results = [(test["name"], "pass", None, None)
+                           for test in tests[:builds]]
+        before = _snapshot(sandbox) if not results else None
+
+        fatal = False
+        for idx, test in enumerate(tests[len(results):], len(results)):
+            if fatal:
+                results.append((test["name"], "skip", 0, None))
+                continue
+            start = time.monotonic()
+            error = _run_test(test, sandbox, timeout)
+            results.append((test["name"], "fail" if error else "pass",
+                            time.monotonic() - start, error))
+            fatal = error is not None and test["fatal"]
+
+            # Only successful builds are cached
+            if idx == builds - 1 and not fatal and build_cache is not None:
+                build_cache.put(build_key,
+                                json.dumps(_save_outputs(sandbox, before)))
+    finally:
+        shutil.rmtree(sandbox, ignore_errors = True)
+    return results
+
+_worker = {}
+
+def _init_worker(cwd, declarations, cache_conf, timeout):
+    # Included files are relative to the source directory
+    os.chdir(cwd)
+    for activity_id, (module, class_name) in declarations.items():
+        lupbook_registry.register_activity(activity_id, module, class_name)
+    _worker["cache"] = cache_conf
+    _worker["timeout"] = timeout
+    _worker["code"] = lupbook_cache.code_digest([sys.modules[__name__]])
+
+def _cache_key(cls, conf):
+    # Results depend on the key files and the tests, not on how the activity
+    # is presented
+    files = [(f["filename"], f["key"]) for f in conf["skeleton"]]
+    return lupbook_cache.digest(
+            "verify", _worker["code"], cls.code_version(),
+            json.dumps([files, conf["tests"], _worker["timeout"]]))
+
+def _build_cache_key(cls, conf):
+    # Build outputs only depend on the key files and the build steps
+    files = [(f["filename"], f["key"]) for f in conf["skeleton"]]
+    builds = conf["tests"][:_build_steps(conf["tests"])]
+    return lupbook_cache.digest(
+            "verify-build", _worker["code"], cls.code_version(),
+            json.dumps([files, builds]))
+
+def _verify_activity(block):
+    """
+    Verify activity, return its ID, its test results and whether they come
+    from the cache
+    """
+    fname, line, activity_type, text = block
+    cls = lupbook_registry.get_activity(activity_type)
+
+    # Activities report errors on stderr on their own
+    with contextlib.redirect_stderr(io.StringIO()):
+        try:
+            conf = cls(text).conf
+        except Exception as e:
+            # See `lupbook lint` for the details
+            message = lupbook_lint._error_message(e).splitlines()[0]
+            return lupbook_parallel.guess_id(text), \
+                [(None, "fail", 0, message)], False
+
+    cache = build_cache = None
+    if _worker["cache"] is not None:
+        path, name, max_size = _worker["cache"]
+        cache = lupbook_cache.LupbookCache(path, name, max_size)
+        build_cache = lupbook_cache.LupbookCache(path, f"{name}-build",
+                                                 max_size)
+    try:
+        key = _cache_key(cls, conf)
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                return conf["id"], [tuple(r) for r in json.loads(cached)], True
+
+        results = _run_tests(conf, _worker["timeout"], build_cache,
+                             _build_cache_key(cls, conf))
+        # Failures may come from the environment (e.g., missing tool), so only
+        # passing activities are cached
+        if cache is not None and all(r[1] == "pass" for r in results):
+            cache.put(key, json.dumps(results))
+        return conf["id"], results, False
+    finally:
+        if cache is not None:
+            cache.close()
+            build_cache.close()
+
+#
+# Caller side
+#
+
+def _is_icode(activity_type):
+    cls = lupbook_registry.get_activity(activity_type)
+    return cls is not None and issubclass(cls, icode_filter.LupbookICode)
+
+def verify(src_dir = None, sources = None, jobs = 0,
+           timeout = DEFAULT_TIMEOUT, cache = True, report = None):
+    """
+    Verify the icode activities of book using `jobs` processes (0 for all
+    cores), with a time limit of `timeout` seconds per test. Return the list
+    of `(file, line, activity ID, results, cached)` of each activity, where
+    results are `(test name, status, time, error)` with status "pass", "fail"
+    or "skip". If given, `report` is called with each activity's entry as soon
+    as it is verified, in order.
+    """
+    src_dir = os.path.abspath(src_dir or os.curdir)
+    if not sources:
+        sources = lupbook_build.default_sources(src_dir)
+
+    # Activity types declared by the book itself (which may derive from icode)
+    declarations = {}
+    for fname in sources:
+        declarations.update(lupbook_lint.read_declarations(
+            os.path.join(src_dir, fname)))
+    lupbook_registry.register_activities(declarations)
+    icode_types = {t for t in lupbook_registry.activity_ids() if _is_icode(t)}
+
+    blocks = [(fname, line, cls, text) for fname in sources
+              for line, cls, text in lupbook_lint.scan_markdown(
+                  os.path.join(src_dir, fname))
+              if cls in icode_types]
+
+    cache_conf = None
+    if cache:
+        path = lupbook_cache.cache_dir()
+        if path is not None:
+            cache_conf = (path, "verify", lupbook_cache.cache_max_size())
+
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    initargs = (src_dir, lupbook_registry.declarations(), cache_conf, timeout)
+
+    # Activities take a while to verify, so each is a task of its own
+    entries = []
+    def collect(block, result):
+        entry = (block[0], block[1], *result)
+        entries.append(entry)
+        if report is not None:
+            report(entry)
+
+    if jobs == 1 or len(blocks) < 2:
+        cwd = os.getcwd()
+        try:
+            _init_worker(*initargs)
+            for block in blocks:
+                collect(block, _verify_activity(block))
+        finally:
+            os.chdir(cwd)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers = min(jobs, len(blocks)),
+                initializer = _init_worker, initargs = initargs) as executor:
+            for block, result in zip(blocks,
+                                     executor.map(_verify_activity, blocks)):
+                collect(block, result)
+    return entries
+
+def report_activity(entry):
+    """ Print results of activity, one line per test """
+    fname, line, ident, results, cached = entry
+    for name, status, elapsed, error in results:
+        where = f"{fname}:{line}: {ident}" + (f": {name}" if name else "")
+        timing = "cached" if cached or elapsed is None else f"{elapsed:.2f} s"
+        print(f"{status.upper():<4} {where} ({timing})", flush = True)
+        if error:
+            sys.stderr.write(f"     {error}\n")
+
+def summary(entries):
+    """ Print summary of verification, return whether all tests passed """
+    counts = { "pass": 0, "fail": 0, "skip": 0 }
+    for _, _, _, results, _ in entries:
+        for _, status, _, _ in results:
+            counts[status] += 1
+    cached = sum(1 for entry in entries if entry[4])
+    sys.stderr.write(f"{len(entries)} icode activities ({cached} cached):"
+                     f" {counts['pass']} tests passed, {counts['fail']} failed,"
+                     f" {counts['skip']} skipped\n")
+    return counts["fail"] == 0
@@ -0,0 +1,220 @@
+# Copyright (c) 2024 LupLab
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Watch mode: rebuild the book incrementally whenever one of its sources changes
+(markdown, template, files included by activities), and serve it from a local
+HTTP server which tells open browser tabs to reload after each build
+"""
+
+import http.server
+import os
+import sys
+import threading
+import time
+import traceback
+import urllib.parse
+
+import lupbook_build
+import lupbook_chapters
+import lupbook_deps
+
+# URL prefix under which the lupbook directory (modules, node_modules) and the
+# reload events are served
+LB_PREFIX = "/__lupbook"
+EVENTS_PATH = f"{LB_PREFIX}/events"
+
+# Injected in served HTML pages
+RELOAD_SCRIPT = f"""<script>
+new EventSource("{EVENTS_PATH}").onmessage = () => location.reload();
+</script>
+"""
+
+#
+# Preview server
+#
+
+class _PreviewHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def translate_path(self, path):
+        path = urllib.parse.unquote(urllib.parse.urlsplit(path).path)
+
+        # Resources of the lupbook directory, and otherwise the output
+        # directory first, then the source directory (e.g., template.css)
+        if path.startswith(LB_PREFIX + "/"):
+            roots = [lupbook_build.LBDIR]
+            path = path[len(LB_PREFIX):]
+        else:
+            roots = self.server.roots
+
+        rel_path = os.path.normpath(path).lstrip("/")
+        if rel_path.startswith(".."):
+            return ""
+        for root in roots:
+            fname = os.path.join(root, rel_path)
+            if os.path.exists(fname):
+                return fname
+        return os.path.join(roots[0], rel_path)
+
+    def do_GET(self):
+        path = urllib.parse.urlsplit(self.path).path
+        if path == "/":
+            self.send_response(302)
+            self.send_header("Location", f"/{self.server.page}")
+            self.end_headers()
+        elif path == EVENTS_PATH:
+            self._send_events()
+        elif path.endswith(".html"):
+            self._send_page(self.translate_path(self.path))
+        else:
+            super().do_GET()
+
+    def _send_page(self, fname):
+        try:
+            with open(fname, 'rb') as f:
+                content = f.read()
+        except OSError:
+            self.send_error(404)
+            return
+
+        # Have the page listen for reload events
+        head, sep, tail = content.rpartition(b"</body>")
+        if sep:
+            content = head + RELOAD_SCRIPT.encode() + sep + tail
+        else:
+            content += RELOAD_SCRIPT.encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _send_events(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+
+        generation = self.server.generation
+        try:
+            while True:
+                with self.server.reloaded:
+                    self.server.reloaded.wait_for(
+                            lambda: self.server.generation != generation,
+                            timeout = 15)
+                if self.server.generation == generation:
+                    # Keep connection alive
+                    self.wfile.write(b": ping\n\n")
+                else:
+                    generation = self.server.generation
+                    self.wfile.write(b"data: reload\n\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+class PreviewServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, output, src_dir):
+        super().__init__(address, _PreviewHandler)
+        self.page = os.path.basename(output)
+        self.roots = [os.path.dirname(os.path.abspath(output)),
+                      os.path.abspath(src_dir)]
+        self.generation = 0
+        self.reloaded = threading.Condition()
+
+    def notify_reload(self):
+        """ Tell all connected pages to reload """
+        with self.reloaded:
+            self.generation += 1
+            self.reloaded.notify_all()
+
+#
+# Watcher
+#
+
+def _source_files(src_dir, output):
+    """ Files of source directory, minus hidden and output directories """
+    output_dir = os.path.dirname(os.path.abspath(output))
+    for root, dirs, files in os.walk(src_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(".")
+                   and os.path.abspath(os.path.join(root, d)) != output_dir]
+        for f in files:
+            yield os.path.join(root, f)
+
+def _snapshot(fnames):
+    mtimes = {}
+    for fname in fnames:
+        try:
+            mtimes[fname] = os.stat(fname).st_mtime_ns
+        except OSError:
+            pass
+    return mtimes
+
+def _watched_files(src_dir, output):
+    """ All the files which affect the book """
+    fnames = set(_source_files(src_dir, output))
+    fnames.update(os.path.join(src_dir, f)
+                  for f in lupbook_chapters.included_files(output))
+    return fnames
+
+def _build(src_dir, output, options):
+    """ Rebuild book, report errors instead of raising them """
+    start = time.monotonic()
+    try:
+        rebuilt = lupbook_chapters.build_book(src_dir, output, embed = False,
+                                              **options)
+    except Exception as e:
+        sys.stderr.write("Build failed: {}".format(
+            "".join(traceback.format_exception_only(type(e), e))))
+        return False
+
+    sys.stderr.write(f"Rebuilt {len(rebuilt)} chapter(s) in"
+                     f" {time.monotonic() - start:.2f}s\n")
+    return True
+
+def watch(src_dir, output, host = "127.0.0.1", port = 8000, interval = 0.2,
+          **options):
+    """
+    Build book into `output`, serve it on `host:port`, then rebuild it on each
+    change until interrupted. `options` are passed to
+    `lupbook_chapters.build_book()`.
+    """
+    src_dir = os.path.abspath(src_dir)
+    options["variables"] = { **(options.get("variables") or {}),
+                            "lbdir": LB_PREFIX }
+
+    server = PreviewServer((host, port), output, src_dir)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    sys.stderr.write(f"Serving book on http://{host}:{server.server_port}/\n")
+
+    code = _snapshot(lupbook_deps.lupbook_sources())
+    try:
+        while True:
+            # Snapshot before building, so that edits made during the build
+            # trigger another one
+            sources = _snapshot(_watched_files(src_dir, output))
+            if _build(src_dir, output, options):
+                server.notify_reload()
+
+            # Files newly included by the build
+            sources.update(_snapshot(_watched_files(src_dir, output)
+                                     - sources.keys()))
+
+            while _snapshot(_watched_files(src_dir, output)) == sources:
+                time.sleep(interval)
+
+                # Never build with stale filter code
+                if _snapshot(lupbook_deps.lupbook_sources()) != code:
+                    sys.stderr.write("Lupbook filter sources changed,"
+                                     " restarting\n")
+                    server.shutdown()
+                    server.server_close()
+                    os.execv(sys.executable, [sys.executable] + sys.argv)
+    finally:
+        server.shutdown()
+        server.server_close()
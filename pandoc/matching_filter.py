@@ -1,12 +1,9 @@
 # Copyright (c) 2021 LupLab
 # SPDX-License-Identifier: AGPL-3.0-only
 
-from dominate.tags import div, span
-from dominate.util import raw
-
 import lupbook_filter
 import matching_schema
-import panflute
+from lupbook_html import div, span, raw
 
 
 #
@@ -37,17 +34,16 @@ class LupbookMatching(lupbook_filter.LupbookComponent):
         with div(**div_attrs):
             span(str(i + 1), cls = "badge text-bg-secondary me-2")
             text = choice['text']
-            formatted_text = panflute.convert_text(text, output_format = 'html')
+            formatted_text = self._markdown(text)
             raw(formatted_text)
 
     def _gen_answer_block(self, answer):
         div_attrs = {
             "cls": "matching-answer bg-light border rounded m-2 mb-0 p-2 d-flex flex-column",
-            "data-choices": ','.join(answer['choices'])
         }
         with div(**div_attrs):
             text = answer['text']
-            formatted_text = panflute.convert_text(text, output_format = 'html')
+            formatted_text = self._markdown(text)
             raw(formatted_text)
 
     def _gen_activity(self):
@@ -72,12 +68,16 @@ class LupbookMatching(lupbook_filter.LupbookComponent):
                         for block in self.conf['answers']:
                             self._gen_answer_block(block)
 
+    def data(self):
+        # Choices matching each answer box, in order
+        return { "answers": [answer["choices"]
+                            for answer in self.conf["answers"]] }
+
     def _gen_testing_activity(self):
         div(id = f"{self.prefix_id}-testing-score",
             cls = "alert d-none")
         for i, choice in enumerate(self.conf["choices"]):
-            formatted_text = panflute.convert_text(
-                    choice["feedback"], output_format = 'html')
+            formatted_text = self._markdown(choice["feedback"])
             with div(id = f"{self.prefix_id}-feedback-{choice['id']}",
                      cls = "d-flex align-items-center matching-feedback-item m-1 p-2 border-start border-5 d-none"):
                 span(str(i + 1), cls="badge text-bg-secondary me-2")
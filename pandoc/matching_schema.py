@@ -65,6 +65,6 @@ _matching_schema = {
     "additionalProperties": False
 }
 
-matching_validator = lupbook_schema.LupbookValidator(
+matching_validator = lupbook_schema.CompiledValidator(
         _matching_schema,
         format_checker = lupbook_schema.lupbook_format_checker)
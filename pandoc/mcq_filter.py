@@ -3,12 +3,9 @@
 
 import random
 
-from dominate.tags import div, label, input_, span
-from dominate.util import raw
-
 import lupbook_filter
 import mcq_schema
-import panflute
+from lupbook_html import div, label, input_, span, raw
 
 #
 # Activity HTML generation
@@ -56,20 +53,22 @@ class LupbookMCQ(lupbook_filter.LupbookComponent):
                     input_(cls = "form-check-input",
                           type = self.form_type,
                           name = f"{self.prefix_id}-choice",
-                          id = f"{self.prefix_id}-choice-{i}",
-                          data_correct = choice['correct'])
+                          id = f"{self.prefix_id}-choice-{i}")
                     with label(cls = "form-check-label mcq-choice-item",
                                for_ = f"{self.prefix_id}-choice-{i}"):
-                        formatted_text = panflute.convert_text(
-                                choice["text"], output_format='html')
+                        formatted_text = self._markdown(choice["text"])
                         raw(formatted_text)
 
+    def data(self):
+        # Indices of the correct choices, in the order they are shown
+        return { "correct": [i for i, choice in enumerate(self.conf["choices"])
+                             if choice["correct"]] }
+
     def _gen_testing_activity(self):
         div(id = f"{self.prefix_id}-testing-score",
             cls = "alert d-none")
         for i, choice in enumerate(self.conf["choices"]):
-            formatted_text = panflute.convert_text(
-                    choice["feedback"], output_format = 'html')
+            formatted_text = self._markdown(choice["feedback"])
             with div(id = f"{self.prefix_id}-feedback-{i}",
                      cls = "d-flex align-items-center mcq-feedback-item m-1 p-2 border-start border-5 d-none"):
                 span(self._index_to_label(i),
@@ -51,6 +51,6 @@ _mcq_schema = {
     "additionalProperties": False
 }
 
-mcq_validator = lupbook_schema.LupbookValidator(
+mcq_validator = lupbook_schema.CompiledValidator(
         _mcq_schema,
         format_checker = lupbook_schema.lupbook_format_checker)
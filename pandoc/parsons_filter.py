@@ -3,12 +3,9 @@
 
 import random
 
-from dominate.tags import div, span
-from dominate.util import raw
-
 import lupbook_filter
 import parsons_schema
-import panflute
+from lupbook_html import div, span, raw
 
 #
 # Component generation
@@ -109,19 +106,16 @@ class LupbookParsons(lupbook_filter.LupbookComponent):
 
         return result
 
-    def _gen_frag_block(self, frag, margin, idx, gid):
+    def _gen_frag_block(self, frag, margin, idx):
         div_attrs = {
             "id": f"{self.prefix_id}-frag-{idx}",
             "cls": f"parsons-frag bg-white border rounded {margin} p-2 d-flex",
-            "data-id": f"{frag['id']}",
-            "data-depend": f"{frag.get('depend', '')}",
-            "data-gid": f"{gid}",
         }
         with div(**div_attrs):
             if self.conf["label"]:
                 span(idx, cls = "badge text-bg-light fw-medium me-1")
             text = frag["text"]
-            formatted_text = panflute.convert_text(text, output_format="html")
+            formatted_text = self._markdown(text)
             raw(formatted_text)
 
     def _gen_activity(self):
@@ -165,13 +159,20 @@ class LupbookParsons(lupbook_filter.LupbookComponent):
 
                                 # Iterate by fragment
                                 for frag in group:
-                                    self._gen_frag_block(frag, "m-2 mb-0", fid, gid)
+                                    self._gen_frag_block(frag, "m-2 mb-0", fid)
                                     fid += 1
 
                 with div(cls = "col"):
                     div(id = f"{self.prefix_id}-answers",
                         cls = "parsons-answers bg-light border h-100 pb-2 d-flex flex-column")
 
+    def data(self):
+        # IDs and dependencies of the fragments, in the order they are
+        # generated (i.e., by group)
+        frags = [frag for group in self._group_frags() for frag in group]
+        return { "ids": [frag["id"] for frag in frags],
+                "depends": [frag.get("depend") for frag in frags] }
+
     def _gen_testing_activity(self):
         div(id = f"{self.prefix_id}-testing-score",
             cls = "alert d-none")
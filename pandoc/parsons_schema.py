@@ -53,6 +53,6 @@ _parsons_schema = {
     "additionalProperties": False
 }
 
-parsons_validator = lupbook_schema.LupbookValidator(
+parsons_validator = lupbook_schema.CompiledValidator(
         _parsons_schema,
         format_checker = lupbook_schema.lupbook_format_checker)
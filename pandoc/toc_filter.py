@@ -6,7 +6,10 @@
 from dominate.tags import a, li, nav, ul
 import panflute
 
+import lupbook_trace
+
 # Prep our data structures, before processing each node
+@lupbook_trace.traced("toc_prepare", cat = "toc")
 def _prepare_toc_filter(doc):
     # Number of components in the main TOC (e.g., parts, chapters, sections)
     # Default 1: h1 level are sections, which are listed in main TOC
@@ -38,18 +41,23 @@ def _prepare_toc_filter(doc):
 
 # Called on each element of input document
 def _process_toc_filter(element, doc):
-    if not isinstance(element, panflute.Header) \
-            or element.level > doc.toc_depth:
+    if not isinstance(element, panflute.Header):
+        return
+
+    _add_toc_node(doc, element.level, element.identifier,
+                  panflute.stringify(element))
+
+# Insert header in TOC (also used to merge header summaries of chapters built
+# separately)
+def _add_toc_node(doc, level, identifier, title):
+    if level > doc.toc_depth:
         return
 
     # Current toc node
-    node = {"id": element.identifier,
-            "title": panflute.stringify(element),
+    node = {"id": identifier,
+            "title": title,
             "children": []}
 
-    # Remap markdown levels from [1:n] to [0:n-1]
-    level = element.level
-
     # Keep track of node in current hierarchy (replace node as same level, reset
     # all levels below)
     doc.toc_current[level] = node
@@ -63,63 +71,82 @@ def _process_toc_filter(element, doc):
     # Insert node in tree
     doc.toc_current[level - 1]["children"].append(node)
 
-    doc.toc_all[element.level].append(node)
+    doc.toc_all[level].append(node)
 
 # Finalize our output after processing the entire document
+@lupbook_trace.traced("toc_finalize", cat = "toc")
 def _finalize_toc_filter(doc):
     # Build main TOC
     if doc.main_toc_depth > 0:
-        main_toc = nav(id = "lb-main-toc-nav", cls = "small")
-        with main_toc:
-            root = doc.toc_all[0][0]
-            with ul(cls = "list-unstyled ps-2",
-                    data_title = root["title"]):
-               _build_main_toc_html(doc.main_toc_depth, root["children"], 1)
-
         # Variable to be inserted in template HTML
-        doc.metadata["main-toc"] = panflute.RawBlock(main_toc.render(), 'html')
+        doc.metadata["main-toc"] = _main_toc(doc)
 
     # Build page TOC
     if doc.toc_depth > 0:
-        page_toc = nav(id = "lb-page-toc-list", cls = "small",
-                          data_level = f"{doc.main_toc_depth}")
-        with page_toc:
-            # 1-level TOCs for each uppersection level
-            for i in range(doc.main_toc_depth):
-                for sect in doc.toc_all[i]:
-                    with ul(id = f"{sect['id']}-toc",
-                            cls = "list-unstyled ps-2 d-none",
-                            data_title = sect["title"]):
-                        _build_page_toc_html(1, sect["children"] , 1)
-
-            if doc.section_toc_depth > 0:
-                # N-level TOCs for each section
-                for sect in doc.toc_all[doc.main_toc_depth]:
+        doc.metadata["page-toc"] = _page_toc(doc, _page_sections(doc))
+
+# Sections shown as pages, with their level
+def _page_sections(doc):
+    return [(sect, i) for i in range(doc.main_toc_depth + 1)
+            for sect in doc.toc_all[i]]
+
+# Main TOC, linking to `href(id)` for each section (by default, its anchor)
+def _main_toc(doc, href = None):
+    main_toc = nav(id = "lb-main-toc-nav", cls = "small")
+    with main_toc:
+        root = doc.toc_all[0][0]
+        with ul(cls = "list-unstyled ps-2",
+                data_title = root["title"]):
+           _build_main_toc_html(doc.main_toc_depth, root["children"], 1,
+                                href or (lambda ident: f"#{ident}"))
+    return panflute.RawBlock(main_toc.render(), 'html')
+
+# Page TOC of the given sections, as `(node, level)`, linking to `href(id)` for
+# each section (by default, its anchor)
+def _page_toc(doc, sections, href = None):
+    href = href or (lambda ident: f"#{ident}")
+    page_toc = nav(id = "lb-page-toc-list", cls = "small",
+                      data_level = f"{doc.main_toc_depth}")
+    with page_toc:
+        # 1-level TOCs for each uppersection level
+        for sect, level in sections:
+            if level < doc.main_toc_depth:
+                with ul(id = f"{sect['id']}-toc",
+                        cls = "list-unstyled ps-2 d-none",
+                        data_title = sect["title"]):
+                    _build_page_toc_html(1, sect["children"] , 1, href)
+
+        if doc.section_toc_depth > 0:
+            # N-level TOCs for each section
+            for sect, level in sections:
+                if level == doc.main_toc_depth:
                     with ul(id = f"{sect['id']}-toc",
                             cls = "list-unstyled ps-2 d-none",
                             data_title = sect["title"]):
-                        _build_page_toc_html(doc.section_toc_depth, sect["children"], 1)
+                        _build_page_toc_html(doc.section_toc_depth, sect["children"], 1,
+                                             href)
 
-        doc.metadata["page-toc"] = panflute.RawBlock(page_toc.render(), 'html')
+    return panflute.RawBlock(page_toc.render(), 'html')
 
-def _build_main_toc_html(max_depth, level, cur_depth):
+def _build_main_toc_html(max_depth, level, cur_depth, href):
     for node in level:
         with li():
-            a(node["title"], href = f"#{node['id']}",
+            a(node["title"], href = href(node["id"]),
               cls = "px-2 py-1 mt-1 d-inline-block text-decoration-none text-reset rounded")
             if node["children"] and cur_depth < max_depth:
                 with ul(cls = "list-unstyled ps-2"):
-                    _build_main_toc_html(max_depth, node["children"], cur_depth + 1)
+                    _build_main_toc_html(max_depth, node["children"],
+                                         cur_depth + 1, href)
 
-def _build_page_toc_html(max_depth, level, cur_depth):
+def _build_page_toc_html(max_depth, level, cur_depth, href):
     for node in level:
         with li():
-            a(node["title"], href = f"#{node['id']}",
+            a(node["title"], href = href(node["id"]),
               cls = "px-2 py-1 mt-1 d-inline-block text-decoration-none text-reset rounded")
             if node["children"] and cur_depth < max_depth:
                 with ul(cls = "list-unstyled ps-2"):
                     _build_page_toc_html(max_depth, node["children"],
-                                         cur_depth + 1)
+                                         cur_depth + 1, href)
 
 if __name__ == "__main__":
     panflute.run_filter(_process_toc_filter,